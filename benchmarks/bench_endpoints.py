@@ -0,0 +1,236 @@
+"""Нагрузочный бенчмарк эндпоинтов submitData без внешних сервисов.
+
+Заполняет временную БД командой seed_perevals (--passes перевалов по
+--images изображений) и для каждого сценария и уровня параллельности
+--concurrency гоняет запросы из потоков прямо в WSGIHandler - весь
+стек Django и DRF без сетевого сервера:
+- submit - POST /api/submitData/ с изображениями base64;
+- detail - GET /api/submitData/<id>/;
+- update - PATCH /api/submitData/<id>/ перевала в статусе new (новое название);
+- by_email - GET /api/submitData/?user__email=...
+
+Выводит пропускную способность и p50/p95/p99, --output сохраняет
+результат в JSON, --baseline сравнивает с сохраненным ранее и
+завершается с кодом 1, если rps упал или p95 вырос больше --tolerance
+процентов.
+
+    python -m benchmarks.bench_endpoints --passes 10000 --concurrency 1 8 32 --output bench.json
+    python -m benchmarks.bench_endpoints --passes 10000 --concurrency 1 8 32 --baseline bench.json
+
+Работает на БД из настроек: PostgreSQL (тестовая база рядом с рабочей)
+или SQLite - в файле, чтобы потоки видели одни данные; --keepdb
+оставляет заполненную базу для следующих запусков. Потоки делят GIL,
+поэтому цифры сравнимы между запусками на одной машине, а не с
+gunicorn под нагрузкой - для него есть benchmarks.loadgen.
+"""
+import argparse
+import base64
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import setup, test_database, summary
+
+setup()
+
+import django  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+from PIL import Image as PILImage  # noqa: E402
+from pereval.models import User, PerevalAdded  # noqa: E402
+
+SCENARIOS = ('submit', 'detail', 'update', 'by_email')
+
+
+def jpeg_data_uri(seed_value):
+    output = io.BytesIO()
+    PILImage.new('RGB', (64, 48), (seed_value % 256, seed_value // 256 % 256, 120)).save(output, 'JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+class Scenarios:
+    """Запросы сценариев: (метод, путь, тело JSON) по генератору потока"""
+
+    def __init__(self, images):
+        self.images = images
+        self.ids = list(PerevalAdded.objects.values_list('id', flat=True))
+        # Редактировать можно только новые перевалы
+        self.new_ids = list(PerevalAdded.objects.filter(status='new').values_list('id', flat=True))
+        self.emails = list(User.objects.values_list('email', flat=True))
+        self.counter = itertools.count()
+
+    def submit(self, rnd):
+        index = next(self.counter)
+        return 'POST', '/api/submitData/', {
+            'beauty_title': 'пер.',
+            'title': f'Новый перевал {index}',
+            'other_titles': '',
+            'connect': '',
+            'user': {'email': rnd.choice(self.emails), 'fam': 'Бенч', 'name': 'Марк', 'otc': '', 'phone': '0'},
+            'coords': {'latitude': rnd.uniform(42.5, 43.5), 'longitude': rnd.uniform(41.0, 45.0), 'height': 3000},
+            'level': {'winter': '', 'summer': '1A', 'autumn': '', 'spring': ''},
+            'images': [{'title': f'Фото {i}', 'data': jpeg_data_uri(index * 16 + i)} for i in range(self.images)],
+        }
+
+    def detail(self, rnd):
+        return 'GET', f'/api/submitData/{rnd.choice(self.ids)}/', None
+
+    def update(self, rnd):
+        return 'PATCH', f'/api/submitData/{rnd.choice(self.new_ids)}/', {'title': f'Перевал {next(self.counter)}'}
+
+    def by_email(self, rnd):
+        return 'GET', f'/api/submitData/?user__email={rnd.choice(self.emails)}', None
+
+
+def environ_for(factory, method, path, body):
+    if body is None:
+        return factory.generic(method, path, HTTP_HOST='localhost').environ
+    return factory.generic(
+        method, path, json.dumps(body), content_type='application/json', HTTP_HOST='localhost'
+    ).environ
+
+
+def worker(handler, scenario, rnd, deadline, timings, errors):
+    factory = RequestFactory()
+    try:
+        while time.perf_counter() < deadline:
+            environ = environ_for(factory, *scenario(rnd))
+            codes = []
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers, exc_info=None: codes.append(int(status[:3])))
+            b''.join(response)
+            response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            if codes[0] >= 400:
+                errors.append(codes[0])
+            else:
+                timings.append(elapsed)
+    finally:
+        connections.close_all()
+
+
+def run_level(handler, scenario, concurrency, duration, seed_value):
+    timings, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=worker, args=(handler, scenario, random.Random(seed_value + i), deadline, timings, errors)
+        )
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    result = {
+        'concurrency': concurrency,
+        'requests': len(timings),
+        'errors': len(errors),
+        'rps': round(len(timings) / elapsed, 1),
+    }
+    if timings:
+        result.update(summary(timings))
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Строки сравнения с базовым прогоном и признак регрессии"""
+    lines, regressed = [], False
+    for name, levels in results['scenarios'].items():
+        previous = {level['concurrency']: level for level in baseline.get('scenarios', {}).get(name, [])}
+        for level in levels:
+            old = previous.get(level['concurrency'])
+            if old is None or not old.get('rps') or 'p95_ms' not in old or 'p95_ms' not in level:
+                continue
+            rps_delta = 100 * (level['rps'] / old['rps'] - 1)
+            p95_delta = 100 * (level['p95_ms'] / old['p95_ms'] - 1)
+            worse = rps_delta < -tolerance or p95_delta > tolerance
+            regressed = regressed or worse
+            lines.append(
+                f"{name} c={level['concurrency']}: rps {old['rps']} -> {level['rps']} ({rps_delta:+.1f}%), "
+                f"p95 {old['p95_ms']} -> {level['p95_ms']} мс ({p95_delta:+.1f}%)"
+                + (' РЕГРЕССИЯ' if worse else '')
+            )
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--passes', type=int, default=10000)
+    parser.add_argument('--images', type=int, default=3, help='Изображений у перевала (и в каждом POST)')
+    parser.add_argument('--scenario', choices=SCENARIOS, nargs='+', default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10.0, help='Длительность каждого уровня, секунды')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Прогрев сценария перед замерами, секунды')
+    parser.add_argument('--output', help='Файл для результатов в JSON')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='Допустимое ухудшение, проценты')
+    parser.add_argument('--keepdb', action='store_true')
+    args = parser.parse_args()
+
+    if connection.vendor == 'sqlite':
+        # Потоки открывают свои подключения: база в памяти у каждого была бы своя. BEGIN IMMEDIATE
+        # ставит пишущие транзакции в очередь, а не отказывает им при переходе от чтения к записи
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), 'pereval_bench.sqlite3')
+        connection.settings_dict['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+    with test_database(keepdb=args.keepdb), \
+            override_settings(DEBUG=False, ALLOWED_HOSTS=['*'], MEDIA_ROOT=tempfile.mkdtemp()):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=WAL')
+        if not PerevalAdded.objects.exists():
+            call_command(
+                'seed_perevals', count=args.passes, images_per=args.images, skip_tiles=True, stdout=sys.stderr
+            )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        scenarios = Scenarios(args.images)
+        handler = WSGIHandler()
+        results = {
+            'meta': {
+                'database': connection.vendor,
+                'passes': len(scenarios.ids),
+                'images': args.images,
+                'duration': args.duration,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'scenarios': {},
+        }
+        for name in args.scenario:
+            scenario = getattr(scenarios, name)
+            run_level(handler, scenario, 1, args.warmup, seed_value=0)
+            results['scenarios'][name] = [
+                run_level(handler, scenario, concurrency, args.duration, seed_value=concurrency * 1000)
+                for concurrency in args.concurrency
+            ]
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            lines, regressed = compare(results, json.load(f), args.tolerance)
+        print('\n'.join(lines))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Бенчмарк геопоиска: область карты и k ближайших на N перевалах.
+
+Сравнивает поиск по индексу geohash с полным сканированием
+(фильтр только по широте/долготе без индекса и сортировка по расстоянию в БД).
+
+    python -m benchmarks.bench_geo --count 1000000
+"""
+import argparse
+import json
+import random
+
+from benchmarks.common import setup, test_database, measure, summary
+
+setup()
+
+from django.db.models import F  # noqa: E402
+from pereval.data_manager import PerevalManager  # noqa: E402
+from pereval.geo import geohash_encode  # noqa: E402
+from pereval.models import User, Coords, Level, PerevalAdded  # noqa: E402
+
+
+def seed(count, chunk=10000, seed_value=1):
+    rnd = random.Random(seed_value)
+    user = User.objects.create(email='bench@example.com', fam='Бенч', name='Марк', phone='0')
+    for start in range(0, count, chunk):
+        size = min(chunk, count - start)
+        points = [(rnd.uniform(-60, 75), rnd.uniform(-180, 180)) for _ in range(size)]
+        coords = Coords.objects.bulk_create([
+            Coords(latitude=lat, longitude=lon, height=rnd.randint(500, 6000), geohash=geohash_encode(lat, lon))
+            for lat, lon in points
+        ])
+        levels = Level.objects.bulk_create([Level(summer='1A') for _ in range(size)])
+        PerevalAdded.objects.bulk_create([
+            PerevalAdded(beauty_title='пер.', title=f'Перевал {start + i}', user=user, coords=c, level=lv)
+            for i, (c, lv) in enumerate(zip(coords, levels))
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--keepdb', action='store_true')
+    args = parser.parse_args()
+
+    with test_database(keepdb=args.keepdb) as connection:
+        if not PerevalAdded.objects.exists():
+            seed(args.count)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        manager = PerevalManager()
+        rnd = random.Random(2)
+        viewports = [(lat, lon, lat + 0.5, lon + 0.8)
+                     for lat, lon in ((rnd.uniform(-50, 70), rnd.uniform(-170, 170)) for _ in range(args.repeat))]
+        points = [(rnd.uniform(-50, 70), rnd.uniform(-170, 170)) for _ in range(args.repeat)]
+        viewport_iter, point_iter = iter(viewports * 2), iter(points * 2)
+
+        def bbox_indexed():
+            manager.search_bbox(*next(viewport_iter))
+
+        def bbox_full_scan():
+            min_lat, min_lon, max_lat, max_lon = next(viewport_iter)
+            list(PerevalAdded.objects.filter(
+                coords__latitude__range=(min_lat, max_lat),
+                coords__longitude__range=(min_lon, max_lon),
+            ).select_related('coords')[:1000])
+
+        def nearest_indexed():
+            manager.search_nearest(*next(point_iter), k=10)
+
+        def nearest_full_scan():
+            lat, lon = next(point_iter)
+            list(PerevalAdded.objects.select_related('coords').order_by(
+                (F('coords__latitude') - lat) ** 2 + (F('coords__longitude') - lon) ** 2
+            )[:10])
+
+        results = {
+            'count': PerevalAdded.objects.count(),
+            'vendor': connection.vendor,
+            'bbox_geohash': summary(measure(bbox_indexed, args.repeat)),
+            'bbox_full_scan': summary(measure(bbox_full_scan, args.repeat)),
+            'nearest_geohash': summary(measure(nearest_indexed, args.repeat)),
+            'nearest_full_scan': summary(measure(nearest_full_scan, args.repeat)),
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
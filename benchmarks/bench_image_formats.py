@@ -0,0 +1,109 @@
+"""Бенчмарк форматов изображений: объем хранилища и исходящего трафика.
+
+Пересжимает корпус изображений (каталог --corpus или синтетические
+"фотографии" и скриншоты) в JPEG, WebP и AVIF (если поддерживается)
+на нескольких уровнях качества и сравнивает с исходными файлами:
+- storage - полноразмерный файл плюс копии всех размеров;
+- egress - типичный просмотр: thumb в списке и large в карточке.
+
+    python -m benchmarks.bench_image_formats --corpus ./photos --quality 90 80 70 60
+"""
+import argparse
+import io
+import json
+import os
+import random
+
+from benchmarks.common import setup
+
+setup()
+
+from django.conf import settings  # noqa: E402
+from PIL import Image as PILImage, ImageFilter  # noqa: E402
+from pereval.processing import modern_formats  # noqa: E402
+
+
+def synthetic_corpus(count, seed_value=1):
+    """Фотографии (шум с размытием) 4000x3000 и PNG-скриншоты 1170x2532"""
+    rnd = random.Random(seed_value)
+    corpus = []
+    for i in range(count):
+        if i % 3 == 2:
+            picture = PILImage.new('RGB', (1170, 2532), (245, 245, 245))
+            for row in range(0, 2532, 120):
+                picture.paste((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)), (40, row, 1130, row + 80))
+            output = io.BytesIO()
+            picture.save(output, 'PNG')
+        else:
+            noise = PILImage.effect_noise((4000, 3000), 60).convert('RGB')
+            picture = PILImage.blend(noise.filter(ImageFilter.GaussianBlur(3)), PILImage.new('RGB', noise.size, (90, 120, 160)), 0.5)
+            output = io.BytesIO()
+            picture.save(output, 'JPEG', quality=95)
+        corpus.append((f'synthetic_{i}', output.getvalue()))
+    return corpus
+
+
+def file_corpus(path):
+    return [
+        (name, open(os.path.join(path, name), 'rb').read())
+        for name in sorted(os.listdir(path))
+        if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png', '.webp')
+    ]
+
+
+def encoded_size(picture, image_format, quality):
+    output = io.BytesIO()
+    if image_format == 'jpeg' and picture.mode != 'RGB':
+        picture = picture.convert('RGB')
+    picture.save(output, image_format.upper(), quality=quality)
+    return output.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='Каталог с изображениями (по умолчанию синтетический корпус)')
+    parser.add_argument('--count', type=int, default=6, help='Размер синтетического корпуса')
+    parser.add_argument('--quality', type=int, nargs='+', default=[90, 80, 70, 60])
+    args = parser.parse_args()
+
+    corpus = file_corpus(args.corpus) if args.corpus else synthetic_corpus(args.count)
+    sizes = settings.PEREVAL_IMAGE_SIZES
+    formats = ['jpeg', *modern_formats()]
+
+    original = {'storage': sum(len(content) for _, content in corpus), 'egress': 0}
+    totals = {(fmt, q): {'storage': 0, 'egress': 0} for fmt in formats for q in args.quality}
+    for _, content in corpus:
+        with PILImage.open(io.BytesIO(content)) as picture:
+            picture.load()
+            # Без уменьшенных копий клиент получает исходный файл и в списке, и в карточке
+            original['egress'] += 2 * len(content)
+            resized = {}
+            for size, max_side in sizes.items():
+                copy = picture.copy()
+                copy.thumbnail((max_side, max_side))
+                resized[size] = copy
+            for fmt in formats:
+                for q in args.quality:
+                    variant_sizes = {size: encoded_size(copy, fmt, q) for size, copy in resized.items()}
+                    totals[fmt, q]['storage'] += encoded_size(picture, fmt, q) + sum(variant_sizes.values())
+                    totals[fmt, q]['egress'] += variant_sizes.get('thumb', 0) + variant_sizes.get('large', 0)
+
+    results = {
+        'images': len(corpus),
+        'original_mb': {key: round(value / 2 ** 20, 2) for key, value in original.items()},
+        'formats': [
+            {
+                'format': fmt,
+                'quality': q,
+                'storage_mb': round(total['storage'] / 2 ** 20, 2),
+                'egress_mb': round(total['egress'] / 2 ** 20, 2),
+                'egress_saving_pct': round(100 * (1 - total['egress'] / original['egress']), 1),
+            }
+            for (fmt, q), total in totals.items()
+        ],
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
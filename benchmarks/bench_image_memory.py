@@ -0,0 +1,79 @@
+"""Бенчмарк памяти при приеме изображений в base64.
+
+Сравнивает пик выделенной памяти (tracemalloc) у прежнего способа
+(split + b64decode + ContentFile целиком в памяти) и потокового
+декодирования во временный файл. Сама base64-строка в обоих случаях
+уже находится в памяти и в замер не входит.
+
+    python -m benchmarks.bench_image_memory --count 10 --size-mb 8
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import tracemalloc
+
+from PIL import Image as PILImage
+
+from benchmarks.common import setup
+
+setup()
+
+from django.core.files.base import ContentFile  # noqa: E402
+from pereval.images import decode_base64_image  # noqa: E402
+
+
+def decode_in_memory(data):
+    header, encoded = data.split(';base64,')
+    ext = header.split('/')[-1]
+    return ContentFile(base64.b64decode(encoded), name=f'upload.{ext}')
+
+
+def image_bytes(size):
+    """Заголовок настоящего JPEG и случайный хвост: формат определяется по началу файла"""
+    output = io.BytesIO()
+    PILImage.new('RGB', (8, 8)).save(output, 'JPEG')
+    return output.getvalue() + os.urandom(size)
+
+
+def decode_streaming(data):
+    return decode_base64_image(data, max_size=len(data))[1]
+
+
+def peak_bytes(decode, images):
+    tracemalloc.start()
+    files = []
+    try:
+        # Все файлы держатся до конца запроса, как в submit_pereval
+        for data in images:
+            files.append(decode(data))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        for file in files:
+            file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--size-mb', type=float, default=8)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    images = [
+        'data:image/jpeg;base64,' + base64.b64encode(image_bytes(size)).decode()
+        for _ in range(args.count)
+    ]
+    results = {
+        'images': args.count,
+        'image_mb': args.size_mb,
+        'in_memory_peak_mb': round(peak_bytes(decode_in_memory, images) / 2 ** 20, 1),
+        'streaming_peak_mb': round(peak_bytes(decode_streaming, images) / 2 ** 20, 1),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Накладные расходы RequestMetricsMiddleware на горячем GET карточки.
+
+Карточка отдается из кэша, поэтому время запроса минимально и доля
+метрик в нем наибольшая. Запросы идут напрямую в WSGIHandler (без
+тестового клиента и его сигналов), с метриками и без - по очереди через
+один запрос, чтобы колебания фона машины одинаково влияли на оба варианта.
+
+    python -m benchmarks.bench_metrics_overhead --requests 20000
+"""
+import argparse
+import json
+import statistics
+
+from benchmarks.common import setup, test_database, measure
+
+setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+from pereval.models import User, Coords, Level, PerevalAdded  # noqa: E402
+
+METRICS_MIDDLEWARE = 'pereval.metrics.RequestMetricsMiddleware'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20000, help='Запросов на каждый вариант')
+    parser.add_argument('--warmup', type=int, default=1000)
+    args = parser.parse_args()
+
+    with test_database():
+        user = User.objects.create(email='bench@example.com', fam='Бенч', name='Марк', phone='0')
+        pereval = PerevalAdded.objects.create(
+            beauty_title='пер.', title='Перевал', user=user,
+            coords=Coords.objects.create(latitude=45, longitude=7, height=1200), level=Level.objects.create()
+        )
+        environ = RequestFactory()._base_environ(
+            PATH_INFO=f'/api/submitData/{pereval.id}/', REQUEST_METHOD='GET', HTTP_HOST='localhost'
+        )
+
+        def start_response(status, headers):
+            assert status.startswith('200'), status
+
+        # Метрики по умолчанию выключены: middleware удаляется из цепочки сам
+        with override_settings(PEREVAL_METRICS=True):
+            with_metrics = WSGIHandler()
+        with override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != METRICS_MIDDLEWARE]):
+            without_metrics = WSGIHandler()
+
+        def request(handler):
+            response = handler(dict(environ), start_response)
+            b''.join(response)
+            response.close()
+
+        timings = {'with_metrics': [], 'without_metrics': []}
+        handlers = [('without_metrics', without_metrics), ('with_metrics', with_metrics)]
+        for _ in range(args.warmup):
+            for _, handler in handlers:
+                request(handler)
+        for _ in range(args.requests):
+            # Порядок меняется каждую пару: второй не выигрывает на прогретых кэшах
+            handlers.reverse()
+            for name, handler in handlers:
+                timings[name].extend(measure(lambda: request(handler), 1))
+
+    p50 = {name: statistics.median(values) for name, values in timings.items()}
+    results = {
+        'requests': args.requests,
+        'p50_ms': {name: round(value, 4) for name, value in p50.items()},
+        'overhead_us': round(1000 * (p50['with_metrics'] - p50['without_metrics']), 1),
+        'overhead_pct': round(100 * (p50['with_metrics'] / p50['without_metrics'] - 1), 2),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Микробенчмарк сериализации страницы перевалов: 1000 проходов.
+
+Сравнивает сборку страницы (--page перевалов с изображениями и копиями):
+- instances - экземпляры моделей через select_related/prefetch_related
+  и сборка словарей по атрибутам (прежний способ);
+- values - строки .values() и общий сериализатор pereval.serializers;
+и рендеринг готовой страницы в JSON: JSONRenderer DRF против FastJSONRenderer.
+
+    python -m benchmarks.bench_serialization --passes 1000 --page 20
+"""
+import argparse
+import json
+
+from benchmarks.common import setup, test_database, measure, summary
+
+setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from pereval.models import User, Coords, Level, PerevalAdded, Image, ImageVariant, PerevalImage  # noqa: E402
+from pereval.renderers import FastJSONRenderer, orjson  # noqa: E402
+from pereval.serializers import DETAIL  # noqa: E402
+
+
+def seed(count, images):
+    user = User.objects.create(email='bench@example.com', fam='Бенч', name='Марк', phone='0')
+    for i in range(count):
+        pereval = PerevalAdded.objects.create(
+            beauty_title='пер.', title=f'Перевал {i}', other_titles='Тест', connect='соединяет долины', user=user,
+            coords=Coords.objects.create(latitude=45 + i / 100, longitude=7.0, height=1200),
+            level=Level.objects.create(winter='1A', summer='1B', autumn='', spring='')
+        )
+        for j in range(images):
+            image = Image.objects.create(title=f'Фото {j}', data=f'pereval_images/blobs/{i}_{j}.webp')
+            PerevalImage.objects.create(pereval=pereval, image=image)
+            ImageVariant.objects.bulk_create([
+                ImageVariant(image=image, size=size, format=fmt, file=f'pereval_images/variants/{i}_{j}_{size}.{fmt}',
+                             width=1, height=1)
+                for size in ('thumb', 'medium', 'large') for fmt in ('webp', 'jpeg')
+            ])
+
+
+def instances_page(limit):
+    """Прежний способ: экземпляры моделей и словари по атрибутам"""
+    page = (
+        PerevalAdded.objects
+        .select_related('user', 'coords', 'level')
+        .prefetch_related('images__variants')
+        .order_by('-add_time', '-id')[:limit]
+    )
+    results = []
+    for pereval in page:
+        images = []
+        for img in pereval.images.all():
+            sizes = {}
+            for variant in img.variants.all():
+                sizes.setdefault(variant.size, {})[variant.format] = variant.file.url
+            images.append({
+                'title': img.title,
+                'data': img.data.url if img.data else None,
+                'processing_status': img.processing_status,
+                'sizes': sizes,
+            })
+        results.append({
+            'id': pereval.id, 'beauty_title': pereval.beauty_title, 'title': pereval.title,
+            'other_titles': pereval.other_titles, 'connect': pereval.connect, 'add_time': pereval.add_time,
+            'updated_at': pereval.updated_at, 'status': pereval.status,
+            'user': {field: getattr(pereval.user, field) for field in ('email', 'fam', 'name', 'otc', 'phone')},
+            'coords': {field: getattr(pereval.coords, field) for field in ('latitude', 'longitude', 'height')},
+            'level': {field: getattr(pereval.level, field) for field in ('winter', 'summer', 'autumn', 'spring')},
+            'images': images,
+        })
+    return results
+
+
+def values_page(limit):
+    return DETAIL.serialize(PerevalAdded.objects.order_by('-add_time', '-id').values(*DETAIL.columns)[:limit])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--passes', type=int, default=1000)
+    parser.add_argument('--page', type=int, default=20, help='Перевалов на странице')
+    parser.add_argument('--images', type=int, default=3, help='Изображений у перевала')
+    args = parser.parse_args()
+
+    with test_database():
+        seed(args.page, args.images)
+        page = {'status': 200, 'message': None, 'perevals': values_page(args.page), 'next_cursor': None}
+        drf, fast = JSONRenderer(), FastJSONRenderer()
+        assert drf.render(page) == fast.render(page)
+
+        cases = {
+            'build_instances': lambda: instances_page(args.page),
+            'build_values': lambda: values_page(args.page),
+            'render_drf': lambda: drf.render(page),
+            'render_fast': lambda: fast.render(page),
+        }
+        results = {
+            'passes': args.passes,
+            'page': args.page,
+            'orjson': orjson is not None,
+            'response_bytes': len(fast.render(page)),
+        }
+        for name, func in cases.items():
+            timings = measure(func, args.passes)
+            results[name] = {'total_ms': round(sum(timings), 1), **summary(timings)}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Бенчмарк записи: SQL-запросы и фиксации транзакций на один вызов.
+
+Считает запросы, фиксации (каждый запрос вне транзакции в режиме
+autocommit фиксируется отдельно) и время для submit_pereval с N
+изображениями и для update_pereval (одно поле, координаты, без изменений).
+Для сравнения "до/после" запустите на двух ревизиях.
+
+    python -m benchmarks.bench_write_path --images 1 5 --repeat 30
+"""
+import argparse
+import base64
+import io
+import json
+
+from benchmarks.common import setup, test_database, measure, summary
+
+setup()
+
+from PIL import Image as PILImage  # noqa: E402
+from pereval.data_manager import PerevalManager  # noqa: E402
+
+
+class StatementCounter:
+    """execute_wrapper: число запросов и фиксаций транзакций"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = 0
+        self.autocommitted = 0
+        self.transactions = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.strip().upper() != 'BEGIN':
+            self.statements += 1
+            if not self.connection.in_atomic_block:
+                self.autocommitted += 1
+            elif not any(block is self.connection.atomic_blocks[0] for block in self.transactions):
+                self.transactions.append(self.connection.atomic_blocks[0])
+        return execute(sql, params, many, context)
+
+    @property
+    def commits(self):
+        return self.autocommitted + len(self.transactions)
+
+
+def jpeg_data_uri(seed_value):
+    output = io.BytesIO()
+    PILImage.new('RGB', (64, 48), (seed_value % 256, seed_value // 256 % 256, 120)).save(output, 'JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+def pereval_data(index, images):
+    return {
+        'beauty_title': 'пер.',
+        'title': f'Перевал {index}',
+        'other_titles': '',
+        'connect': '',
+        'user': {'email': f'bench{index % 10}@example.com', 'fam': 'Бенч', 'name': 'Марк', 'otc': '', 'phone': '0'},
+        'coords': {'latitude': 45 + index / 1000, 'longitude': 7.0, 'height': 1200},
+        'level': {'winter': '', 'summer': '1A', 'autumn': '', 'spring': ''},
+        'images': [{'title': f'Фото {i}', 'data': jpeg_data_uri(index * 16 + i)} for i in range(images)],
+    }
+
+
+def counted(connection, func):
+    counter = StatementCounter(connection)
+    with connection.execute_wrapper(counter):
+        func()
+    return {'statements': counter.statements, 'commits': counter.commits}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    manager = PerevalManager()
+    results = {}
+    with test_database() as connection:
+        index = iter(range(10 ** 6))
+        for images in args.images:
+            payloads = [pereval_data(next(index), images) for _ in range(args.repeat + 1)]
+            payload_iter = iter(payloads)
+            results[f'submit_{images}_images'] = {
+                **counted(connection, lambda: manager.submit_pereval(next(payload_iter))),
+                **summary(measure(lambda: manager.submit_pereval(next(payload_iter)), args.repeat)),
+            }
+
+        pereval_id = manager.submit_pereval(pereval_data(next(index), 1))['id']
+        updates = {
+            'update_title': lambda i: {'title': f'Новое название {i}'},
+            'update_coords': lambda i: {'coords': {'latitude': 46 + i / 1000}},
+            'update_noop': lambda i: {'title': 'Без изменений'},
+        }
+        manager.update_pereval(pereval_id, {'title': 'Без изменений'})
+        for name, make_data in updates.items():
+            counter = iter(range(10 ** 6))
+            results[name] = {
+                **counted(connection, lambda: manager.update_pereval(pereval_id, make_data(next(counter)))),
+                **summary(measure(lambda: manager.update_pereval(pereval_id, make_data(next(counter))), args.repeat)),
+            }
+            if name != 'update_noop':
+                manager.update_pereval(pereval_id, {'title': 'Без изменений'})
+
+        results['vendor'] = connection.vendor
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
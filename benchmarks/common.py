@@ -0,0 +1,57 @@
+"""Общие утилиты бенчмарков.
+
+Бенчмарки запускаются из корня проекта, например:
+    python -m benchmarks.bench_geo --count 1000000
+
+Данные создаются во временной тестовой БД (как у manage.py test),
+рабочая база не затрагивается.
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'transit_point.settings')
+    django.setup()
+
+
+@contextmanager
+def test_database(keepdb=False):
+    """Временная тестовая БД на время бенчмарка"""
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def measure(func, repeat):
+    """Время выполнения func в миллисекундах: список замеров"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summary(timings):
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+    }
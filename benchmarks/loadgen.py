@@ -0,0 +1,104 @@
+"""Нагрузочный тест чтения: WSGI (gunicorn) против ASGI (uvicorn, async-представления).
+
+Запустите оба варианта сервиса и передайте их адреса:
+    docker compose up -d web && docker compose --profile asgi up -d web-asgi
+    python -m benchmarks.loadgen --target wsgi=http://localhost:8000 --target asgi=http://localhost:8001 \\
+        --path /api/submitData/1/ --path "/api/submitData/?user__email=user@example.com" \\
+        --concurrency 10 50 200 --duration 20 --client-kbps 64
+
+Каждый виртуальный клиент в цикле выполняет GET по очереди путей.
+--client-kbps ограничивает скорость чтения ответа (мобильная сеть):
+медленный клиент держит синхронный воркер все время ответа. Для каждой
+цели и уровня параллельности выводятся пропускная способность,
+перцентили задержки и число ошибок.
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.common import summary
+
+READ_CHUNK_SIZE = 4096
+
+
+async def fetch(host, port, path, client_kbps, timeout):
+    """Один GET на новом соединении: код ответа и время до последнего байта тела (мс)"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\nConnection: close\r\n\r\n'.encode()
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        while True:
+            chunk = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE), timeout)
+            if not chunk:
+                break
+            if client_kbps:
+                await asyncio.sleep(len(chunk) / (client_kbps * 1024 / 8))
+    finally:
+        writer.close()
+    return int(status_line.split()[1]), (time.perf_counter() - started) * 1000
+
+
+async def client(target, paths, deadline, client_kbps, timeout, timings, errors):
+    parts = urlsplit(target)
+    index = 0
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        try:
+            code, elapsed = await fetch(parts.hostname, parts.port or 80, path, client_kbps, timeout)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            errors.append('connection')
+            continue
+        if code >= 400:
+            errors.append(code)
+        else:
+            timings.append(elapsed)
+
+
+async def run_level(target, paths, concurrency, duration, client_kbps, timeout):
+    timings, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        client(target, paths, deadline, client_kbps, timeout, timings, errors) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+    result = {
+        'concurrency': concurrency,
+        'requests': len(timings),
+        'errors': len(errors),
+        'rps': round(len(timings) / elapsed, 1),
+    }
+    if timings:
+        result.update(summary(timings))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='имя=адрес сервиса, можно несколько')
+    parser.add_argument('--path', action='append', required=True, help='Путь запроса, можно несколько')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--duration', type=float, default=20.0, help='Длительность каждого уровня, секунды')
+    parser.add_argument('--client-kbps', type=float, default=0, help='Скорость чтения ответа клиентом, кбит/с')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.target:
+        name, _, url = target.partition('=')
+        results[name] = [
+            asyncio.run(run_level(url, args.path, concurrency, args.duration, args.client_kbps, args.timeout))
+            for concurrency in args.concurrency
+        ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class PerevalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pereval'
+
+    def ready(self):
+        from . import signals, processing  # noqa: F401
@@ -0,0 +1,110 @@
+"""Async-представления чтения для ASGI (PEREVAL_ASYNC_VIEWS=1).
+
+Под ASGI синхронное представление выполняется в общем потоке через
+sync_to_async, и медленный клиент занимает его на все время ответа.
+Здесь GET карточки перевала и списка по email работают на async ORM:
+пока ждут БД или клиента, воркер обслуживает другие запросы. Ответы
+совпадают с синхронными APIView байт в байт (тот же рендерер DRF),
+остальные методы передаются синхронным APIView.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.settings import api_settings
+
+from .data_manager import PerevalManager
+from .images import accepted_formats
+from .views import (
+    is_conditional, negotiate_result, not_modified, page_params, versions_etag, with_validators,
+)
+
+manager = PerevalManager()
+
+
+def render(data):
+    return api_settings.DEFAULT_RENDERER_CLASSES[0]().render(data)
+
+
+def json_response(request, result):
+    response = HttpResponse(
+        render(negotiate_result(request, result)),
+        status=result['status'],
+        content_type='application/json'
+    )
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def bad_request(message):
+    return HttpResponse(
+        render({'status': 400, 'message': message}), status=400, content_type='application/json'
+    )
+
+
+async def pereval_detail(request, pk):
+    """Async-вариант SubmitDataDetailAPI.get"""
+    accepted = accepted_formats(request.headers.get('Accept'))
+    if is_conditional(request):
+        updated_at = await manager.aget_pereval_updated_at(pk)
+        if updated_at is not None:
+            response = not_modified(request, versions_etag([(pk, updated_at)], *accepted), updated_at)
+            if response is not None:
+                return response
+
+    result = await manager.aget_pereval_by_id(pk)
+    response = json_response(request, result)
+    if result['status'] == 200:
+        etag = versions_etag([(pk, result['updated_at'])], *accepted)
+        with_validators(response, etag, result['updated_at'])
+    return response
+
+
+async def perevals_by_email(request):
+    """Async-вариант SubmitDataListAPI.get"""
+    email = request.GET.get('user__email')
+    if not email:
+        return bad_request('Email не указан')
+    try:
+        cursor, limit = page_params(request)
+    except ValueError:
+        return bad_request('Параметр limit должен быть числом')
+
+    accepted = accepted_formats(request.headers.get('Accept'))
+    if is_conditional(request):
+        try:
+            versions, next_cursor = await manager.aget_perevals_by_email_versions(email, cursor, limit)
+        except ValidationError:
+            versions = None
+        if versions:
+            etag = versions_etag(versions, next_cursor, *accepted)
+            response = not_modified(request, etag, max(updated_at for _, updated_at in versions))
+            if response is not None:
+                return response
+
+    result = await manager.aget_perevals_by_email(email, cursor, limit)
+    response = json_response(request, result)
+    if result['status'] == 200 and result['perevals']:
+        versions = [(pereval['id'], pereval['updated_at']) for pereval in result['perevals']]
+        etag = versions_etag(versions, result['next_cursor'], *accepted)
+        with_validators(response, etag, max(updated_at for _, updated_at in versions))
+    return response
+
+
+def async_read_view(read_view, api_view):
+    """Представление, где GET/HEAD async, а остальные методы - синхронный APIView.
+
+    Атрибуты cls/initkwargs оставляют эндпоинт в схеме Swagger.
+    """
+    sync_view = sync_to_async(api_view.as_view())
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await read_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+
+    view.cls = api_view
+    view.initkwargs = {}
+    return view
@@ -0,0 +1,129 @@
+import hashlib
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import ImageBlob
+from .storage import image_storage
+
+# Каталог содержимого: pereval_images/blobs/<sha256>.<ext>, раскладку по подкаталогам делает хранилище
+BLOB_DIR = 'pereval_images/blobs'
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def file_sha256(file):
+    """SHA-256 файла чтением порциями, без загрузки в память целиком"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(sha256, ext):
+    return image_storage().generate_filename(f'{BLOB_DIR}/{sha256}.{ext}')
+
+
+def store(file, ext):
+    return store_many([(file, ext)])[0]
+
+
+def store_many(files):
+    """Ссылки на содержимое файлов [(file, ext), ...]: запись на диск только для новых хешей.
+
+    Увеличивает ref_count найденных и созданных blob. Повторная загрузка
+    той же фотографии не пишет ни байта в хранилище. Число запросов не
+    зависит от числа файлов.
+    """
+    return link(write_files(files))
+
+
+def write_files(files):
+    """Первая половина store_many: хеши и запись на диск содержимого, которого еще нет.
+
+    Вызывается до открытия транзакции, чтобы запись файлов не шла под
+    блокировками строк. Загрузка, уже обработанная раньше (есть blob с
+    таким source_sha256), сразу ссылается на результат обработки и не
+    пишется: это единственный запрос к БД. Остальное проверяется по файлу
+    в хранилище. Возвращает [(sha256, имя файла, размер)] для link().
+    """
+    storage = image_storage()
+    hashed = [(file, ext, file_sha256(file)) for file, ext in files]
+    processed = {
+        blob.source_sha256: (blob.sha256, blob.file.name, blob.size)
+        for blob in ImageBlob.objects.filter(source_sha256__in={sha256 for _, _, sha256 in hashed})
+    }
+    written = {}
+    result = []
+    for file, ext, sha256 in hashed:
+        if sha256 in processed:
+            result.append(processed[sha256])
+            continue
+        if sha256 not in written:
+            name = blob_name(sha256, ext)
+            if not storage.exists(name):
+                saved = storage.save(name, file)
+                if saved != name:
+                    # Параллельная запись того же содержимого успела раньше
+                    storage.delete(saved)
+            written[sha256] = name
+        result.append((sha256, written[sha256], file.size))
+    return result
+
+
+def link(blob_files):
+    """Вторая половина store_many: строки ImageBlob и ссылки на содержимое.
+
+    Три запроса на любое число файлов и без точки сохранения внутри
+    транзакции вызывающего кода.
+    """
+    counts = Counter(sha256 for sha256, _, _ in blob_files)
+    blobs = {sha256: ImageBlob(sha256=sha256, file=name, size=size) for sha256, name, size in blob_files}
+    with transaction.atomic(savepoint=False):
+        # Уже известное содержимое (в том числе созданное параллельно) - конфликт,
+        # такие строки получают только ссылки ниже
+        ImageBlob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+
+        stored = {blob.sha256: blob for blob in ImageBlob.objects.filter(sha256__in=counts)}
+        for blob in stored.values():
+            blob.ref_count = F('ref_count') + counts[blob.sha256]
+        ImageBlob.objects.bulk_update(stored.values(), ['ref_count'])
+    return [stored[sha256] for sha256, _, _ in blob_files]
+
+
+def alias(blob, source_sha256):
+    """Отметка blob как результата обработки загрузки с хешем source_sha256"""
+    ImageBlob.objects.filter(id=blob.id).update(source_sha256=source_sha256)
+    blob.source_sha256 = source_sha256
+
+
+def discard(blob_files):
+    """Удаление файлов write_files(), которые так и не получили строку ImageBlob.
+
+    Вызывается, когда транзакция с link() откатилась. Файлы, на которые
+    ссылается строка ImageBlob (то же содержимое, загруженное раньше),
+    остаются на месте.
+    """
+    names = {name for _, name, _ in blob_files}
+    if not names:
+        return
+    linked = set(ImageBlob.objects.filter(file__in=names).values_list('file', flat=True))
+    storage = image_storage()
+    for name in names - linked:
+        storage.delete(name)
+
+
+def release(blob_id):
+    """Снятие ссылки на содержимое; последняя ссылка удаляет строку и файл.
+
+    Удаление условное (ref_count=0): ссылка, взятая между уменьшением
+    счетчика и удалением, сохраняет blob.
+    """
+    with transaction.atomic():
+        ImageBlob.objects.filter(id=blob_id).update(ref_count=F('ref_count') - 1)
+        name = ImageBlob.objects.filter(id=blob_id).values_list('file', flat=True).first()
+        deleted, _ = ImageBlob.objects.filter(id=blob_id, ref_count=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: image_storage().delete(name))
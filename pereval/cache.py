@@ -0,0 +1,103 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class PerevalCache:
+    """Read-through кэш карточек перевалов поверх Django cache framework.
+
+    Ключ карточки версионируется поколением перевала, которое хранится
+    в отдельном ключе. Инвалидация записывает новое поколение: старые
+    значения больше не читаются, даже если параллельный читатель успел
+    положить в кэш данные, прочитанные до изменения.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or settings.PEREVAL_CACHE_ALIAS
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _generation_key(pereval_id):
+        return f'pereval:{pereval_id}:generation'
+
+    @staticmethod
+    def _detail_key(pereval_id, generation):
+        return f'pereval:{settings.PEREVAL_CACHE_VERSION}:{pereval_id}:{generation}'
+
+    def _generation(self, pereval_id):
+        key = self._generation_key(pereval_id)
+        generation = self.cache.get(key)
+        if generation is None:
+            # Ключ поколения вытеснен или еще не создан: новое уникальное поколение
+            self.cache.add(key, time.time_ns(), None)
+            generation = self.cache.get(key)
+        return generation
+
+    def get(self, pereval_id, loader):
+        """Карточка перевала из кэша или из loader() с сохранением успешного результата"""
+        key = self._detail_key(pereval_id, self._generation(pereval_id))
+        result = self.cache.get(key)
+        if result is not None:
+            self._count(hit=True)
+            return result
+
+        self._count(hit=False)
+        result = loader()
+        if result['status'] == 200:
+            self.cache.set(key, result, settings.PEREVAL_CACHE_TIMEOUT)
+        return result
+
+    async def _ageneration(self, pereval_id):
+        key = self._generation_key(pereval_id)
+        generation = await self.cache.aget(key)
+        if generation is None:
+            await self.cache.aadd(key, time.time_ns(), None)
+            generation = await self.cache.aget(key)
+        return generation
+
+    async def aget(self, pereval_id, loader):
+        """Async-вариант get: loader - корутинная функция"""
+        key = self._detail_key(pereval_id, await self._ageneration(pereval_id))
+        result = await self.cache.aget(key)
+        if result is not None:
+            self._count(hit=True)
+            return result
+
+        self._count(hit=False)
+        result = await loader()
+        if result['status'] == 200:
+            await self.cache.aset(key, result, settings.PEREVAL_CACHE_TIMEOUT)
+        return result
+
+    def invalidate(self, pereval_id):
+        self.cache.set(self._generation_key(pereval_id), time.time_ns(), None)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Счетчики попаданий и промахов текущего процесса"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': self.cache.__class__.__name__,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None,
+        }
+
+
+pereval_cache = PerevalCache()
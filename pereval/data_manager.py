@@ -1,8 +1,27 @@
 import os
+import math
 import base64
+import binascii
+from datetime import datetime
+from django.conf import settings
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
-from django.core.files.base import ContentFile
-from .models import User, Coords, Level, PerevalAdded, Image, PerevalImage
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Abs, Least
+from django.utils import timezone
+from .models import User, Coords, Level, PerevalAdded, Image, PerevalImage, PerevalTombstone, UploadSession
+from . import blobs, tiles, uploads
+from .processing import enqueue_images, image_for_blob
+from .cache import pereval_cache
+from .images import check_request_size, decode_base64_image, sniff_extension, uploaded_image
+from .serializers import DETAIL, LIST, USER_FIELDS, COORDS_FIELDS, LEVEL_FIELDS
+from .geo import geohash_encode, cover_bbox, split_bbox, prefix_range, search_box, haversine_km
+
+# Поля, которые клиент передает в данных перевала
+MAIN_FIELDS = ('beauty_title', 'title', 'other_titles', 'connect')
+# Координаты: поле, тип и допустимый модуль значения
+COORDS_LIMITS = (('latitude', float, 90), ('longitude', float, 180), ('height', int, 10000))
 
 
 class PerevalManager:
@@ -18,7 +37,14 @@ class PerevalManager:
 
     @staticmethod
     def validate_data(data):
-        """Валидация входящих данных"""
+        """Валидация входящих данных.
+
+        Проверяются не только ключи, но и типы и значения: запись, прошедшая
+        проверку, не должна падать на вставке в БД - в пакете такая ошибка
+        откатила бы все записи. Координаты приводятся к числам на месте.
+        """
+        if not isinstance(data, dict):
+            raise ValidationError('Запись должна быть объектом')
         required_fields = [
             'beauty_title', 'title', 'other_titles', 'connect',
             'user', 'coords', 'level', 'images'
@@ -27,195 +53,948 @@ class PerevalManager:
         for field in required_fields:
             if field not in data:
                 raise ValidationError(f'Отсутствует обязательное поле: {field}')
+        for field in MAIN_FIELDS:
+            PerevalManager.check_text(PerevalAdded, field, data[field], field)
+
+        for group in ('user', 'coords', 'level'):
+            if not isinstance(data[group], dict):
+                raise ValidationError(f'Поле {group} должно быть объектом')
 
         user_fields = ['email', 'fam', 'name', 'otc', 'phone']
         for field in user_fields:
             if field not in data['user']:
                 raise ValidationError(f'Отсутствует обязательное поле пользователя: {field}')
+            PerevalManager.check_text(User, field, data['user'][field], f'user.{field}')
+        try:
+            validate_email(data['user']['email'])
+        except ValidationError:
+            raise ValidationError('Некорректное поле user.email')
 
-        coord_fields = ['latitude', 'longitude', 'height']
-        for field in coord_fields:
+        for field in COORDS_FIELDS:
             if field not in data['coords']:
                 raise ValidationError(f'Отсутствует обязательное поле координат: {field}')
+        PerevalManager.check_coords(data['coords'])
 
         level_fields = ['winter', 'summer', 'autumn', 'spring']
         for field in level_fields:
             if field not in data['level']:
                 raise ValidationError(f'Отсутствует обязательное поле уровня сложности: {field}')
+            PerevalManager.check_text(Level, field, data['level'][field], f'level.{field}')
 
         if not isinstance(data['images'], list) or len(data['images']) == 0:
             raise ValidationError('Должна быть хотя бы одна фотография')
+        for img_data in data['images']:
+            if not isinstance(img_data, dict):
+                raise ValidationError('Изображение должно быть объектом')
+            if 'id' not in img_data:
+                PerevalManager.check_text(Image, 'title', img_data.get('title'), 'images.title')
 
-    def submit_pereval(self, data):
-        """Основной метод для добавления данных о перевале"""
-        try:
-            self.validate_data(data)  # Проверяем валидность данных
+    @staticmethod
+    def validate_update(data):
+        """Валидация данных редактирования: правила validate_data, но все поля необязательны"""
+        if not isinstance(data, dict):
+            raise ValidationError('Запись должна быть объектом')
+        for group in ('user', 'coords', 'level'):
+            if group in data and not isinstance(data[group], dict):
+                raise ValidationError(f'Поле {group} должно быть объектом')
+        for field in MAIN_FIELDS:
+            if field in data:
+                PerevalManager.check_text(PerevalAdded, field, data[field], field)
+        PerevalManager.check_coords(data.get('coords', {}))
+        for field in LEVEL_FIELDS:
+            if field in data.get('level', {}):
+                PerevalManager.check_text(Level, field, data['level'][field], f'level.{field}')
 
-            # Обработка изображений
-            images_data = data.pop('images', [])
+    @staticmethod
+    def check_coords(coords):
+        """Проверка переданных координат с приведением к числам на месте"""
+        for field, kind, limit in COORDS_LIMITS:
+            if field in coords:
+                coords[field] = PerevalManager.check_number(coords[field], f'coords.{field}', kind, limit)
 
-            # Создаем пользователя
-            user_data = data.pop('user')
-            user, created = User.objects.get_or_create(
-                email=user_data['email'],
-                defaults=user_data
-            )
+    @staticmethod
+    def check_text(model, field, value, label):
+        """Строковое поле: тип, длина и null по описанию поля модели"""
+        model_field = model._meta.get_field(field)
+        if value is None:
+            if not model_field.null:
+                raise ValidationError(f'Поле {label} не может быть пустым')
+            return
+        if not isinstance(value, str):
+            raise ValidationError(f'Поле {label} должно быть строкой')
+        if model_field.max_length and len(value) > model_field.max_length:
+            raise ValidationError(f'Поле {label} длиннее {model_field.max_length} символов')
 
-            # Создаем координаты
-            coords = Coords.objects.create(**data.pop('coords'))
+    @staticmethod
+    def check_number(value, label, kind, limit):
+        """Число или числовая строка в пределах [-limit, limit], приведенное к kind"""
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValidationError(f'Поле {label} должно быть числом')
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValidationError(f'Поле {label} должно быть числом')
+        if not math.isfinite(number) or abs(number) > limit:
+            raise ValidationError(f'Поле {label} вне допустимого диапазона')
+        if kind is int:
+            if not number.is_integer():
+                raise ValidationError(f'Поле {label} должно быть целым числом')
+            return int(number)
+        return number
 
-            # Создаем уровень сложности
-            level = Level.objects.create(**data.pop('level'))
+    def submit_pereval(self, data, files=None):
+        """Основной метод для добавления данных о перевале.
 
-            # Создаем перевал
-            pereval = PerevalAdded.objects.create(
-                user=user,
-                coords=coords,
-                level=level,
-                **data
-            )
+        files - файлы multipart-запроса: изображение может ссылаться на
+        часть запроса полем file вместо base64-строки в поле data.
+        """
+        pending_files = []
+        try:
+            self.validate_data(data)  # Проверяем валидность данных
 
-            # Добавляем изображения
+            # Изображения декодируются во временные файлы до записи в БД:
+            # некорректное изображение не оставит в базе половину перевала
+            images_data = data.pop('images', [])
+            check_request_size(images_data, files)
+            used_files = set()
+            uploaded_ids = []
             for img_data in images_data:
-                img_format, img_str = img_data['data'].split(';base64,')
-                ext = img_format.split('/')[-1]
-                img_file = ContentFile(
-                    base64.b64decode(img_str),
-                    name=f"img_{pereval.id}_{img_data['title']}.{ext}"
-                )
-                image = Image.objects.create(
-                    title=img_data['title'],
-                    data=img_file
-                )
-                PerevalImage.objects.create(pereval=pereval, image=image)
+                if isinstance(img_data, dict) and 'id' in img_data:
+                    # Изображение уже загружено частями через /api/uploads/
+                    uploaded_ids.append(img_data['id'])
+                    continue
+                if isinstance(img_data, dict) and 'file' in img_data:
+                    ext, upload = self.file_image(img_data, files, used_files)
+                else:
+                    ext, upload = self.decode_image(img_data)
+                pending_files.append((img_data['title'], ext, upload))
+            # Запись - тот же путь, что у пакета из одного элемента:
+            # число запросов не зависит от числа изображений
+            pereval_id, = self._save([(0, data, pending_files)], {0: uploaded_ids})
 
-            return {'status': 200, 'message': None, 'id': pereval.id}
+            return {'status': 200, 'message': None, 'id': pereval_id}
 
         except ValidationError as e:
             return {'status': 400, 'message': str(e), 'id': None}
         except Exception as e:
             return {'status': 500, 'message': str(e), 'id': None}
+        finally:
+            for _, _, upload in pending_files:
+                upload.close()
 
+    @staticmethod
+    def decode_image(img_data):
+        """Потоковое декодирование изображения data:image/...;base64,... во временный файл"""
+        if not isinstance(img_data, dict) or 'title' not in img_data:
+            raise ValidationError('У изображения должны быть поля data и title')
+        try:
+            ext, upload = decode_base64_image(img_data.get('data'))
+        except ValidationError as e:
+            raise ValidationError(f"Некорректное изображение {img_data['title']}: {e.message}")
+        # base64-строка больше не нужна: освобождаем память до следующего изображения
+        img_data['data'] = None
+        return ext, upload
 
-    def get_pereval_by_id(self, pereval_id):
-        """Получение данных о перевале по ID"""
+    @staticmethod
+    def file_image(img_data, files, used_files):
+        """Изображение из файловой части multipart-запроса"""
+        if 'title' not in img_data:
+            raise ValidationError('У изображения должны быть поля file и title')
+        name = img_data['file']
+        if files is None or name not in files:
+            raise ValidationError(f'Файл {name} не найден в запросе')
+        if name in used_files:
+            raise ValidationError(f'Файл {name} указан несколько раз')
+        used_files.add(name)
+        upload = files[name]
         try:
-            pereval = PerevalAdded.objects.get(id=pereval_id)
+            return uploaded_image(upload), upload
+        except ValidationError as e:
+            raise ValidationError(f"Некорректное изображение {img_data['title']}: {e.message}")
+
+    @staticmethod
+    def claim_uploaded_images(image_ids):
+        """Резервирование изображений, загруженных частями, за новым перевалом.
+
+        Подходят только завершенные и еще не привязанные загрузки. Статус
+        меняется одним условным UPDATE, поэтому одно изображение не попадет
+        в два перевала при параллельной отправке.
+        """
+        if not image_ids:
+            return []
+        image_ids = PerevalManager.check_uploaded_ids(image_ids, set())
+        with transaction.atomic():
+            claimed = UploadSession.objects.filter(
+                image_id__in=image_ids,
+                status=UploadSession.StatusChoices.COMPLETE
+            ).update(status=UploadSession.StatusChoices.ATTACHED)
+            if claimed != len(image_ids):
+                # Исключение откатывает резервирование: часть изображений недоступна
+                raise ValidationError('Изображения не найдены или уже привязаны к перевалу')
+        images = Image.objects.in_bulk(image_ids)
+        return [images[image_id] for image_id in image_ids]
+
+    @staticmethod
+    def check_uploaded_ids(image_ids, used_ids):
+        """id изображений, загруженных частями: числа, не встречавшиеся в used_ids"""
+        try:
+            image_ids = [int(image_id) for image_id in image_ids]
+        except (TypeError, ValueError):
+            raise ValidationError('id изображения должен быть числом')
+        if len(set(image_ids)) != len(image_ids) or used_ids.intersection(image_ids):
+            raise ValidationError('Изображение указано несколько раз')
+        used_ids.update(image_ids)
+        return image_ids
+
+    def create_upload(self, data):
+        """Создание сессии возобновляемой загрузки изображения"""
+        try:
+            for field in ('title', 'filename', 'size'):
+                if field not in data:
+                    raise ValidationError(f'Отсутствует обязательное поле: {field}')
+            try:
+                size = int(data['size'])
+            except (TypeError, ValueError):
+                raise ValidationError('Поле size должно быть числом')
+            if not 0 < size <= settings.PEREVAL_MAX_IMAGE_SIZE:
+                raise ValidationError(
+                    f'Размер изображения должен быть от 1 до {settings.PEREVAL_MAX_IMAGE_SIZE} байт'
+                )
+            content_type = data.get('content_type') or 'image/jpeg'
+            if not content_type.startswith('image/'):
+                raise ValidationError('Ожидается файл изображения (image/*)')
+
+            session = UploadSession.objects.create(
+                title=data['title'],
+                filename=data['filename'],
+                content_type=content_type,
+                size=size
+            )
+            uploads.create_part(session)
+            return {'status': 201, 'message': None, **self.upload_to_dict(session)}
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'id': None}
+
+    @staticmethod
+    def upload_to_dict(session):
+        return {
+            'id': str(session.id),
+            'offset': session.offset,
+            'size': session.size,
+            'upload_status': session.status,
+            'image_id': session.image_id,
+        }
+
+    def get_upload(self, upload_id):
+        """Текущее состояние загрузки: с какого байта продолжать"""
+        session = UploadSession.objects.filter(id=upload_id).first()
+        if session is None:
+            return {'status': 404, 'message': 'Загрузка не найдена'}
+        return {'status': 200, 'message': None, **self.upload_to_dict(session)}
+
+    def append_upload(self, upload_id, offset, length, stream):
+        """Запись очередной части загрузки с позиции offset.
+
+        Запись принимается только с текущей позиции сессии. Позиция
+        сдвигается условным UPDATE: из двух параллельных запросов с одним
+        offset засчитывается один, второй получает 409 и текущую позицию.
+        """
+        session = UploadSession.objects.filter(id=upload_id).first()
+        if session is None:
+            return {'status': 404, 'message': 'Загрузка не найдена'}
+        if session.status != UploadSession.StatusChoices.UPLOADING:
+            return {'status': 409, 'message': 'Загрузка уже завершена', **self.upload_to_dict(session)}
+        if offset != session.offset:
+            return {'status': 409, 'message': 'Неверная позиция части', **self.upload_to_dict(session)}
+        if length <= 0 or offset + length > session.size:
+            return {'status': 400, 'message': 'Часть выходит за объявленный размер файла', **self.upload_to_dict(session)}
+
+        written = uploads.write_part(session, offset, length, stream)
+        moved = UploadSession.objects.filter(
+            id=session.id, offset=offset, status=UploadSession.StatusChoices.UPLOADING
+        ).update(offset=offset + written, updated_at=timezone.now())
+        session.refresh_from_db()
+        if not moved:
+            return {'status': 409, 'message': 'Неверная позиция части', **self.upload_to_dict(session)}
+        if written < length:
             return {
-                'id': pereval.id,
-                'beauty_title': pereval.beauty_title,
-                'title': pereval.title,
-                'other_titles': pereval.other_titles,
-                'connect': pereval.connect,
-                'add_time': pereval.add_time,
-                'status': pereval.status,
-                'user': {
-                    'email': pereval.user.email,
-                    'fam': pereval.user.fam,
-                    'name': pereval.user.name,
-                    'otc': pereval.user.otc,
-                    'phone': pereval.user.phone
-                },
-                'coords': {
-                    'latitude': pereval.coords.latitude,
-                    'longitude': pereval.coords.longitude,
-                    'height': pereval.coords.height
-                },
-                'level': {
-                    'winter': pereval.level.winter,
-                    'summer': pereval.level.summer,
-                    'autumn': pereval.level.autumn,
-                    'spring': pereval.level.spring
-                },
-                'images': [{
-                    'title': img.title,
-                    'data': img.data.url if img.data else None
-                } for img in pereval.images.all()],
-                'status': 200,
-                'message': None
+                'status': 400,
+                'message': f'Получено {written} из {length} байт, продолжите с позиции {session.offset}',
+                **self.upload_to_dict(session)
             }
+        return {'status': 200, 'message': None, **self.upload_to_dict(session)}
+
+    def finalize_upload(self, upload_id):
+        """Завершение загрузки: файл переносится в хранилище и становится изображением.
+
+        Повторный вызов возвращает то же изображение, поэтому клиент может
+        безопасно повторить запрос, не получив ответа.
+        """
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().filter(id=upload_id).first()
+            if session is None:
+                return {'status': 404, 'message': 'Загрузка не найдена'}
+            if session.status != UploadSession.StatusChoices.UPLOADING:
+                return {'status': 200, 'message': None, **self.upload_to_dict(session)}
+            if session.offset < session.size:
+                return {'status': 409, 'message': 'Файл загружен не полностью', **self.upload_to_dict(session)}
+
+            part = uploads.open_part(session, f'upload_{session.id.hex}')
+            try:
+                # Расширение - по формату содержимого, имя файла клиента не используется
+                ext = sniff_extension(part)
+                blob = blobs.store(part, ext)
+            except ValidationError as e:
+                return {'status': 400, 'message': e.message, **self.upload_to_dict(session)}
+            finally:
+                part.close()
+            session.image = image_for_blob(session.title, blob)
+            session.image.save()
+            enqueue_images([session.image])
+            session.status = UploadSession.StatusChoices.COMPLETE
+            session.save(update_fields=['image', 'status', 'updated_at'])
+        uploads.remove_part(session)
+        return {'status': 200, 'message': None, **self.upload_to_dict(session)}
+
+    def submit_many(self, items, files=None):
+        """Пакетное добавление перевалов.
+
+        Все записи проверяются заранее, валидные вставляются через bulk_create
+        в одной транзакции: число запросов к БД зависит от числа таблиц,
+        а не от числа записей. Для каждой записи возвращается свой результат.
+        Изображения передаются так же, как в submit_pereval: base64, файлом
+        multipart-запроса (files) или id загрузки частями.
+        """
+        if not isinstance(items, list) or len(items) == 0:
+            return {'status': 400, 'message': 'Ожидается непустой список перевалов', 'results': []}
+        if len(items) > settings.PEREVAL_BATCH_MAX_SIZE:
+            return {
+                'status': 400,
+                'message': f'Слишком много записей в пакете (максимум {settings.PEREVAL_BATCH_MAX_SIZE})',
+                'results': []
+            }
+
+        results = [None] * len(items)
+        prepared = []
+        uploaded_ids = {}
+        pending_files = []
+        try:
+            # Лимит на суммарный размер проверяется по всему пакету до декодирования
+            all_images = []
+            for data in items:
+                if isinstance(data, dict) and isinstance(data.get('images'), list):
+                    all_images.extend(data['images'])
+            check_request_size(all_images, files)
+            used_files = set()
+            used_ids = set()
+            for index, data in enumerate(items):
+                images = []
+                try:
+                    self.validate_data(data)
+                    image_ids = []
+                    for img_data in data['images']:
+                        if 'id' in img_data:
+                            image_ids.append(img_data['id'])
+                            continue
+                        if 'file' in img_data:
+                            ext, upload = self.file_image(img_data, files, used_files)
+                        else:
+                            ext, upload = self.decode_image(img_data)
+                        images.append((img_data['title'], ext, upload))
+                    uploaded_ids[index] = self.check_uploaded_ids(image_ids, used_ids)
+                    prepared.append((index, data, images))
+                except ValidationError as e:
+                    results[index] = {'status': 400, 'message': str(e), 'id': None}
+                finally:
+                    pending_files.extend(upload for _, _, upload in images)
+
+            # Записи с недоступными загрузками отсекаются одним запросом до транзакции,
+            # а не откатывают весь пакет в claim_uploaded_images
+            unavailable = self.unavailable_uploads([image_id for ids in uploaded_ids.values() for image_id in ids])
+            for index, _, _ in prepared:
+                if unavailable.intersection(uploaded_ids[index]):
+                    results[index] = {
+                        'status': 400, 'message': 'Изображения не найдены или уже привязаны к перевалу', 'id': None
+                    }
+            prepared = [item for item in prepared if results[item[0]] is None]
+
+            if prepared:
+                try:
+                    ids = self._save(prepared, uploaded_ids)
+                except ValidationError as e:
+                    for index, _, _ in prepared:
+                        results[index] = {'status': 400, 'message': str(e), 'id': None}
+                except Exception as e:
+                    for index, _, _ in prepared:
+                        results[index] = {'status': 500, 'message': str(e), 'id': None}
+                else:
+                    for (index, _, _), pereval_id in zip(prepared, ids):
+                        results[index] = {'status': 200, 'message': None, 'id': pereval_id}
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'results': []}
+        finally:
+            for upload in pending_files:
+                upload.close()
+
+        return {'status': 200, 'message': None, 'results': results}
+
+    @staticmethod
+    def unavailable_uploads(image_ids):
+        """id из image_ids, которые нельзя привязать: нет завершенной непривязанной загрузки"""
+        if not image_ids:
+            return set()
+        available = UploadSession.objects.filter(
+            image_id__in=image_ids,
+            status=UploadSession.StatusChoices.COMPLETE
+        ).values_list('image_id', flat=True)
+        return set(image_ids).difference(available)
+
+    def _save(self, prepared, uploaded_ids):
+        """Запись подготовленных перевалов, возвращает их id.
+
+        Файлы пишутся до транзакции, строки - в одной транзакции: ошибка на
+        любом шаге не оставит в базе координаты, уровень или изображения
+        без перевала. uploaded_ids - {индекс записи: id загрузок частями}.
+        Если транзакция откатилась, только что записанные файлы удаляются.
+        """
+        prepared = self._write_files(prepared)
+        try:
+            with transaction.atomic():
+                claimed = iter(self.claim_uploaded_images([
+                    image_id for index, _, _ in prepared for image_id in uploaded_ids.get(index, ())
+                ]))
+                ids = self._bulk_insert(prepared)
+                PerevalImage.objects.bulk_create([
+                    PerevalImage(pereval_id=pereval_id, image=next(claimed))
+                    for (index, _, _), pereval_id in zip(prepared, ids)
+                    for _ in uploaded_ids.get(index, ())
+                ])
+                PerevalAdded.touch(ids)
+        except BaseException:
+            blobs.discard([blob_file for _, _, images in prepared for _, blob_file in images])
+            raise
+        return ids
+
+    @staticmethod
+    def _write_files(prepared):
+        """Запись содержимого изображений на диск до открытия транзакции.
+
+        Изображения (title, ext, файл) подготовленных записей заменяются на
+        (title, файл blob) для _bulk_insert.
+        """
+        written = iter(blobs.write_files([
+            (upload, ext) for _, _, images in prepared for _, ext, upload in images
+        ]))
+        return [
+            (index, data, [(title, next(written)) for title, _, _ in images])
+            for index, data, images in prepared
+        ]
+
+    @staticmethod
+    def _bulk_insert(prepared):
+        """Вставка подготовленных записей: по одному bulk-запросу на таблицу.
+
+        Номера изменений не назначаются: вызывающий код берет их
+        PerevalAdded.touch() последним запросом транзакции, чтобы строка
+        счетчика SyncSequence была заблокирована только до COMMIT.
+        """
+        # Пользователи: существующие не изменяются, как и в get_or_create
+        users_data = {}
+        for _, data, _ in prepared:
+            users_data.setdefault(data['user']['email'], data['user'])
+        users = {u.email: u for u in User.objects.filter(email__in=users_data)}
+        missing = [
+            User(**{field: user_data[field] for field in USER_FIELDS})
+            for email, user_data in users_data.items() if email not in users
+        ]
+        if missing:
+            User.objects.bulk_create(missing, ignore_conflicts=True)
+            users = {u.email: u for u in User.objects.filter(email__in=users_data)}
+
+        # bulk_create не вызывает save(), поэтому geohash считаем сами
+        coords = Coords.objects.bulk_create([
+            Coords(
+                geohash=geohash_encode(data['coords']['latitude'], data['coords']['longitude']),
+                **{field: data['coords'][field] for field in COORDS_FIELDS}
+            )
+            for _, data, _ in prepared
+        ])
+        levels = Level.objects.bulk_create([
+            Level(**{field: data['level'][field] for field in LEVEL_FIELDS})
+            for _, data, _ in prepared
+        ])
+
+        perevals = PerevalAdded.objects.bulk_create([
+            PerevalAdded(
+                user=users[data['user']['email']],
+                coords=coords[i],
+                level=levels[i],
+                **{field: data[field] for field in MAIN_FIELDS}
+            )
+            for i, (_, data, _) in enumerate(prepared)
+        ])
+
+        titles = []
+        blob_files = []
+        owners = []
+        for pereval, (_, _, images_data) in zip(perevals, prepared):
+            for title, blob_file in images_data:
+                titles.append(title)
+                blob_files.append(blob_file)
+                owners.append(pereval)
+        stored = blobs.link(blob_files)
+        images = [image_for_blob(title, blob) for title, blob in zip(titles, stored)]
+        images = Image.objects.bulk_create(images)
+        enqueue_images(images)
+        PerevalImage.objects.bulk_create([
+            PerevalImage(pereval=pereval, image=image)
+            for pereval, image in zip(owners, images)
+        ])
+
+        tiles.add_points([(c.latitude, c.longitude) for c in coords])
+
+        return [pereval.id for pereval in perevals]
+
+    def get_pereval_by_id(self, pereval_id):
+        """Получение данных о перевале по ID (через кэш)"""
+        return pereval_cache.get(pereval_id, lambda: self._load_pereval(pereval_id))
+
+    async def aget_pereval_by_id(self, pereval_id):
+        """Async-вариант get_pereval_by_id для ASGI-представлений"""
+        return await pereval_cache.aget(pereval_id, lambda: self._aload_pereval(pereval_id))
+
+    @staticmethod
+    def _detail_queryset():
+        # Пользователь, координаты и уровень приходят одним JOIN в строке .values(),
+        # изображения и их копии - еще двумя запросами: всего 3 на любой перевал
+        return PerevalAdded.objects.values(*DETAIL.columns)
+
+    @staticmethod
+    def _detail_result(result):
+        result.update({'status': 200, 'message': None})
+        return result
+
+    def _load_pereval(self, pereval_id):
+        """Чтение данных о перевале из БД"""
+        try:
+            row = self._detail_queryset().get(id=pereval_id)
+        except ObjectDoesNotExist:
+            return {'status': 404, 'message': 'Перевал не найден', 'id': None}
+        return self._detail_result(DETAIL.serialize([row])[0])
+
+    async def _aload_pereval(self, pereval_id):
+        try:
+            row = await self._detail_queryset().aget(id=pereval_id)
         except ObjectDoesNotExist:
             return {'status': 404, 'message': 'Перевал не найден', 'id': None}
+        return self._detail_result((await DETAIL.aserialize([row]))[0])
+
+    @staticmethod
+    def changed_fields(obj, data, fields):
+        """Поля из data, значения которых отличаются от текущих значений obj"""
+        return {field: data[field] for field in fields if field in data and getattr(obj, field) != data[field]}
 
     def update_pereval(self, pereval_id, data):
-        """Обновление данных о перевале"""
+        """Обновление данных о перевале.
+
+        Одна транзакция: строки перевала, координат и уровня блокируются
+        (SELECT ... FOR UPDATE) от проверки статуса до записи, поэтому
+        модератор не сменит статус между ними. Записываются только
+        изменившиеся столбцы, запрос без изменений не пишет в БД.
+        """
         try:
-            pereval = PerevalAdded.objects.get(id=pereval_id)
+            self.validate_update(data)
+            with transaction.atomic():
+                pereval = (
+                    PerevalAdded.objects
+                    .select_for_update()
+                    .select_related('coords', 'level')
+                    .get(id=pereval_id)
+                )
 
-            if pereval.status != 'new':
-                return {'state': 0, 'message': 'Редактирование запрещено: запись не в статусе "new"'}
+                if pereval.status != 'new':
+                    return {'state': 0, 'message': 'Редактирование запрещено: запись не в статусе "new"'}
 
-            # Проверяем, что пользователь не меняет свои данные
-            user_data = data.get('user', {})
-            if any(key in user_data for key in ['email', 'fam', 'name', 'otc', 'phone']):
-                return {'state': 0, 'message': 'Редактирование персональных данных запрещено'}
+                # Проверяем, что пользователь не меняет свои данные
+                user_data = data.get('user', {})
+                if any(key in user_data for key in ['email', 'fam', 'name', 'otc', 'phone']):
+                    return {'state': 0, 'message': 'Редактирование персональных данных запрещено'}
 
-            # Обновляем координаты
-            if 'coords' in data:
                 coords = pereval.coords
-                coords_data = data['coords']
-                coords.latitude = coords_data.get('latitude', coords.latitude)
-                coords.longitude = coords_data.get('longitude', coords.longitude)
-                coords.height = coords_data.get('height', coords.height)
-                coords.save()
-
-            # Обновляем уровень сложности
-            if 'level' in data:
-                level = pereval.level
-                level_data = data['level']
-                level.winter = level_data.get('winter', level.winter)
-                level.summer = level_data.get('summer', level.summer)
-                level.autumn = level_data.get('autumn', level.autumn)
-                level.spring = level_data.get('spring', level.spring)
-                level.save()
-
-            # Обновляем основные данные перевала
-            pereval.beauty_title = data.get('beauty_title', pereval.beauty_title)
-            pereval.title = data.get('title', pereval.title)
-            pereval.other_titles = data.get('other_titles', pereval.other_titles)
-            pereval.connect = data.get('connect', pereval.connect)
-            pereval.save()
+                coords_changes = self.changed_fields(coords, data.get('coords', {}), COORDS_FIELDS)
+                level_changes = self.changed_fields(pereval.level, data.get('level', {}), LEVEL_FIELDS)
+                main_changes = self.changed_fields(pereval, data, MAIN_FIELDS)
+
+                # Координаты и уровень - UPDATE только изменившихся столбцов без повторного
+                # чтения: кэш карточки сбрасывает сохранение перевала ниже
+                if coords_changes:
+                    old_point = (coords.latitude, coords.longitude)
+                    for field, value in coords_changes.items():
+                        setattr(coords, field, value)
+                    if (coords.latitude, coords.longitude) != old_point:
+                        coords_changes['geohash'] = geohash_encode(coords.latitude, coords.longitude)
+                        tiles.move_point(old_point, (coords.latitude, coords.longitude))
+                    Coords.objects.filter(id=coords.id).update(**coords_changes)
+
+                if level_changes:
+                    Level.objects.filter(id=pereval.level_id).update(**level_changes)
+
+                if coords_changes or level_changes or main_changes:
+                    for field, value in main_changes.items():
+                        setattr(pereval, field, value)
+                    # save() добавляет change_seq и updated_at: изменение координат
+                    # или уровня тоже видно синхронизации и условным GET
+                    pereval.save(update_fields=list(main_changes))
 
             return {'state': 1, 'message': 'Запись успешно обновлена'}
 
+        except ValidationError as e:
+            return {'state': 0, 'message': e.message}
         except ObjectDoesNotExist:
             return {'state': 0, 'message': 'Перевал не найден'}
         except Exception as e:
             return {'state': 0, 'message': str(e)}
 
-    def get_perevals_by_email(self, email):
-        """Получение списка перевалов по email пользователя"""
+    @staticmethod
+    def encode_cursor(pereval):
+        """Курсор страницы - непрозрачная строка с ключом (add_time, id) последней записи (строки .values())"""
+        raw = f'{pereval["add_time"].isoformat()}|{pereval["id"]}'
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Разбор курсора, полученного от клиента"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            add_time, pereval_id = raw.rsplit('|', 1)
+            return datetime.fromisoformat(add_time), int(pereval_id)
+        except (ValueError, UnicodeError, binascii.Error):
+            raise ValidationError('Некорректный курсор')
+
+    def paginate(self, queryset, cursor=None, limit=None):
+        """Keyset-пагинация по (add_time, id) от новых записей к старым.
+
+        В отличие от OFFSET, следующая страница начинается поиском по индексу
+        сразу с нужного ключа, поэтому время ответа не зависит от глубины.
+        """
+        queryset, limit = self._page_queryset(queryset, cursor, limit)
+        return self._split_page(list(queryset), limit)
+
+    async def apaginate(self, queryset, cursor=None, limit=None):
+        queryset, limit = self._page_queryset(queryset, cursor, limit)
+        return self._split_page([item async for item in queryset], limit)
+
+    def _page_queryset(self, queryset, cursor, limit):
+        """Запрос страницы с одной лишней записью - признаком следующей страницы"""
+        limit = min(limit or settings.PEREVAL_PAGE_SIZE, settings.PEREVAL_PAGE_SIZE_MAX)
+        if limit < 1:
+            raise ValidationError('Параметр limit должен быть положительным')
+
+        queryset = queryset.order_by('-add_time', '-id')
+        if cursor:
+            add_time, pereval_id = self.decode_cursor(cursor)
+            # add_time <= t ограничивает диапазон сканирования индекса,
+            # условие в скобках отсекает уже выданные записи с тем же временем
+            queryset = queryset.filter(
+                Q(add_time__lt=add_time) | Q(add_time=add_time, id__lt=pereval_id),
+                add_time__lte=add_time,
+            )
+
+        return queryset[:limit + 1], limit
+
+    def _split_page(self, page, limit):
+        next_cursor = self.encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return page[:limit], next_cursor
+
+    @staticmethod
+    def _by_email_queryset(user):
+        # Запросы: пользователь, перевалы с координатами и уровнем,
+        # изображения и копии всех перевалов страницы - независимо от их числа
+        return PerevalAdded.objects.filter(user=user).values(*LIST.columns)
+
+    @staticmethod
+    def _by_email_result(perevals, next_cursor):
+        return {
+            'status': 200,
+            'message': None,
+            'perevals': perevals,
+            'next_cursor': next_cursor
+        }
+
+    def get_perevals_by_email(self, email, cursor=None, limit=None):
+        """Получение списка перевалов по email пользователя (постранично)"""
         try:
             user = User.objects.get(email=email)
-            perevals = PerevalAdded.objects.filter(user=user)
-
-            result = []
-            for pereval in perevals:
-                result.append({
-                    'id': pereval.id,
-                    'beauty_title': pereval.beauty_title,
-                    'title': pereval.title,
-                    'other_titles': pereval.other_titles,
-                    'connect': pereval.connect,
-                    'add_time': pereval.add_time,
-                    'status': pereval.status,
-                    'coords': {
-                        'latitude': pereval.coords.latitude,
-                        'longitude': pereval.coords.longitude,
-                        'height': pereval.coords.height
-                    },
-                    'level': {
-                        'winter': pereval.level.winter,
-                        'summer': pereval.level.summer,
-                        'autumn': pereval.level.autumn,
-                        'spring': pereval.level.spring
-                    },
-                    'images': [{
-                        'title': img.title,
-                        'data': img.data.url if img.data else None
-                    } for img in pereval.images.all()]
-                })
-
-            return {'status': 200, 'message': None, 'perevals': result}
+            page, next_cursor = self.paginate(self._by_email_queryset(user), cursor, limit)
+            return self._by_email_result(LIST.serialize(page), next_cursor)
         except User.DoesNotExist:
-            return {'status': 404, 'message': 'Пользователь с таким email не найден', 'perevals': []}
\ No newline at end of file
+            return {'status': 404, 'message': 'Пользователь с таким email не найден', 'perevals': []}
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'perevals': []}
+
+    async def aget_perevals_by_email(self, email, cursor=None, limit=None):
+        """Async-вариант get_perevals_by_email для ASGI-представлений"""
+        try:
+            user = await User.objects.aget(email=email)
+            page, next_cursor = await self.apaginate(self._by_email_queryset(user), cursor, limit)
+            return self._by_email_result(await LIST.aserialize(page), next_cursor)
+        except User.DoesNotExist:
+            return {'status': 404, 'message': 'Пользователь с таким email не найден', 'perevals': []}
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'perevals': []}
+
+    @staticmethod
+    def get_pereval_updated_at(pereval_id):
+        """Дата изменения перевала одним запросом без JOIN - для условных GET"""
+        return PerevalAdded.objects.filter(id=pereval_id).values_list('updated_at', flat=True).first()
+
+    @staticmethod
+    async def aget_pereval_updated_at(pereval_id):
+        return await PerevalAdded.objects.filter(id=pereval_id).values_list('updated_at', flat=True).afirst()
+
+    def get_perevals_by_email_versions(self, email, cursor=None, limit=None):
+        """Пары (id, updated_at) страницы списка по email и курсор следующей страницы.
+
+        Этого достаточно для ETag страницы, поэтому условный GET не строит полный ответ.
+        """
+        perevals = PerevalAdded.objects.filter(user__email=email).values('id', 'add_time', 'updated_at')
+        page, next_cursor = self.paginate(perevals, cursor, limit)
+        return [(pereval['id'], pereval['updated_at']) for pereval in page], next_cursor
+
+    async def aget_perevals_by_email_versions(self, email, cursor=None, limit=None):
+        perevals = PerevalAdded.objects.filter(user__email=email).values('id', 'add_time', 'updated_at')
+        page, next_cursor = await self.apaginate(perevals, cursor, limit)
+        return [(pereval['id'], pereval['updated_at']) for pereval in page], next_cursor
+
+    def get_perevals(self, status=None, cursor=None, limit=None):
+        """Получение списка всех перевалов (постранично) с фильтром по статусу.
+
+        Список публичный, поэтому без данных пользователя: как и список по email.
+        """
+        try:
+            perevals = PerevalAdded.objects.values(*LIST.columns)
+            if status:
+                if status not in PerevalAdded.StatusChoices.values:
+                    raise ValidationError(f'Неизвестный статус: {status}')
+                perevals = perevals.filter(status=status)
+            page, next_cursor = self.paginate(perevals, cursor, limit)
+
+            return {
+                'status': 200,
+                'message': None,
+                'perevals': LIST.serialize(page),
+                'next_cursor': next_cursor
+            }
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'perevals': []}
+
+    @staticmethod
+    def pereval_to_point(pereval):
+        """Краткое представление перевала для карты"""
+        return {
+            'id': pereval.id,
+            'beauty_title': pereval.beauty_title,
+            'title': pereval.title,
+            'status': pereval.status,
+            'coords': {
+                'latitude': pereval.coords.latitude,
+                'longitude': pereval.coords.longitude,
+                'height': pereval.coords.height
+            }
+        }
+
+    @staticmethod
+    def validate_point(latitude, longitude):
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise ValidationError('Координаты вне допустимого диапазона')
+
+    @staticmethod
+    def _bbox_queryset(min_lat, min_lon, max_lat, max_lon):
+        """Перевалы в прямоугольнике: префиксы geohash отбирают ячейки по индексу,
+        точное сравнение координат отсекает лишнее по краям ячеек"""
+        cells = Q()
+        for prefix in cover_bbox(min_lat, min_lon, max_lat, max_lon):
+            lower, upper = prefix_range(prefix)
+            cell = Q(coords__geohash__gte=lower)
+            if upper is not None:
+                cell &= Q(coords__geohash__lt=upper)
+            cells |= cell
+        bounds = Q()
+        for box_min_lat, box_min_lon, box_max_lat, box_max_lon in split_bbox(min_lat, min_lon, max_lat, max_lon):
+            bounds |= Q(
+                coords__latitude__range=(box_min_lat, box_max_lat),
+                coords__longitude__range=(box_min_lon, box_max_lon),
+            )
+        return PerevalAdded.objects.filter(cells, bounds).select_related('coords')
+
+    def search_bbox(self, min_lat, min_lon, max_lat, max_lon, limit=None):
+        """Поиск перевалов в видимой области карты"""
+        try:
+            self.validate_point(min_lat, min_lon)
+            self.validate_point(max_lat, max_lon)
+            if min_lat > max_lat:
+                raise ValidationError('min_lat больше max_lat')
+            limit = min(limit or settings.PEREVAL_SEARCH_LIMIT, settings.PEREVAL_SEARCH_LIMIT)
+
+            perevals = self._bbox_queryset(min_lat, min_lon, max_lat, max_lon)[:limit]
+            return {
+                'status': 200,
+                'message': None,
+                'perevals': [self.pereval_to_point(pereval) for pereval in perevals]
+            }
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'perevals': []}
+
+    def search_nearest(self, latitude, longitude, k=10):
+        """Поиск k ближайших перевалов.
+
+        Окрестность точки расширяется от мелких ячеек geohash к крупным, пока в
+        гарантированном радиусе не наберется k перевалов, но не дальше
+        PEREVAL_SEARCH_NEAREST_MAX_KM: дальше нее перевалы не ищутся, и их
+        может вернуться меньше k. Каждый шаг - один индексный запрос за
+        координатами не более PEREVAL_SEARCH_NEAREST_CANDIDATES ближайших,
+        полные записи читаются только для найденных.
+        """
+        try:
+            self.validate_point(latitude, longitude)
+            if not 1 <= k <= settings.PEREVAL_SEARCH_K_MAX:
+                raise ValidationError(f'Параметр k должен быть от 1 до {settings.PEREVAL_SEARCH_K_MAX}')
+
+            max_km = settings.PEREVAL_SEARCH_NEAREST_MAX_KM
+            limit = max(settings.PEREVAL_SEARCH_NEAREST_CANDIDATES, k)
+            nearest = []
+            for precision in range(5, 0, -1):
+                box, radius_km = search_box(latitude, longitude, precision)
+                radius_km = min(radius_km, max_km)
+                candidates = sorted(
+                    (haversine_km(latitude, longitude, lat, lon), pereval_id)
+                    for pereval_id, lat, lon in self._nearest_candidates(latitude, longitude, box, limit)
+                )
+                nearest = [candidate for candidate in candidates if candidate[0] <= radius_km][:k]
+                if len(nearest) == k or radius_km >= max_km:
+                    break
+
+            ids = [pereval_id for _, pereval_id in nearest]
+            perevals = PerevalAdded.objects.select_related('coords').only(
+                'beauty_title', 'title', 'status', 'coords__latitude', 'coords__longitude', 'coords__height'
+            ).in_bulk(ids)
+            return {
+                'status': 200,
+                'message': None,
+                'perevals': [
+                    {**self.pereval_to_point(perevals[pereval_id]), 'distance_km': round(distance, 3)}
+                    for distance, pereval_id in nearest if pereval_id in perevals
+                ]
+            }
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'perevals': []}
+
+    @staticmethod
+    def _nearest_candidates(latitude, longitude, box, limit):
+        """Id и координаты перевалов окрестности, ближайшие первыми.
+
+        Порядок - по равнопромежуточной проекции вокруг точки: точное
+        расстояние считается потом в Python, а приближенное нужно только для
+        того, чтобы LIMIT отрезал дальние перевалы, а не случайные.
+        """
+        d_lat = F('coords__latitude') - latitude
+        d_lon = Abs(F('coords__longitude') - longitude)
+        # Через 180-й меридиан разница долгот идет короткой стороной
+        d_lon = Least(d_lon, 360.0 - d_lon) * math.cos(math.radians(latitude))
+        return (
+            PerevalManager._bbox_queryset(*box)
+            .annotate(approx_distance=d_lat * d_lat + d_lon * d_lon)
+            .order_by('approx_distance')
+            .values_list('id', 'coords__latitude', 'coords__longitude')[:limit]
+        )
+
+    @staticmethod
+    def get_tile_version(zoom, x, y):
+        """Версия тайла для ETag одним агрегирующим запросом, без чтения кластеров"""
+        if not tiles.is_valid_tile(zoom, x, y):
+            return {'status': 400, 'message': 'Некорректный тайл', 'version': None}
+        updated_at = tiles.tile_version(zoom, x, y)
+        return {'status': 200, 'message': None, 'version': updated_at.isoformat() if updated_at else ''}
+
+    def get_tile(self, zoom, x, y):
+        """Кластеры перевалов в тайле карты {z}/{x}/{y}"""
+        if not tiles.is_valid_tile(zoom, x, y):
+            return {'status': 400, 'message': 'Некорректный тайл', 'clusters': []}
+
+        if zoom <= settings.PEREVAL_TILE_MAX_ZOOM:
+            clusters = tiles.tile_clusters(zoom, x, y)
+        else:
+            # На крупных масштабах кластеры не нужны - отдаем сами перевалы
+            perevals = self._bbox_queryset(*tiles.tile_bounds(zoom, x, y)).order_by('id')
+            clusters = [
+                {
+                    'count': 1,
+                    'latitude': pereval.coords.latitude,
+                    'longitude': pereval.coords.longitude,
+                    'id': pereval.id
+                }
+                for pereval in perevals[:settings.PEREVAL_SEARCH_LIMIT]
+            ]
+        return {'status': 200, 'message': None, 'zoom': zoom, 'x': x, 'y': y, 'clusters': clusters}
+
+    @staticmethod
+    def encode_sync_token(change_seq):
+        return base64.urlsafe_b64encode(f'v1:{change_seq}'.encode()).decode()
+
+    @staticmethod
+    def decode_sync_token(token):
+        if not token:
+            return 0
+        try:
+            version, change_seq = base64.urlsafe_b64decode(token.encode()).decode().split(':')
+            if version != 'v1':
+                raise ValueError(version)
+            return int(change_seq)
+        except (ValueError, UnicodeError, binascii.Error):
+            raise ValidationError('Некорректный токен синхронизации')
+
+    def sync(self, email, token=None, limit=None):
+        """Изменения перевалов пользователя после токена синхронизации.
+
+        Возвращает созданные, измененные (в том числе сменившие статус)
+        перевалы и id удаленных в порядке номеров изменений. Объем ответа
+        пропорционален числу изменений, а не числу перевалов пользователя.
+        """
+        try:
+            since = self.decode_sync_token(token)
+            limit = min(limit or settings.PEREVAL_PAGE_SIZE, settings.PEREVAL_PAGE_SIZE_MAX)
+            if limit < 1:
+                raise ValidationError('Параметр limit должен быть положительным')
+
+            changed = list(
+                PerevalAdded.objects
+                .filter(user__email=email, change_seq__gt=since)
+                .order_by('change_seq')
+                .values(*LIST.columns, 'change_seq')[:limit + 1]
+            )
+            deleted = list(
+                PerevalTombstone.objects
+                .filter(email=email, change_seq__gt=since)
+                .order_by('change_seq')
+                .values_list('change_seq', 'pereval_id')[:limit + 1]
+            )
+
+            # Слияние двух упорядоченных потоков и отсечение по limit
+            events = sorted(
+                [(pereval['change_seq'], pereval) for pereval in changed] + deleted,
+                key=lambda event: event[0]
+            )
+            has_more = len(events) > limit
+            events = events[:limit]
+            last_seq = events[-1][0] if events else since
+
+            return {
+                'status': 200,
+                'message': None,
+                'perevals': LIST.serialize([item for _, item in events if isinstance(item, dict)]),
+                'deleted': [item for _, item in events if not isinstance(item, dict)],
+                'next_token': self.encode_sync_token(last_seq),
+                'has_more': has_more
+            }
+        except ValidationError as e:
+            return {'status': 400, 'message': str(e), 'perevals': [], 'deleted': []}
@@ -0,0 +1,146 @@
+import math
+
+# Алфавит geohash (base32 без a, i, l, o)
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Кодирование координат в geohash заданной длины.
+
+    Соседние точки получают общий префикс, поэтому поиск по области сводится
+    к нескольким запросам по префиксу к обычному B-tree индексу.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    result = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(result) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = bits * 2 + 1
+                lon_range[0] = mid
+            else:
+                bits = bits * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = bits * 2 + 1
+                lat_range[0] = mid
+            else:
+                bits = bits * 2
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            result.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(result)
+
+
+def cell_size(precision):
+    """Размер ячейки geohash в градусах: (по широте, по долготе)"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _cells_in_box(min_lat, min_lon, max_lat, max_lon, precision):
+    """Ячейки заданной точности, покрывающие прямоугольник (без перехода через 180°)"""
+    cell_lat, cell_lon = cell_size(precision)
+    lats = _grid_steps(min_lat, max_lat, cell_lat)
+    lons = _grid_steps(min_lon, max_lon, cell_lon)
+    return {geohash_encode(lat, lon, precision) for lat in lats for lon in lons}
+
+
+def _grid_steps(start, stop, step):
+    """Точки с шагом step от start до stop включительно - по одной в каждой ячейке"""
+    values = []
+    value = start
+    while value < stop:
+        values.append(value)
+        value += step
+    values.append(stop)
+    return values
+
+
+def _estimate_cells(min_lat, min_lon, max_lat, max_lon, precision):
+    cell_lat, cell_lon = cell_size(precision)
+    rows = math.floor(max_lat / cell_lat) - math.floor(min_lat / cell_lat) + 1
+    cols = math.floor(max_lon / cell_lon) - math.floor(min_lon / cell_lon) + 1
+    return rows * cols
+
+
+def split_bbox(min_lat, min_lon, max_lat, max_lon):
+    """Разбиение прямоугольника, пересекающего 180-й меридиан, на два"""
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    if min_lon <= max_lon:
+        return [(min_lat, min_lon, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+
+
+def cover_bbox(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """Набор префиксов geohash, покрывающих прямоугольник.
+
+    Выбирается самая мелкая точность, при которой число ячеек не превышает
+    max_cells: так запрос остается коротким, а лишних строк читается мало.
+    """
+    boxes = split_bbox(min_lat, min_lon, max_lat, max_lon)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if sum(_estimate_cells(*box, precision) for box in boxes) <= max_cells:
+            break
+    cells = set()
+    for box in boxes:
+        cells |= _cells_in_box(*box, precision)
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """Диапазон [prefix, next) всех geohash, начинающихся с prefix.
+
+    Сравнение по диапазону использует B-tree индекс на любой СУБД, в отличие
+    от LIKE 'prefix%', который в SQLite и при не-C коллации в PostgreSQL
+    индекс не использует. Символы geohash - только [0-9a-z], порядок
+    которых одинаков во всех коллациях.
+    """
+    chars = list(prefix)
+    while chars:
+        position = GEOHASH_ALPHABET.index(chars[-1])
+        if position + 1 < len(GEOHASH_ALPHABET):
+            chars[-1] = GEOHASH_ALPHABET[position + 1]
+            return prefix, ''.join(chars)
+        chars.pop()
+    return prefix, None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Расстояние между двумя точками по дуге большого круга, км"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def search_box(latitude, longitude, precision):
+    """Окрестность точки размером в ячейку во все стороны и радиус, который она гарантирует.
+
+    Любая точка ближе radius_km гарантированно лежит внутри возвращаемого прямоугольника.
+    """
+    cell_lat, cell_lon = cell_size(precision)
+    min_lon, max_lon = longitude - cell_lon, longitude + cell_lon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    box = (latitude - cell_lat, min_lon, latitude + cell_lat, max_lon)
+    km_per_degree = math.pi * EARTH_RADIUS_KM / 180
+    cos_lat = max(math.cos(math.radians(min(abs(latitude) + cell_lat, 90.0))), 0.0)
+    radius_km = km_per_degree * min(cell_lat, cell_lon * cos_lat)
+    return box, radius_km
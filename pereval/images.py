@@ -0,0 +1,193 @@
+import base64
+import binascii
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image as PILImage
+
+BASE64_MARKER = ';base64,'
+# Размер порции base64 (символов) при потоковом декодировании
+BASE64_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = str.maketrans('', '', ' \t\r\n')
+
+# Принимаемые форматы: формат Pillow -> расширение файла в хранилище. Расширение
+# берется только отсюда, имя файла и Content-Type клиента на него не влияют
+IMAGE_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'AVIF': 'avif'}
+# Тип из data:image/<тип>;base64, -> расширение
+DATA_URI_TYPES = {'jpeg': 'jpeg', 'jpg': 'jpeg', 'png': 'png', 'webp': 'webp', 'avif': 'avif'}
+UNSUPPORTED_FORMAT = 'Неподдерживаемый формат изображения: допускаются JPEG, PNG, WebP и AVIF'
+
+
+def parse_data_uri(data):
+    """Разбор заголовка data:image/...;base64, без копирования самой строки.
+
+    Возвращает расширение файла и позицию начала base64-данных.
+    """
+    if not isinstance(data, str):
+        raise ValueError('data must be a string')
+    start = data.find(BASE64_MARKER, 0, 256)
+    if start == -1:
+        raise ValueError('base64 marker not found')
+    ext = data[:start].split('/')[-1].lower()
+    return ext, start + len(BASE64_MARKER)
+
+
+def sniff_extension(file):
+    """Расширение по формату, который Pillow определяет по заголовку содержимого.
+
+    Файл целиком не декодируется; формат вне IMAGE_FORMATS - ValidationError.
+    """
+    try:
+        file.seek(0)
+        with PILImage.open(file) as picture:
+            image_format = picture.format
+    except (OSError, SyntaxError, ValueError):
+        image_format = None
+    finally:
+        file.seek(0)
+    if image_format not in IMAGE_FORMATS:
+        raise ValidationError(UNSUPPORTED_FORMAT)
+    return IMAGE_FORMATS[image_format]
+
+
+def estimated_size(data, start):
+    """Оценка размера после декодирования сверху - до того, как что-то декодировано"""
+    return (len(data) - start) * 3 // 4
+
+
+def check_request_size(images_data, files=None):
+    """Проверка суммарного размера изображений запроса до декодирования.
+
+    Для base64 размер оценивается по длине строк, для файлов multipart
+    берется размер уже принятого файла.
+    """
+    total = 0
+    for img_data in images_data:
+        if not isinstance(img_data, dict):
+            continue
+        if files is not None and isinstance(img_data.get('file'), str) and img_data['file'] in files:
+            total += files[img_data['file']].size
+            continue
+        data = img_data.get('data')
+        try:
+            _, start = parse_data_uri(data)
+        except ValueError:
+            continue
+        total += estimated_size(data, start)
+    if total > settings.PEREVAL_MAX_REQUEST_IMAGES_SIZE:
+        raise ValidationError(
+            f'Суммарный размер изображений больше допустимого ({settings.PEREVAL_MAX_REQUEST_IMAGES_SIZE} байт)'
+        )
+
+
+def decode_base64_image(data, max_size=None):
+    """Потоковое декодирование изображения из data URI во временный файл.
+
+    Строка декодируется порциями, кратными 4 символам, и сразу пишется на
+    диск, поэтому в памяти никогда не оказываются все декодированные байты.
+    Размер проверяется до начала декодирования и по ходу записи. Расширение,
+    как и у файлов multipart, определяется по содержимому: тип из заголовка
+    data: задает клиент.
+    """
+    max_size = max_size or settings.PEREVAL_MAX_IMAGE_SIZE
+    try:
+        ext, start = parse_data_uri(data)
+    except ValueError:
+        raise ValidationError('Ожидается изображение в формате data:image/...;base64,...')
+    if ext not in DATA_URI_TYPES:
+        raise ValidationError(UNSUPPORTED_FORMAT)
+    ext = DATA_URI_TYPES[ext]
+    if estimated_size(data, start) > max_size + 2:
+        raise ValidationError(f'Изображение больше допустимого размера ({max_size} байт)')
+
+    upload = TemporaryUploadedFile(f'upload.{ext}', f'image/{ext}', 0, None)
+    try:
+        size = 0
+        tail = ''
+        for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+            # Пробелы и переводы строк (MIME base64) сдвигают выравнивание,
+            # поэтому неполную четверку символов переносим в следующую порцию
+            chunk = tail + data[offset:offset + BASE64_CHUNK_SIZE].translate(_WHITESPACE)
+            aligned = len(chunk) - len(chunk) % 4
+            tail = chunk[aligned:]
+            decoded = base64.b64decode(chunk[:aligned], validate=True)
+            size += len(decoded)
+            if size > max_size:
+                raise ValidationError(f'Изображение больше допустимого размера ({max_size} байт)')
+            upload.write(decoded)
+        if tail:
+            raise binascii.Error('incomplete base64 data')
+        upload.size = size
+        return sniff_extension(upload), upload
+    except (binascii.Error, ValueError):
+        upload.close()
+        raise ValidationError('Некорректные данные изображения в base64')
+    except BaseException:
+        upload.close()
+        raise
+
+
+def uploaded_image(upload, max_size=None):
+    """Проверка файла изображения из multipart-запроса, возвращает расширение.
+
+    Файл уже записан на диск обработчиком загрузки Django и будет
+    перенесен в хранилище без декодирования и копирования в память.
+    Формат определяется по содержимому, а не по имени файла клиента.
+    """
+    max_size = max_size or settings.PEREVAL_MAX_IMAGE_SIZE
+    if upload.size > max_size:
+        raise ValidationError(f'Изображение больше допустимого размера ({max_size} байт)')
+    return sniff_extension(upload)
+
+
+# Форматы уменьшенных копий в порядке предпочтения при согласовании по Accept
+MODERN_FORMATS = ('avif', 'webp')
+
+
+def accepted_formats(accept):
+    """Современные форматы, явно перечисленные в заголовке Accept (с q > 0).
+
+    image/* и */* не учитываются: их присылают и клиенты, не умеющие
+    декодировать WebP/AVIF, а браузеры с поддержкой указывают форматы явно.
+    """
+    accepted = set()
+    for item in (accept or '').split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0 and media_type.startswith('image/'):
+            accepted.add(media_type[len('image/'):])
+    return tuple(name for name in MODERN_FORMATS if name in accepted)
+
+
+def negotiate_image(image, accepted):
+    """Изображение карточки с адресами в лучшем формате, который принимает клиент.
+
+    В карточке (и в кэше) хранятся адреса всех форматов; выбор делается
+    на каждый запрос и ничего не перекодирует.
+    """
+    sizes = {}
+    for size, formats in image['sizes'].items():
+        preferred = [name for name in accepted if name in formats]
+        fallback = [name for name in formats if name not in MODERN_FORMATS] or list(formats)
+        sizes[size] = formats[(preferred or fallback)[0]]
+    data = image['data']
+    data_format = os.path.splitext(data or '')[1].lstrip('.').lower()
+    if data_format in MODERN_FORMATS and data_format not in accepted and sizes:
+        # Полноразмерный WebP/AVIF клиенту без поддержки: самая крупная копия в JPEG/PNG
+        data = sizes.get('large') or list(sizes.values())[-1]
+    return {**image, 'data': data, 'sizes': sizes}
+
+
+def negotiate_perevals(perevals, accepted):
+    return [
+        {**pereval, 'images': [negotiate_image(image, accepted) for image in pereval['images']]}
+        for pereval in perevals
+    ]
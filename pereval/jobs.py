@@ -0,0 +1,116 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Обработчики задач по типу: заполняются декоратором handler
+HANDLERS = {}
+
+
+def handler(kind):
+    """Регистрация функции-обработчика задач типа kind"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payloads):
+    """Постановка задач в очередь одним INSERT.
+
+    Строки видны воркеру только после фиксации транзакции, в которой
+    они созданы, поэтому задача не начнется раньше записи ее данных.
+    При PEREVAL_JOBS_EAGER задачи выполняются в этом же процессе сразу
+    после фиксации - для разработки без запущенного воркера.
+    """
+    jobs = Job.objects.bulk_create([Job(kind=kind, payload=payload) for payload in payloads])
+    if settings.PEREVAL_JOBS_EAGER and jobs:
+        ids = [job.id for job in jobs]
+        transaction.on_commit(lambda: run_jobs(Job.objects.filter(id__in=ids)))
+    return jobs
+
+
+def claim(limit):
+    """Взять в работу до limit готовых задач.
+
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет нескольким воркерам
+    разбирать очередь, не ожидая друг друга и не беря одну задачу дважды.
+    """
+    now = timezone.now()
+    return claim_from(
+        Job.objects.filter(status=Job.StatusChoices.QUEUED, run_after__lte=now).order_by('run_after', 'id')[:limit],
+        now
+    )
+
+
+def claim_from(queryset, now=None):
+    now = now or timezone.now()
+    with transaction.atomic():
+        jobs = list(queryset.select_for_update(skip_locked=True))
+        # Условный UPDATE страхует СУБД без блокировок строк (SQLite)
+        claimed = set()
+        for job in jobs:
+            if Job.objects.filter(id=job.id, status=Job.StatusChoices.QUEUED).update(
+                status=Job.StatusChoices.RUNNING, locked_at=now, attempts=F('attempts') + 1, updated_at=now
+            ):
+                job.attempts += 1
+                claimed.add(job.id)
+    return [job for job in jobs if job.id in claimed]
+
+
+def run(job):
+    """Выполнение задачи; при ошибке - повтор с экспоненциальной задержкой"""
+    try:
+        HANDLERS[job.kind](**job.payload)
+    except Exception as e:
+        logger.exception('Задача %s завершилась с ошибкой', job)
+        now = timezone.now()
+        if job.attempts >= settings.PEREVAL_JOBS_MAX_ATTEMPTS:
+            Job.objects.filter(id=job.id).update(
+                status=Job.StatusChoices.FAILED, last_error=str(e), updated_at=now
+            )
+        else:
+            Job.objects.filter(id=job.id).update(
+                status=Job.StatusChoices.QUEUED,
+                run_after=now + timedelta(seconds=settings.PEREVAL_JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)),
+                last_error=str(e),
+                updated_at=now
+            )
+        return False
+    Job.objects.filter(id=job.id).update(status=Job.StatusChoices.DONE, updated_at=timezone.now())
+    return True
+
+
+def run_jobs(queryset):
+    """Выполнение задач из queryset, которые еще в очереди"""
+    jobs = claim_from(queryset.filter(status=Job.StatusChoices.QUEUED).order_by('id'))
+    for job in jobs:
+        run(job)
+    return len(jobs)
+
+
+def run_pending(batch_size=10):
+    """Выполнение всех готовых задач очереди, возвращает их число"""
+    done = 0
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return done
+        for job in jobs:
+            run(job)
+        done += len(jobs)
+
+
+def requeue_stale():
+    """Возврат в очередь задач, чей воркер завершился, не закончив их"""
+    deadline = timezone.now() - timedelta(seconds=settings.PEREVAL_JOBS_STALE_TIMEOUT)
+    return Job.objects.filter(status=Job.StatusChoices.RUNNING, locked_at__lt=deadline).update(
+        status=Job.StatusChoices.QUEUED, locked_at=None
+    )
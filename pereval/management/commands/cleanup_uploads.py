@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pereval import uploads
+from pereval.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Удаление брошенных сессий загрузки: недокачанных и не привязанных к перевалу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.PEREVAL_UPLOAD_SESSION_TTL)
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(
+            updated_at__lt=timezone.now() - timedelta(hours=options['hours']),
+            status__in=[UploadSession.StatusChoices.UPLOADING, UploadSession.StatusChoices.COMPLETE]
+        ).select_related('image')
+        removed = 0
+        for session in expired.iterator():
+            if session.image is not None:
+                # Файл удаляется вместе с последней ссылкой на его содержимое
+                session.image.delete()
+            uploads.remove_part(session)
+            session.delete()
+            removed += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий загрузки: {removed}'))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from pereval.models import Image
+from pereval.processing import enqueue_images, modern_formats
+
+
+class Command(BaseCommand):
+    help = 'Постановка в очередь обработки изображений без полного набора уменьшенных копий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        images = (
+            Image.objects
+            .exclude(processing_status=Image.ProcessingChoices.FAILED)
+            .annotate(variant_count=Count('variants'))
+            .filter(variant_count__lt=len(settings.PEREVAL_IMAGE_SIZES) * (1 + len(modern_formats())))
+            .only('id')
+        )
+        queued = 0
+        chunk = []
+        for image in images.iterator(chunk_size=options['chunk_size']):
+            chunk.append(image)
+            if len(chunk) == options['chunk_size']:
+                queued += len(enqueue_images(chunk))
+                chunk = []
+        queued += len(enqueue_images(chunk))
+        self.stdout.write(self.style.SUCCESS(f'Поставлено в очередь изображений: {queued}'))
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pereval.profiling import profile_token
+
+
+class Command(BaseCommand):
+    help = 'Токен для заголовка X-Pereval-Profile: профилирование отдельного запроса'
+
+    def handle(self, *args, **options):
+        self.stdout.write(profile_token())
+        self.stderr.write(f'Действует {settings.PEREVAL_PROFILE_TOKEN_TTL} с, профили пишутся в '
+                          f'{settings.PEREVAL_PROFILE_DIR or "(PEREVAL_PROFILE_DIR не задан)"}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pereval import tiles
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчет предрасчитанных кластеров карты по всем перевалам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tiles.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('Кластеры карты пересчитаны'))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pereval import jobs
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновых задач: обработка загруженных изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза при пустой очереди, секунды')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            jobs.requeue_stale()
+            done = jobs.run_pending(options['batch_size'])
+            if done:
+                self.stdout.write(f'Выполнено задач: {done}')
+            if options['once']:
+                break
+            if not done:
+                time.sleep(options['sleep'])
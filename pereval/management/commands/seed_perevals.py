@@ -0,0 +1,215 @@
+import io
+import itertools
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image as PILImage
+
+from pereval import blobs, processing, tiles
+from pereval.geo import geohash_encode
+from pereval.models import User, Coords, Level, PerevalAdded, Image, ImageVariant, PerevalImage, SyncSequence
+from pereval.storage import image_storage
+
+# Горные районы: широта, долгота (границы), высоты перевалов, доля перевалов и известные названия
+MOUNTAIN_RANGES = [
+    ('Кавказ', (42.6, 43.6), (40.5, 46.0), (2200, 4200), 30,
+     ['Джантуган', 'Бечо', 'Донгуз-Орун', 'Твибер', 'Местийский', 'Чипер-Азау', 'Гандарайский', 'Кашкаташ']),
+    ('Алтай', (49.3, 50.5), (85.5, 89.0), (2000, 3800), 15,
+     ['Каратюрек', 'Кара-Тюрек', 'Томских Геологов', 'Делоне', 'Маашей', 'Текелю']),
+    ('Тянь-Шань', (41.5, 43.2), (74.0, 80.5), (3000, 4800), 12,
+     ['Талгарский', 'Аксу', 'Туюксу', 'Озерный', 'Кок-Джар', 'Иныльчек']),
+    ('Памир', (37.5, 39.5), (71.5, 74.5), (3800, 5600), 8,
+     ['Ак-Байтал', 'Кызыл-Арт', 'Тахтакорум', 'Кашал-Аяк', 'Федченко']),
+    ('Альпы', (44.5, 47.5), (6.5, 13.5), (1800, 3600), 10,
+     ['Сен-Бернар', 'Симплон', 'Сен-Готард', 'Стельвио', 'Фурка', 'Гримзель']),
+    ('Саяны', (51.5, 53.5), (94.0, 101.0), (1600, 3000), 7,
+     ['Аршанский', 'Ледяной', 'Кинзелюкский', 'Мунку-Сардык', 'Орликский']),
+    ('Урал', (54.0, 62.5), (57.5, 60.5), (600, 1600), 8,
+     ['Дятлова', 'Манарага', 'Народный', 'Таганай', 'Иремель', 'Ямантау']),
+    ('Хибины', (67.5, 68.0), (33.0, 34.2), (600, 1100), 5,
+     ['Ферсмана', 'Юмъечорр', 'Рамзая', 'Северный Чорргор', 'Кукисвумчорр']),
+    ('Крым', (44.4, 44.9), (33.7, 35.1), (500, 1300), 5,
+     ['Ангарский', 'Гурзуфское седло', 'Шайтан-Мердвен', 'Байдарский']),
+]
+
+FAMILIES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков']
+# Имена и отчества: мужские и женские (фамилия женщины - с окончанием -а)
+PEOPLE = [
+    (['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей'],
+     ['Александрович', 'Сергеевич', 'Игоревич', 'Викторович', ''], ''),
+    (['Мария', 'Анна', 'Елена', 'Ольга', 'Наталья'],
+     ['Александровна', 'Сергеевна', 'Игоревна', 'Викторовна', ''], 'а'),
+]
+
+# Категории трудности ФСТР: легкие встречаются чаще сложных
+CATEGORIES = ['н/к', '1А', '1Б', '2А', '2Б', '3А', '3Б']
+CATEGORY_WEIGHTS = [10, 28, 24, 16, 11, 7, 4]
+STATUSES = [choice.value for choice in PerevalAdded.StatusChoices]
+STATUS_WEIGHTS = [55, 10, 30, 5]
+
+PLACEHOLDER_COUNT = 16
+
+
+def placeholders():
+    """Крошечные JPEG разных цветов: файлы-заглушки для всех сгенерированных изображений"""
+    files = []
+    for i in range(PLACEHOLDER_COUNT):
+        output = io.BytesIO()
+        PILImage.new('RGB', (8, 6), (40 + i * 12, 90 + i * 5, 160 - i * 6)).save(output, 'JPEG')
+        files.append(ContentFile(output.getvalue(), name=f'placeholder_{i}.jpg'))
+    return files
+
+
+def placeholder_variants(files):
+    """Копии заглушек всех размеров PEREVAL_IMAGE_SIZES и форматов, как после фоновой обработки.
+
+    Файлы пишутся один раз (повторный запуск находит их в хранилище), строки
+    ImageVariant всех изображений ссылаются на них. Возвращает для каждой
+    заглушки список (размер, формат, имя файла, ширина, высота).
+    """
+    storage = image_storage()
+    result = []
+    for i, file in enumerate(files):
+        with PILImage.open(io.BytesIO(file.read())) as picture:
+            picture.load()
+        file.seek(0)
+        formats = [processing.fallback_format(picture), *processing.modern_formats()]
+        variants = []
+        for size, max_side in settings.PEREVAL_IMAGE_SIZES.items():
+            resized = picture.copy()
+            resized.thumbnail((max_side, max_side), PILImage.LANCZOS)
+            for image_format in formats:
+                name = storage.generate_filename(f'{processing.VARIANT_DIR}/placeholder_{i}_{max_side}.{image_format}')
+                if not storage.exists(name):
+                    name = storage.save(name, ContentFile(processing.encode(resized, image_format)))
+                variants.append((size, image_format, name, resized.width, resized.height))
+        result.append(variants)
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Синтетические перевалы для нагрузочного тестирования: координаты реальных горных районов, '
+        'неравномерное число перевалов у пользователей, обработанные изображения-заглушки с уменьшенными '
+        'копиями. Вставка пачками bulk_create'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, required=True, help='Число перевалов')
+        parser.add_argument('--images-per', type=int, default=2, help='Изображений у перевала')
+        parser.add_argument('--users', type=int, help='Число пользователей (по умолчанию count / 5)')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Показатель закона Ципфа для числа перевалов у пользователя')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора: одинаковые данные при повторе')
+        parser.add_argument('--skip-tiles', action='store_true',
+                            help='Не пересчитывать кластеры карты (потом - manage.py rebuild_tiles)')
+
+    def handle(self, *args, **options):
+        count, images_per, chunk_size = options['count'], options['images_per'], options['chunk_size']
+        if count < 1 or images_per < 0 or chunk_size < 1:
+            raise CommandError('count и chunk-size должны быть положительными, images-per - неотрицательным')
+        rnd = random.Random(options['seed'])
+        started = time.perf_counter()
+
+        users = self.create_users(rnd, options['users'] or max(1, count // 5), chunk_size)
+        # Закон Ципфа: у пользователя ранга r доля перевалов ~ 1 / r^skew
+        user_weights = list(itertools.accumulate(1 / rank ** options['skew'] for rank in range(1, len(users) + 1)))
+        range_weights = list(itertools.accumulate(mountain[4] for mountain in MOUNTAIN_RANGES))
+        files = placeholders()
+        variants = placeholder_variants(files) if images_per else []
+
+        for start in range(0, count, chunk_size):
+            size = min(chunk_size, count - start)
+            with transaction.atomic():
+                self.create_chunk(rnd, size, images_per, users, user_weights, range_weights, files, variants)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{start + size} / {count}')
+
+        if not options['skip_tiles']:
+            with transaction.atomic():
+                tiles.rebuild(chunk_size=chunk_size)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано перевалов: {count}, изображений: {count * images_per}, пользователей: {len(users)} '
+            f'за {elapsed:.1f} с ({count / elapsed:.0f} перевалов/с)'
+        ))
+
+    @staticmethod
+    def create_users(rnd, count, chunk_size):
+        # Префикс запуска: адреса не совпадают с уже существующими, даже если часть
+        # пользователей удалена или повторный запуск идет с тем же --seed
+        run = uuid.uuid4().hex[:8]
+        users = []
+        for i in range(count):
+            names, patronymics, ending = rnd.choice(PEOPLE)
+            users.append(User(
+                email=f'seed-{run}-{i}@example.com', fam=rnd.choice(FAMILIES) + ending, name=rnd.choice(names),
+                otc=rnd.choice(patronymics), phone=f'+7{rnd.randrange(9000000000, 9999999999)}'
+            ))
+        users = User.objects.bulk_create(users, batch_size=chunk_size)
+        return [user.id for user in users]
+
+    @staticmethod
+    def create_chunk(rnd, size, images_per, users, user_weights, range_weights, files, variants):
+        mountains = rnd.choices(MOUNTAIN_RANGES, cum_weights=range_weights, k=size)
+        owners = rnd.choices(users, cum_weights=user_weights, k=size)
+
+        coords = []
+        for _, (lat_min, lat_max), (lon_min, lon_max), (height_min, height_max), _, _ in mountains:
+            latitude, longitude = rnd.uniform(lat_min, lat_max), rnd.uniform(lon_min, lon_max)
+            coords.append(Coords(
+                latitude=latitude, longitude=longitude, height=rnd.randint(height_min, height_max),
+                geohash=geohash_encode(latitude, longitude)
+            ))
+        coords = Coords.objects.bulk_create(coords)
+
+        levels = []
+        for _ in range(size):
+            summer = rnd.choices(CATEGORIES, weights=CATEGORY_WEIGHTS)[0]
+            # Зимой перевал на полкатегории-категорию сложнее или не проходится
+            winter = CATEGORIES[min(CATEGORIES.index(summer) + rnd.randint(1, 2), len(CATEGORIES) - 1)]
+            levels.append(Level(
+                summer=summer, autumn=summer, spring=rnd.choice([summer, winter]),
+                winter=winter if rnd.random() < 0.6 else ''
+            ))
+        levels = Level.objects.bulk_create(levels)
+
+        statuses = rnd.choices(STATUSES, weights=STATUS_WEIGHTS, k=size)
+        first_seq = SyncSequence.allocate(size) - size + 1
+        perevals = PerevalAdded.objects.bulk_create([
+            PerevalAdded(
+                beauty_title='пер.', title=rnd.choice(mountain[5]),
+                other_titles=mountain[0], connect='', status=status, change_seq=first_seq + i,
+                user_id=owner, coords=coord, level=level
+            )
+            for i, (mountain, owner, status, coord, level) in enumerate(zip(mountains, owners, statuses, coords, levels))
+        ])
+
+        if images_per:
+            # Содержимое общее (несколько blob-заглушек), строки Image у каждого перевала свои.
+            # Изображения уже обработаны: статус ready и уменьшенные копии, как после process_image
+            picks = [rnd.randrange(len(files)) for _ in range(size * images_per)]
+            stored = blobs.store_many([(files[pick], 'jpg') for pick in picks])
+            images = Image.objects.bulk_create([
+                Image(
+                    title=f'Фото {i % images_per + 1}', data=blob.file.name, blob=blob,
+                    processing_status=Image.ProcessingChoices.READY
+                )
+                for i, blob in enumerate(stored)
+            ])
+            PerevalImage.objects.bulk_create([
+                PerevalImage(pereval=perevals[i // images_per], image=image) for i, image in enumerate(images)
+            ])
+            ImageVariant.objects.bulk_create([
+                ImageVariant(
+                    image=image, size=size_name, format=image_format, file=name, width=width, height=height
+                )
+                for image, pick in zip(images, picks)
+                for size_name, image_format, name, width, height in variants[pick]
+            ], batch_size=5000)
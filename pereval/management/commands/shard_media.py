@@ -0,0 +1,101 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pereval.models import Image, ImageBlob, ImageVariant, PerevalAdded, PerevalImage
+from pereval.signals import invalidate_after_commit
+from pereval.storage import image_storage, sharded_name
+
+
+def copy_file(storage, old, new):
+    """Копия файла под новым именем: жесткая ссылка на той же ФС, иначе копирование через хранилище"""
+    if storage.exists(new):
+        # Копия осталась от прерванного запуска
+        return
+    try:
+        old_path, new_path = storage.path(old), storage.path(new)
+    except NotImplementedError:
+        with storage.open(old, 'rb') as content:
+            storage.save(new, content)
+        return
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    try:
+        os.link(old_path, new_path)
+    except OSError:
+        with storage.open(old, 'rb') as content:
+            storage.save(new, content)
+
+
+class Command(BaseCommand):
+    help = 'Перенос файлов изображений в подкаталоги по хешу имени (без остановки сервиса)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.0, help='Пауза между пачками, секунды')
+
+    def handle(self, *args, **options):
+        storage = image_storage()
+        moved = 0
+        # Image с blob хранит то же имя, что и blob, и переносится вместе с ним
+        sources = [
+            (ImageBlob.objects.all(), 'file'),
+            (Image.objects.filter(blob__isnull=True), 'data'),
+            (ImageVariant.objects.all(), 'file'),
+        ]
+        for queryset, field in sources:
+            last_id = 0
+            while True:
+                rows = list(
+                    queryset.filter(id__gt=last_id).order_by('id').values_list('id', field)[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                moved += self.move_batch(storage, queryset.model, field, rows)
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Перенесено файлов: {moved}'))
+
+    def move_batch(self, storage, model, field, rows):
+        """Перенос пачки: копия, смена имени в БД, удаление старого файла после фиксации.
+
+        До фиксации читатели получают старое имя, и старый файл еще на месте,
+        поэтому перенос не прерывает отдачу изображений.
+        """
+        renames = {}
+        for _, name in rows:
+            if name and name not in renames and sharded_name(name) != name:
+                try:
+                    copy_file(storage, name, sharded_name(name))
+                except FileNotFoundError:
+                    self.stderr.write(f'Файл не найден: {name}')
+                    continue
+                renames[name] = sharded_name(name)
+        if not renames:
+            return 0
+
+        with transaction.atomic():
+            image_ids = set()
+            for old, new in renames.items():
+                # Один файл может принадлежать нескольким строкам (общие копии размеров)
+                owners = model.objects.filter(**{field: old})
+                if model is ImageBlob:
+                    images = Image.objects.filter(blob__in=owners)
+                    image_ids.update(images.values_list('id', flat=True))
+                    images.update(data=new)
+                elif model is Image:
+                    image_ids.update(owners.values_list('id', flat=True))
+                else:
+                    image_ids.update(owners.values_list('image_id', flat=True))
+                owners.update(**{field: new})
+
+            # Новые адреса в карточках: сброс кэша и новый номер изменения для синхронизации
+            pereval_ids = list(
+                PerevalImage.objects.filter(image_id__in=image_ids).values_list('pereval_id', flat=True)
+            )
+            PerevalAdded.touch(pereval_ids)
+            invalidate_after_commit(pereval_ids)
+            transaction.on_commit(lambda: [storage.delete(old) for old in renames])
+        return len(renames)
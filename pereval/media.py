@@ -0,0 +1,128 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views import static
+
+from .storage import image_storage
+
+# Имена по хешу содержимого (blob и его уменьшенные копии) никогда не меняют содержимое
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{40,64}[._]')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """Диапазон байт (start, end) включительно из заголовка Range.
+
+    None - заголовок не задан или не поддерживается (несколько диапазонов):
+    отдается весь файл. ValueError - диапазон вне файла (ответ 416).
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # bytes=-N: последние N байт
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def cache_headers(response, name, etag, mtime):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if CONTENT_ADDRESSED.match(posixpath.basename(name)):
+        response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={settings.PEREVAL_MEDIA_MAX_AGE}'
+    return response
+
+
+def serve_media(request, path):
+    """Отдача файлов изображений из MEDIA_ROOT.
+
+    Режим PEREVAL_MEDIA_MODE:
+    - '' - как раньше: django.views.static только при DEBUG;
+    - 'django' - отдача из Python с ETag, Range и долгим кэшированием;
+    - 'x-accel-redirect' / 'x-sendfile' - Python только проверяет запрос
+      и ставит заголовки, байты файла отдает nginx / Apache.
+    """
+    mode = settings.PEREVAL_MEDIA_MODE
+    if not mode:
+        if not settings.DEBUG:
+            raise Http404
+        return static.serve(request, path, document_root=settings.MEDIA_ROOT)
+
+    name = posixpath.normpath(path).lstrip('/')
+    if name.startswith('..') or '\x00' in name:
+        raise Http404
+    try:
+        full_path = image_storage().path(name)
+        stat = os.stat(full_path)
+    except (NotImplementedError, FileNotFoundError, NotADirectoryError):
+        raise Http404
+    upload_dir = os.path.join(os.path.abspath(settings.PEREVAL_UPLOAD_DIR), '')
+    if not os.path.isfile(full_path) or full_path.startswith(upload_dir):
+        # Недокачанные части возобновляемых загрузок не отдаются
+        raise Http404
+
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return cache_headers(not_modified, name, etag, stat.st_mtime)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if mode == 'x-accel-redirect':
+        # nginx сам обработает Range по внутреннему location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.PEREVAL_MEDIA_ACCEL_PREFIX + name
+        return cache_headers(response, name, etag, stat.st_mtime)
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return cache_headers(response, name, etag, stat.st_mtime)
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        # FileResponse использует wsgi.file_wrapper (sendfile в gunicorn)
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(full_path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = end - start + 1
+    return cache_headers(response, name, etag, stat.st_mtime)
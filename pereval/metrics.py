@@ -0,0 +1,270 @@
+"""Метрики запросов: задержка, SQL-запросы и сериализация по маршрутам.
+
+RequestMetricsMiddleware пишет гистограммы по паре (маршрут, метод),
+представление metrics отдает их в текстовом формате Prometheus. Счетчики
+хранятся в памяти процесса: при нескольких воркерах gunicorn Prometheus
+опрашивает каждый из них (или их суммирует балансировщик). Эндпоинт
+открыт только адресам PEREVAL_METRICS_ALLOWED_IPS или с токеном
+PEREVAL_METRICS_TOKEN в заголовке Authorization: Bearer.
+"""
+import bisect
+import hmac
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+METRICS = {
+    'pereval_request_duration_seconds': ('Время обработки запроса', LATENCY_BUCKETS),
+    'pereval_db_queries': ('Число SQL-запросов на запрос', QUERY_BUCKETS),
+    'pereval_db_duration_seconds': ('Время SQL-запросов на запрос', LATENCY_BUCKETS),
+    'pereval_render_duration_seconds': ('Время сериализации ответа в JSON', LATENCY_BUCKETS),
+}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Последняя ячейка - значения больше всех границ (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+
+def observe(shard, route, method, values):
+    """Значения одного запроса в порядке METRICS (None - не измерено) - в часть потока shard"""
+    histograms = shard.get((route, method))
+    if histograms is None:
+        histograms = shard[route, method] = [Histogram(buckets) for _, buckets in METRICS.values()]
+    # Горячий путь: без вызова метода на каждую гистограмму
+    for histogram, value in zip(histograms, values):
+        if value is not None:
+            histogram.counts[bisect.bisect_left(histogram.buckets, value)] += 1
+            histogram.sum += value
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_bound(bound):
+    return repr(float(bound))
+
+
+class MetricsRegistry:
+    """Гистограммы по маршрутам без блокировки на горячем пути.
+
+    Каждый поток пишет в свою часть (shard): (маршрут, метод) -> список
+    гистограмм в порядке METRICS. Блокировка берется только при первом запросе
+    потока, чтобы зарегистрировать его часть, и при чтении списка частей.
+    snapshot складывает части; наблюдение, которое поток пишет в этот
+    момент, может попасть в следующий опрос - для Prometheus это неважно.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+
+    def shard(self):
+        """Часть текущего потока: (маршрут, метод) -> гистограммы"""
+        try:
+            return self._local.series
+        except AttributeError:
+            shard = self._local.series = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def observe(self, route, method, values):
+        """Значения одного запроса в порядке METRICS (None - не измерено)"""
+        observe(self.shard(), route, method, values)
+
+    def snapshot(self):
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            # list() копирует пары разом: поток может добавить маршрут во время обхода
+            for (route, method), histograms in list(shard.items()):
+                for name, histogram in zip(METRICS, histograms):
+                    if not any(histogram.counts):
+                        continue
+                    counts, total = merged.get((name, route, method), ([0] * len(histogram.counts), 0.0))
+                    merged[name, route, method] = (
+                        [a + b for a, b in zip(counts, histogram.counts)], total + histogram.sum
+                    )
+        return merged
+
+    def exposition(self):
+        """Текстовый формат Prometheus 0.0.4"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, (description, buckets) in METRICS.items():
+            series = sorted((key[1:], value) for key, value in snapshot.items() if key[0] == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (route, method), (counts, total) in series:
+                labels = f'route="{escape_label(route)}",method="{escape_label(method)}"'
+                cumulative = 0
+                for bound, count in zip((*map(format_bound, buckets), '+Inf'), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {total!r}')
+                lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+registry = MetricsRegistry()
+
+
+class QueryTimer:
+    """execute_wrapper: число и суммарное время SQL-запросов"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else '<unmatched>'
+
+
+class RequestMetricsMiddleware:
+    """Гистограммы задержки, SQL и сериализации по маршруту и методу.
+
+    Ставится первым в MIDDLEWARE. Время сериализации замеряет
+    FastJSONRenderer (атрибут render_duration ответа DRF): отдельный хук
+    process_template_response стоил бы каждому запросу еще два вызова. SQL
+    считается и под ASGI (см. __acall__). PEREVAL_SERVER_TIMING=1 добавляет те
+    же значения в заголовок Server-Timing.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PEREVAL_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = settings.PEREVAL_SERVER_TIMING
+        self.local = threading.local()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        try:
+            timer, shard = self.local.state
+        except AttributeError:
+            timer, shard = self.local.state = self.thread_state()
+        timer.count = 0
+        timer.duration = 0.0
+        response = self.get_response(request)
+        duration = time.perf_counter() - started
+        render_duration = getattr(response, 'render_duration', None)
+        observe(shard, route_of(request), request.method, (duration, timer.count, timer.duration, render_duration))
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(duration, timer, render_duration)
+        return response
+
+    @staticmethod
+    def thread_state():
+        """Таймер SQL и часть реестра текущего потока.
+
+        Доступ к django.db.connection идет через asgiref.Local и стоит
+        несколько микросекунд, поэтому таймер ставится в execute_wrappers
+        один раз на поток, а на каждый запрос только обнуляется. Часть
+        реестра тоже берется один раз: запрос пишет в нее без блокировок.
+        """
+        timer = QueryTimer()
+        connection.execute_wrappers.append(timer)
+        return timer, registry.shard()
+
+    async def __acall__(self, request):
+        """Запрос под ASGI.
+
+        Соединения с БД у Django свои в каждом потоке, а ORM запроса под ASGI
+        работает в потоке sync_to_async (thread_sensitive) этого запроса.
+        Поэтому таймер ставится в execute_wrappers соединения того потока:
+        один переход в поток на запрос. Снимается он уже отсюда - запросы к
+        БД к этому моменту закончены.
+        """
+        started = time.perf_counter()
+        timer = QueryTimer()
+        wrappers = await sync_to_async(install_timer)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrappers.remove(timer)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def record(self, request, response, duration, timer):
+        render_duration = getattr(response, 'render_duration', None)
+        registry.observe(route_of(request), request.method, (duration, timer.count, timer.duration, render_duration))
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(duration, timer, render_duration)
+
+
+def install_timer(timer):
+    """Таймер в execute_wrappers соединения текущего потока, возвращает список оберток"""
+    connection.execute_wrappers.append(timer)
+    return connection.execute_wrappers
+
+
+def server_timing(duration, timer, render_duration):
+    timings = [f'db;dur={timer.duration * 1000:.2f};desc="{timer.count} queries"']
+    if render_duration is not None:
+        timings.append(f'render;dur={render_duration * 1000:.2f}')
+    timings.append(f'total;dur={duration * 1000:.2f}')
+    return ', '.join(timings)
+
+
+def metrics_allowed(request):
+    """Токен из PEREVAL_METRICS_TOKEN или адрес клиента из PEREVAL_METRICS_ALLOWED_IPS"""
+    token = settings.PEREVAL_METRICS_TOKEN
+    if token:
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(value.encode(), token.encode()):
+            return True
+    # REMOTE_ADDR, а не X-Forwarded-For: заголовок подделывается клиентом
+    return request.META.get('REMOTE_ADDR') in settings.PEREVAL_METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    """Гистограммы запросов текущего процесса в формате Prometheus"""
+    if not settings.PEREVAL_METRICS:
+        raise Http404
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
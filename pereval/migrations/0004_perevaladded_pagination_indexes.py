@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0003_alter_perevaladded_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['user', '-add_time', '-id'], name='pereval_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['status', '-add_time', '-id'], name='pereval_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['-add_time', '-id'], name='pereval_time_idx'),
+        ),
+    ]
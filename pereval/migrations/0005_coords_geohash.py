@@ -0,0 +1,35 @@
+# Generated by Django 5.2.2 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+from pereval.geo import geohash_encode
+
+
+def fill_geohash(apps, schema_editor):
+    """Заполнение geohash для уже существующих координат пачками"""
+    Coords = apps.get_model('pereval', 'Coords')
+    batch = []
+    for coords in Coords.objects.only('id', 'latitude', 'longitude').iterator(chunk_size=2000):
+        coords.geohash = geohash_encode(coords.latitude, coords.longitude)
+        batch.append(coords)
+        if len(batch) == 2000:
+            Coords.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Coords.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0004_perevaladded_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coords',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12, verbose_name='Geohash'),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
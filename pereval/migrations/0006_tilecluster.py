@@ -0,0 +1,30 @@
+# Generated by Django 5.2.2 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0005_coords_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TileCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField(verbose_name='Масштаб')),
+                ('cell_x', models.IntegerField(verbose_name='Ячейка X')),
+                ('cell_y', models.IntegerField(verbose_name='Ячейка Y')),
+                ('count', models.IntegerField(default=0, verbose_name='Число перевалов')),
+                ('sum_lat', models.FloatField(default=0.0, verbose_name='Сумма широт')),
+                ('sum_lon', models.FloatField(default=0.0, verbose_name='Сумма долгот')),
+            ],
+            options={
+                'verbose_name': 'Кластер карты',
+                'verbose_name_plural': 'Кластеры карты',
+                'constraints': [models.UniqueConstraint(fields=('zoom', 'cell_x', 'cell_y'), name='tile_cluster_cell_unique')],
+            },
+        ),
+    ]
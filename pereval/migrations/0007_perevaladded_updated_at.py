@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    """Для существующих записей дата изменения равна дате добавления"""
+    PerevalAdded = apps.get_model('pereval', 'PerevalAdded')
+    PerevalAdded.objects.update(updated_at=models.F('add_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0006_tilecluster'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.2 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+def number_existing_perevals(apps, schema_editor):
+    """Существующие перевалы нумеруются по id, счетчик продолжает нумерацию"""
+    PerevalAdded = apps.get_model('pereval', 'PerevalAdded')
+    SyncSequence = apps.get_model('pereval', 'SyncSequence')
+    PerevalAdded.objects.update(change_seq=models.F('id'))
+    last = PerevalAdded.objects.aggregate(last=models.Max('id'))['last'] or 0
+    SyncSequence.objects.create(id=1, value=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0007_perevaladded_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerevalTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pereval_id', models.BigIntegerField(verbose_name='ID перевала')),
+                ('email', models.EmailField(max_length=254, verbose_name='Email пользователя')),
+                ('change_seq', models.BigIntegerField(verbose_name='Номер изменения')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')),
+            ],
+            options={
+                'verbose_name': 'Удаленный перевал',
+                'verbose_name_plural': 'Удаленные перевалы',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик изменений',
+                'verbose_name_plural': 'Счетчики изменений',
+            },
+        ),
+        migrations.AddField(
+            model_name='perevaladded',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, verbose_name='Номер изменения'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['user', 'change_seq'], name='pereval_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaltombstone',
+            index=models.Index(fields=['email', 'change_seq'], name='tombstone_email_seq_idx'),
+        ),
+        migrations.RunPython(number_existing_perevals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.2 on 2026-10-18 15:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0010_image_processing_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(max_length=20, verbose_name='Размер')),
+                ('format', models.CharField(max_length=10, verbose_name='Формат')),
+                ('file', models.ImageField(upload_to='pereval_images/variants/', verbose_name='Файл')),
+                ('width', models.PositiveIntegerField(verbose_name='Ширина')),
+                ('height', models.PositiveIntegerField(verbose_name='Высота')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='pereval.image', verbose_name='Изображение')),
+            ],
+            options={
+                'verbose_name': 'Размер изображения',
+                'verbose_name_plural': 'Размеры изображений',
+                'constraints': [models.UniqueConstraint(fields=('image', 'size', 'format'), name='image_variant_unique')],
+            },
+        ),
+    ]
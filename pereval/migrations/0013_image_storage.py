@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-18 15:18
+
+import pereval.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0012_imageblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='data',
+            field=models.ImageField(max_length=255, storage=pereval.storage.image_storage, upload_to='pereval_images/', verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='imageblob',
+            name='file',
+            field=models.FileField(max_length=255, storage=pereval.storage.image_storage, upload_to='', verbose_name='Файл'),
+        ),
+        migrations.AlterField(
+            model_name='imagevariant',
+            name='file',
+            field=models.ImageField(max_length=255, storage=pereval.storage.image_storage, upload_to='pereval_images/variants/', verbose_name='Файл'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from pereval import tiles
+
+
+def backfill_tile_clusters(apps, schema_editor):
+    """Кластеры перевалов, добавленных до появления TileCluster (0006 создала пустую таблицу).
+
+    Без них move_point и remove_points уводили бы счетчики ячеек в минус.
+    Пересчет с нуля, поэтому безопасен и для баз, где кластеры уже ведутся.
+    """
+    tiles.rebuild(
+        pereval_model=apps.get_model('pereval', 'PerevalAdded'),
+        cluster_model=apps.get_model('pereval', 'TileCluster'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0013_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_tile_clusters, migrations.RunPython.noop),
+    ]
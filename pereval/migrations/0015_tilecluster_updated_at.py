@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0014_tilecluster_backfill'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tilecluster',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+    ]
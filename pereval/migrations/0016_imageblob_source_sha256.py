@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pereval', '0015_tilecluster_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='source_sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='SHA-256 исходной загрузки'),
+        ),
+    ]
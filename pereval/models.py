@@ -1,5 +1,10 @@
-from django.db import models
+import uuid
+
+from django.db import connection, models, transaction
 from django.core.validators import EmailValidator
+from django.utils import timezone
+from .geo import geohash_encode
+from .storage import image_storage
 
 
 class User(models.Model):
@@ -21,6 +26,8 @@ class Coords(models.Model):
     latitude = models.FloatField(verbose_name='Широта')
     longitude = models.FloatField(verbose_name='Долгота')
     height = models.IntegerField(verbose_name='Высота')
+    # Geohash точки: пространственный индекс на обычном B-tree без PostGIS
+    geohash = models.CharField(max_length=12, db_index=True, blank=True, default='', verbose_name='Geohash')
 
     class Meta:
         verbose_name = 'Координаты'
@@ -29,6 +36,13 @@ class Coords(models.Model):
     def __str__(self):
         return f"Широта: {self.latitude}, Долгота: {self.longitude}, Высота: {self.height}"
 
+    def save(self, *args, **kwargs):
+        self.geohash = geohash_encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'geohash' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'geohash']
+        super().save(*args, **kwargs)
+
 
 class Level(models.Model):
     winter = models.CharField(max_length=10, blank=True, null=True, verbose_name='Зима')
@@ -45,9 +59,27 @@ class Level(models.Model):
 
 
 class Image(models.Model):
-    data = models.ImageField(upload_to='pereval_images/', verbose_name='Изображение')
+    class ProcessingChoices(models.TextChoices):
+        PENDING = 'pending', 'Ожидает обработки'
+        PROCESSING = 'processing', 'Обрабатывается'
+        READY = 'ready', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    data = models.ImageField(
+        upload_to='pereval_images/', storage=image_storage, max_length=255, verbose_name='Изображение'
+    )
     title = models.CharField(max_length=255, verbose_name='Название')
     date_added = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
+    # Проверка, очистка EXIF и пересжатие выполняются фоновой задачей
+    processing_status = models.CharField(
+        max_length=10, choices=ProcessingChoices, default='pending', verbose_name='Статус обработки'
+    )
+    processing_error = models.TextField(blank=True, default='', verbose_name='Ошибка обработки')
+    # Общий файл с тем же содержимым; data указывает на файл blob
+    blob = models.ForeignKey(
+        'ImageBlob', on_delete=models.PROTECT, null=True, blank=True, related_name='images',
+        verbose_name='Содержимое'
+    )
 
     class Meta:
         verbose_name = 'Изображение'
@@ -70,7 +102,10 @@ class PerevalAdded(models.Model):
     other_titles = models.CharField(max_length=255, blank=True, null=True, verbose_name='Другие названия')
     connect = models.TextField(blank=True, null=True, verbose_name='Что соединяет')
     add_time = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
     status = models.CharField(max_length=10, choices=StatusChoices, default='new', verbose_name='Статус')
+    # Номер последнего изменения для дельта-синхронизации, растет монотонно
+    change_seq = models.BigIntegerField(default=0, verbose_name='Номер изменения')
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pereval', verbose_name='Пользователь')
     coords = models.ForeignKey(Coords, on_delete=models.CASCADE, verbose_name='Координаты')
@@ -80,10 +115,44 @@ class PerevalAdded(models.Model):
     class Meta:
         verbose_name = 'Перевал'
         verbose_name_plural = 'Перевалы'
+        # Составные индексы под keyset-пагинацию по (add_time, id)
+        indexes = [
+            models.Index(fields=['user', '-add_time', '-id'], name='pereval_user_time_idx'),
+            models.Index(fields=['status', '-add_time', '-id'], name='pereval_status_time_idx'),
+            models.Index(fields=['-add_time', '-id'], name='pereval_time_idx'),
+            models.Index(fields=['user', 'change_seq'], name='pereval_user_seq_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Номер изменения берется в той же транзакции, что и запись строки
+        with transaction.atomic(savepoint=False):
+            self.change_seq = SyncSequence.allocate()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'change_seq', 'updated_at'}
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def touch(cls, pereval_ids):
+        """Отметка изменения перевалов без save(): новые updated_at и номера изменений.
+
+        Два запроса на любое число перевалов. Сигналы не отправляются,
+        кэш карточек сбрасывает вызывающий код.
+        """
+        pereval_ids = sorted(set(pereval_ids))
+        if not pereval_ids:
+            return
+        with transaction.atomic(savepoint=False):
+            first_seq = SyncSequence.allocate(len(pereval_ids)) - len(pereval_ids) + 1
+            now = timezone.now()
+            cls.objects.bulk_update(
+                [cls(id=pereval_id, change_seq=first_seq + i, updated_at=now) for i, pereval_id in enumerate(pereval_ids)],
+                ['change_seq', 'updated_at']
+            )
+
 
 class PerevalImage(models.Model):
     pereval = models.ForeignKey(PerevalAdded, on_delete=models.CASCADE)
@@ -91,4 +160,174 @@ class PerevalImage(models.Model):
 
     class Meta:
         verbose_name = 'Изображение перевала'
-        verbose_name_plural = 'Изображения перевалов'
\ No newline at end of file
+        verbose_name_plural = 'Изображения перевалов'
+
+
+# Предрасчитанный кластер перевалов: ячейка сетки на заданном масштабе карты
+class TileCluster(models.Model):
+    zoom = models.PositiveSmallIntegerField(verbose_name='Масштаб')
+    cell_x = models.IntegerField(verbose_name='Ячейка X')
+    cell_y = models.IntegerField(verbose_name='Ячейка Y')
+    count = models.IntegerField(default=0, verbose_name='Число перевалов')
+    sum_lat = models.FloatField(default=0.0, verbose_name='Сумма широт')
+    sum_lon = models.FloatField(default=0.0, verbose_name='Сумма долгот')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Кластер карты'
+        verbose_name_plural = 'Кластеры карты'
+        constraints = [
+            models.UniqueConstraint(fields=['zoom', 'cell_x', 'cell_y'], name='tile_cluster_cell_unique'),
+        ]
+
+    def __str__(self):
+        return f"z{self.zoom} ({self.cell_x}, {self.cell_y}): {self.count}"
+
+
+# Счетчик изменений для синхронизации офлайн-клиентов (одна строка)
+class SyncSequence(models.Model):
+    value = models.BigIntegerField(default=0, verbose_name='Значение')
+
+    class Meta:
+        verbose_name = 'Счетчик изменений'
+        verbose_name_plural = 'Счетчики изменений'
+
+    @classmethod
+    def allocate(cls, count=1):
+        """Резервирует count номеров изменений и возвращает последний из них.
+
+        UPDATE блокирует строку счетчика до конца транзакции, поэтому
+        транзакции фиксируются в порядке номеров и клиент, получивший
+        номер N, уже не увидит позже изменений с меньшим номером.
+        Вызывать внутри транзакции и как можно ближе к ее концу: пока
+        строка заблокирована, все пишущие транзакции ждут. Файлы и прочие
+        долгие операции - до открытия транзакции.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            if connection.features.can_return_columns_from_insert:
+                cursor.execute(f'UPDATE {table} SET value = value + %s WHERE id = 1 RETURNING value', [count])
+            else:
+                cursor.execute(f'UPDATE {table} SET value = value + %s WHERE id = 1', [count])
+                cursor.execute(f'SELECT value FROM {table} WHERE id = 1')
+            row = cursor.fetchone()
+        if row is None:
+            # Строку счетчика создает миграция; сюда попадаем только после очистки таблицы
+            return cls.objects.create(id=1, value=count).value
+        return row[0]
+
+
+# Отметка об удаленном перевале для дельта-синхронизации
+class PerevalTombstone(models.Model):
+    pereval_id = models.BigIntegerField(verbose_name='ID перевала')
+    email = models.EmailField(verbose_name='Email пользователя')
+    change_seq = models.BigIntegerField(verbose_name='Номер изменения')
+    deleted_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')
+
+    class Meta:
+        verbose_name = 'Удаленный перевал'
+        verbose_name_plural = 'Удаленные перевалы'
+        indexes = [
+            models.Index(fields=['email', 'change_seq'], name='tombstone_email_seq_idx'),
+        ]
+
+
+# Сессия возобновляемой загрузки изображения частями
+class UploadSession(models.Model):
+    class StatusChoices(models.TextChoices):
+        UPLOADING = 'uploading', 'Загружается'
+        COMPLETE = 'complete', 'Загружено'
+        ATTACHED = 'attached', 'Привязано к перевалу'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=255, verbose_name='Название')
+    filename = models.CharField(max_length=255, verbose_name='Имя файла')
+    content_type = models.CharField(max_length=100, verbose_name='Тип содержимого')
+    size = models.BigIntegerField(verbose_name='Размер')
+    offset = models.BigIntegerField(default=0, verbose_name='Получено байт')
+    status = models.CharField(max_length=10, choices=StatusChoices, default='uploading', verbose_name='Статус')
+    image = models.OneToOneField(
+        Image, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session',
+        verbose_name='Изображение'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Сессия загрузки'
+        verbose_name_plural = 'Сессии загрузки'
+
+    def __str__(self):
+        return f"{self.filename}: {self.offset}/{self.size}"
+
+
+# Фоновая задача локальной очереди (без внешнего брокера)
+class Job(models.Model):
+    class StatusChoices(models.TextChoices):
+        QUEUED = 'queued', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Выполнена'
+        FAILED = 'failed', 'Ошибка'
+
+    kind = models.CharField(max_length=50, verbose_name='Тип')
+    payload = models.JSONField(default=dict, verbose_name='Параметры')
+    status = models.CharField(max_length=10, choices=StatusChoices, default='queued', verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Выполнить после')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Взята в работу')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+
+# Уменьшенная копия изображения для экранов разного размера
+class ImageVariant(models.Model):
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='variants', verbose_name='Изображение')
+    size = models.CharField(max_length=20, verbose_name='Размер')
+    format = models.CharField(max_length=10, verbose_name='Формат')
+    file = models.ImageField(
+        upload_to='pereval_images/variants/', storage=image_storage, max_length=255, verbose_name='Файл'
+    )
+    width = models.PositiveIntegerField(verbose_name='Ширина')
+    height = models.PositiveIntegerField(verbose_name='Высота')
+
+    class Meta:
+        verbose_name = 'Размер изображения'
+        verbose_name_plural = 'Размеры изображений'
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'size', 'format'], name='image_variant_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.image_id} {self.size} ({self.width}x{self.height} {self.format})"
+
+
+# Содержимое изображения, хранимое один раз под своим хешем SHA-256
+class ImageBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    file = models.FileField(max_length=255, storage=image_storage, verbose_name='Файл')
+    size = models.BigIntegerField(verbose_name='Размер')
+    # Число изображений, ссылающихся на содержимое; при нуле файл удаляется
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='Число ссылок')
+    # Для результата обработки - SHA-256 загрузки, из которой он получен: повторная
+    # загрузка того же файла ссылается сразу на обработанное содержимое
+    source_sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True,
+                                     verbose_name='SHA-256 исходной загрузки')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Содержимое изображения'
+        verbose_name_plural = 'Содержимое изображений'
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count})"
@@ -0,0 +1,250 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Min
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError, features
+
+from . import blobs
+from .jobs import handler, enqueue
+from .models import Image, ImageVariant, PerevalAdded
+from .storage import image_storage
+
+PROCESS_IMAGE = 'process_image'
+# Совпадает с upload_to поля ImageVariant.file
+VARIANT_DIR = 'pereval_images/variants'
+# Форматы, которые принимаются и пересжимаются без метаданных
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+
+def image_for_blob(title, blob):
+    """Новое изображение с содержимым blob.
+
+    Blob - результат обработки (повторная загрузка уже обработанного
+    файла, см. blobs.write_files): изображение сразу готово.
+    """
+    status = Image.ProcessingChoices.READY if blob.source_sha256 else Image.ProcessingChoices.PENDING
+    return Image(title=title, data=blob.file.name, blob=blob, processing_status=status)
+
+
+def enqueue_images(images):
+    """Постановка загруженных изображений в очередь обработки.
+
+    Готовым изображениям копируются строки уменьшенных копий другого
+    изображения с тем же blob (файлы копий общие); задача ставится,
+    только если копировать нечего.
+    """
+    copied = copy_variants([image for image in images if image.processing_status == Image.ProcessingChoices.READY])
+    return enqueue(PROCESS_IMAGE, [{'image_id': image.id} for image in images if image.id not in copied])
+
+
+def copy_variants(images):
+    """Копии строк ImageVariant для изображений с уже обработанным blob, возвращает id получивших их"""
+    if not images:
+        return set()
+    sources = dict(
+        Image.objects.filter(blob_id__in={image.blob_id for image in images}, variants__isnull=False)
+        .exclude(id__in=[image.id for image in images])
+        .values_list('blob_id')
+        .annotate(source=Min('id'))
+    )
+    variants = {}
+    for variant in ImageVariant.objects.filter(image_id__in=sources.values()):
+        variants.setdefault(variant.image_id, []).append(variant)
+    rows = [
+        ImageVariant(
+            image=image,
+            size=variant.size,
+            format=variant.format,
+            file=variant.file.name,
+            width=variant.width,
+            height=variant.height
+        )
+        for image in images
+        for variant in variants.get(sources.get(image.blob_id), [])
+    ]
+    ImageVariant.objects.bulk_create(rows)
+    return {row.image_id for row in rows}
+
+
+def modern_formats():
+    """Современные форматы из PEREVAL_IMAGE_FORMATS, которые умеет сохранять установленный Pillow"""
+    return [name for name in settings.PEREVAL_IMAGE_FORMATS if name in features.modules and features.check_module(name)]
+
+
+def has_alpha(picture):
+    return picture.mode in ('RGBA', 'LA', 'PA') or (picture.mode == 'P' and 'transparency' in picture.info)
+
+
+def fallback_format(picture):
+    """Формат для клиентов без поддержки WebP/AVIF: PNG сохраняет прозрачность"""
+    return 'png' if has_alpha(picture) else 'jpeg'
+
+
+def encode(picture, image_format):
+    """Сохранение картинки в байты формата image_format ('jpeg', 'png', 'webp', 'avif')"""
+    options = {}
+    if image_format == 'jpeg':
+        if picture.mode not in ('RGB', 'L'):
+            picture = picture.convert('RGB')
+        options = {'optimize': True}
+    elif image_format == 'png':
+        options = {'optimize': True}
+    if image_format in settings.PEREVAL_IMAGE_QUALITY:
+        options['quality'] = settings.PEREVAL_IMAGE_QUALITY[image_format]
+    output = BytesIO()
+    picture.save(output, image_format.upper(), **options)
+    return output.getvalue()
+
+
+def verify_image(source):
+    """Проверка, что файл - целое изображение допустимого формата, без декодирования пикселей"""
+    with PILImage.open(source) as picture:
+        picture.verify()
+        if picture.format not in ALLOWED_FORMATS:
+            raise ValidationError(f'Неподдерживаемый формат изображения: {picture.format}')
+    source.seek(0)
+
+
+def reencode(source):
+    """Проверка изображения и пересжатие без EXIF и прочих метаданных.
+
+    Поворот из EXIF применяется к пикселям до удаления метаданных,
+    поэтому фотография с телефона не окажется лежащей на боку.
+    Возвращает байты и формат: WebP, если его умеет Pillow, иначе исходный.
+    """
+    verify_image(source)
+    with PILImage.open(source) as picture:
+        image_format = 'webp' if 'webp' in modern_formats() else picture.format.lower()
+        return encode(ImageOps.exif_transpose(picture), image_format), image_format
+
+
+def make_variants(image, content):
+    """Уменьшенные копии всех размеров PEREVAL_IMAGE_SIZES и форматов, которых еще нет.
+
+    Каждый размер сохраняется в WebP/AVIF и в JPEG/PNG для старых клиентов.
+    Копии создаются один раз при обработке и отдаются как обычные файлы,
+    без масштабирования и перекодирования на каждый запрос.
+    """
+    existing = set(image.variants.values_list('size', 'format'))
+    stem = os.path.splitext(os.path.basename(image.data.name))[0]
+    with PILImage.open(BytesIO(content)) as original:
+        # Оригинал при PEREVAL_IMAGE_KEEP_ORIGINAL хранится с EXIF: поворот применяется к копиям
+        picture = ImageOps.exif_transpose(original)
+        formats = [fallback_format(picture), *modern_formats()]
+        variants = []
+        for size, max_side in settings.PEREVAL_IMAGE_SIZES.items():
+            resized = None
+            for image_format in formats:
+                if (size, image_format) in existing:
+                    continue
+                if resized is None:
+                    resized = picture.copy()
+                    resized.thumbnail((max_side, max_side), PILImage.LANCZOS)
+                # Имя зависит от содержимого оригинала и параметров копии: копия того же
+                # содержимого, уже созданная для другого изображения, не пересчитывается
+                quality = settings.PEREVAL_IMAGE_QUALITY.get(image_format, 0)
+                name = f'{stem[:40]}_{max_side}_q{quality}.{image_format}'
+                file = image_storage().generate_filename(f'{VARIANT_DIR}/{name}')
+                if not image_storage().exists(file):
+                    file = ContentFile(encode(resized, image_format), name=name)
+                variants.append(ImageVariant(
+                    image=image,
+                    size=size,
+                    format=image_format,
+                    file=file,
+                    width=resized.width,
+                    height=resized.height
+                ))
+    # bulk_create не сохраняет файлы полей, поэтому строки создаются по одной
+    for variant in variants:
+        variant.save()
+
+
+def release_variants(names):
+    """Удаление файлов копий, на которые больше не ссылается ни одна строка ImageVariant.
+
+    Файл копии общий для изображений с одинаковым содержимым (см. make_variants),
+    поэтому строки с тем же файлом - его счетчик ссылок. Файлы удаляются после
+    фиксации транзакции, как и файлы blob.
+    """
+    if not names:
+        return
+    used = set(ImageVariant.objects.filter(file__in=names).values_list('file', flat=True))
+    unused = set(names) - used
+    if unused:
+        transaction.on_commit(lambda: delete_files(unused))
+
+
+def delete_files(names):
+    storage = image_storage()
+    for name in names:
+        storage.delete(name)
+
+
+@handler(PROCESS_IMAGE)
+def process_image(image_id):
+    """Фоновая обработка загруженного изображения"""
+    image = Image.objects.filter(id=image_id).first()
+    if image is None:
+        return
+    if image.processing_status == Image.ProcessingChoices.READY:
+        # Уже обработанное изображение не пересжимается повторно: только недостающие размеры
+        with image.data.open('rb') as source:
+            make_variants(image, source.read())
+        touch_perevals(image_id)
+        return
+
+    Image.objects.filter(id=image_id).update(processing_status=Image.ProcessingChoices.PROCESSING)
+    try:
+        with image.data.open('rb') as source:
+            if settings.PEREVAL_IMAGE_KEEP_ORIGINAL:
+                # Хранимый файл не меняется ни на байт: только проверка и уменьшенные копии
+                verify_image(source)
+                content, image_format = source.read(), None
+            else:
+                content, image_format = reencode(source)
+    except (ValidationError, UnidentifiedImageError, PILImage.DecompressionBombError, SyntaxError, OSError) as e:
+        # Файл не является допустимым изображением: повтор не поможет
+        message = e.message if isinstance(e, ValidationError) else f'Некорректное изображение: {e}'
+        Image.objects.filter(id=image_id).update(
+            processing_status=Image.ProcessingChoices.FAILED, processing_error=message
+        )
+    except Exception:
+        Image.objects.filter(id=image_id).update(processing_status=Image.ProcessingChoices.PENDING)
+        raise
+    else:
+        if image_format is None:
+            Image.objects.filter(id=image_id).update(
+                processing_status=Image.ProcessingChoices.READY, processing_error=''
+            )
+        else:
+            # Пересжатое содержимое - новый blob; одинаковые загрузки дают одинаковый
+            # результат, и он тоже хранится один раз
+            blob = blobs.store(ContentFile(content), image_format)
+            if image.blob_id:
+                # Повторная загрузка исходного файла сошлется сразу на этот blob
+                blobs.alias(blob, image.blob.sha256)
+            image.data.name = blob.file.name
+            Image.objects.filter(id=image_id).update(
+                data=image.data.name, blob=blob, processing_status=Image.ProcessingChoices.READY, processing_error=''
+            )
+            if image.blob_id:
+                blobs.release(image.blob_id)
+            image.blob = blob
+        # При сбое повтор задачи создаст только недостающие размеры, без второго пересжатия
+        make_variants(image, content)
+    touch_perevals(image_id)
+
+
+def touch_perevals(image_id):
+    """Отметка изменения перевалов с изображением.
+
+    Новый updated_at и номер изменения меняют ETag карточки и попадают
+    в дельта-синхронизацию, а сохранение сбрасывает кэш карточек.
+    """
+    for pereval in PerevalAdded.objects.filter(perevalimage__image_id=image_id):
+        pereval.save(update_fields=['updated_at'])
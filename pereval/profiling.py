@@ -0,0 +1,94 @@
+"""Профилирование отдельных запросов в рабочем окружении.
+
+RequestProfilerMiddleware запускает cProfile для выбранных запросов и
+пишет результат (.prof, формат pstats) в каталог PEREVAL_PROFILE_DIR.
+Запрос выбирается случайно с долей PEREVAL_PROFILE_RATE или заголовком
+X-Pereval-Profile с подписанным токеном (manage.py profile_token). Имя
+файла содержит время, метод, маршрут и длительность запроса. Файлы
+открываются pstats/snakeviz, flamegraph строится flameprof.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import route_of
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Pereval-Profile'
+TOKEN_SALT = 'pereval.profiling'
+
+
+def profile_token():
+    """Токен для заголовка X-Pereval-Profile, подписанный SECRET_KEY"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PEREVAL_PROFILE_TOKEN_TTL)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_filename(request, duration):
+    route = re.sub(r'\W+', '_', route_of(request)).strip('_') or 'root'
+    return (
+        f"{time.strftime('%Y%m%d-%H%M%S')}_{request.method}_{route}_"
+        f"{duration * 1000:.0f}ms_{uuid.uuid4().hex[:8]}.prof"
+    )
+
+
+class RequestProfilerMiddleware:
+    """cProfile выбранных запросов.
+
+    Без PEREVAL_PROFILE_DIR удаляется из цепочки (MiddlewareNotUsed), и
+    запросы не платят за него ничего. Под ASGI Django выполняет его в
+    потоке: профилировщик видит только синхронную часть запроса.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PEREVAL_PROFILE_DIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.directory = settings.PEREVAL_PROFILE_DIR
+        self.rate = settings.PEREVAL_PROFILE_RATE
+        self.min_duration = settings.PEREVAL_PROFILE_MIN_MS / 1000
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        token = request.headers.get(PROFILE_HEADER)
+        requested = token is not None and valid_token(token)
+        if not requested and (not self.rate or random.random() >= self.rate):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик
+            return self.get_response(request)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+
+        # Порог отсекает быстрые случайные запросы; запрошенный заголовком пишется всегда
+        if requested or duration >= self.min_duration:
+            filename = profile_filename(request, duration)
+            profiler.dump_stats(os.path.join(self.directory, filename))
+            logger.info('Профиль запроса %s %s записан в %s', request.method, request.path, filename)
+            if requested:
+                response[PROFILE_HEADER] = filename
+        return response
@@ -0,0 +1,85 @@
+"""Карточки перевалов для ответов API из строк .values().
+
+Поля ответа описаны один раз. По описанию при импорте строятся список
+столбцов для .values() и itemgetter'ы сборки словаря, поэтому ответ
+не создает экземпляры моделей и одинаков во всех эндпоинтах.
+"""
+from operator import itemgetter
+
+from .models import ImageVariant, PerevalImage
+from .storage import image_storage
+
+PEREVAL_FIELDS = ('id', 'beauty_title', 'title', 'other_titles', 'connect', 'add_time', 'updated_at', 'status')
+USER_FIELDS = ('email', 'fam', 'name', 'otc', 'phone')
+COORDS_FIELDS = ('latitude', 'longitude', 'height')
+LEVEL_FIELDS = ('winter', 'summer', 'autumn', 'spring')
+
+IMAGE_COLUMNS = ('pereval_id', 'image_id', 'image__title', 'image__data', 'image__processing_status')
+VARIANT_COLUMNS = ('image_id', 'size', 'format', 'file')
+
+
+class PerevalSerializer:
+    """Строка PerevalAdded.objects.values(*serializer.columns) -> словарь ответа"""
+
+    def __init__(self, with_user=False):
+        groups = [('user', USER_FIELDS)] if with_user else []
+        groups += [('coords', COORDS_FIELDS), ('level', LEVEL_FIELDS)]
+        self.columns = (*PEREVAL_FIELDS, *(f'{name}__{field}' for name, fields in groups for field in fields))
+        self._fields = itemgetter(*PEREVAL_FIELDS)
+        self._groups = [
+            (name, fields, itemgetter(*(f'{name}__{field}' for field in fields))) for name, fields in groups
+        ]
+
+    def __call__(self, row):
+        result = dict(zip(PEREVAL_FIELDS, self._fields(row)))
+        for name, fields, getter in self._groups:
+            result[name] = dict(zip(fields, getter(row)))
+        return result
+
+    def serialize(self, rows):
+        """Карточки с изображениями: два запроса на любое число перевалов"""
+        results = [self(row) for row in rows]
+        if results:
+            images, variants = image_querysets([result['id'] for result in results])
+            attach_images(results, list(images), list(variants))
+        return results
+
+    async def aserialize(self, rows):
+        results = [self(row) for row in rows]
+        if results:
+            images, variants = image_querysets([result['id'] for result in results])
+            attach_images(results, [row async for row in images], [row async for row in variants])
+        return results
+
+
+def image_querysets(pereval_ids):
+    links = PerevalImage.objects.filter(pereval_id__in=pereval_ids)
+    return (
+        links.order_by('id').values_list(*IMAGE_COLUMNS),
+        ImageVariant.objects.filter(image_id__in=links.values('image_id')).values_list(*VARIANT_COLUMNS),
+    )
+
+
+def attach_images(results, images, variants):
+    """Изображения перевалов и адреса их копий: размер -> формат -> url"""
+    url = image_storage().url
+    sizes = {}
+    for image_id, size, image_format, name in variants:
+        sizes.setdefault(image_id, {}).setdefault(size, {})[image_format] = url(name)
+
+    by_id = {}
+    for result in results:
+        result['images'] = []
+        by_id[result['id']] = result
+    for pereval_id, image_id, title, data, processing_status in images:
+        by_id[pereval_id]['images'].append({
+            'title': title,
+            'data': url(data) if data else None,
+            'processing_status': processing_status,
+            'sizes': sizes.get(image_id, {})
+        })
+
+
+# Карточка перевала (с пользователем) и элемент списка пользователя (без него)
+DETAIL = PerevalSerializer(with_user=True)
+LIST = PerevalSerializer()
@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import blobs, tiles
+from .cache import pereval_cache
+from .models import Coords, Image, Level, PerevalAdded, PerevalTombstone, SyncSequence, User
+from .processing import release_variants
+
+
+def invalidate_after_commit(pereval_ids):
+    """Сброс кэша карточек после фиксации транзакции, чтобы читатели
+    не закэшировали снова незафиксированное старое состояние"""
+    def invalidate():
+        for pereval_id in pereval_ids:
+            pereval_cache.invalidate(pereval_id)
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=PerevalAdded)
+def invalidate_saved_pereval(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_after_commit([instance.id])
+
+
+@receiver(post_save, sender=Coords)
+@receiver(post_save, sender=Level)
+def invalidate_related_perevals(sender, instance, created, **kwargs):
+    """Координаты и уровень, измененные напрямую (например, в админке)"""
+    if not created:
+        field = 'coords' if sender is Coords else 'level'
+        invalidate_after_commit(list(
+            PerevalAdded.objects.filter(**{field: instance}).values_list('id', flat=True)
+        ))
+
+
+@receiver(post_delete, sender=PerevalAdded)
+def remove_pereval_from_tiles(sender, instance, **kwargs):
+    """Удаленный перевал (в том числе каскадно) убирается из кластеров карты"""
+    invalidate_after_commit([instance.id])
+    try:
+        coords = instance.coords
+    except Coords.DoesNotExist:
+        return
+    tiles.remove_points([(coords.latitude, coords.longitude)])
+
+
+@receiver(post_delete, sender=PerevalAdded)
+def record_pereval_deletion(sender, instance, **kwargs):
+    """Удаленный перевал оставляет отметку для синхронизации офлайн-клиентов.
+
+    Подключен после обновления кластеров: номер изменения берется
+    последним, и строка счетчика заблокирована меньше.
+    """
+    try:
+        email = instance.user.email
+    except User.DoesNotExist:
+        return
+    with transaction.atomic(savepoint=False):
+        PerevalTombstone.objects.create(
+            pereval_id=instance.id,
+            email=email,
+            change_seq=SyncSequence.allocate()
+        )
+
+
+@receiver(pre_delete, sender=Image)
+def remember_variant_files(sender, instance, **kwargs):
+    """Файлы копий удаляемого изображения: к post_delete их строки уже удалены каскадом"""
+    instance.variant_files = list(instance.variants.values_list('file', flat=True))
+
+
+@receiver(post_delete, sender=Image)
+def release_image_blob(sender, instance, **kwargs):
+    """Удаленное изображение снимает ссылку на общее содержимое и на файлы копий"""
+    if instance.blob_id:
+        blobs.release(instance.blob_id)
+    release_variants(getattr(instance, 'variant_files', []))
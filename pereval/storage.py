@@ -0,0 +1,47 @@
+import hashlib
+import posixpath
+
+from django.core.files.storage import FileSystemStorage, storages
+
+# Алиас хранилища изображений в settings.STORAGES
+STORAGE_ALIAS = 'pereval'
+
+
+def image_storage():
+    """Хранилище файлов изображений.
+
+    Поля моделей ссылаются на эту функцию, а не на класс: бэкенд
+    задается в settings.STORAGES и меняется без новых миграций.
+    """
+    return storages[STORAGE_ALIAS]
+
+
+def shard_prefix(basename):
+    digest = hashlib.md5(basename.encode()).hexdigest()
+    return digest[:2], digest[2:4]
+
+
+def sharded_name(name):
+    """Имя файла в подкаталогах по хешу имени: dir/ab/cd/file.jpg.
+
+    Повторный вызов для уже разложенного имени возвращает его без изменений.
+    """
+    directory, basename = posixpath.split(name)
+    prefix = shard_prefix(basename)
+    head, second = posixpath.split(directory)
+    if (posixpath.basename(head), second) == prefix:
+        return name
+    return posixpath.join(directory, *prefix, basename)
+
+
+class ShardedFileSystemStorage(FileSystemStorage):
+    """Файловое хранилище, раскладывающее файлы по 65536 подкаталогам.
+
+    В одном каталоге остаются сотни файлов даже при миллионах изображений,
+    поэтому поиск файла и резервное копирование не замедляются. Файлы,
+    сохраненные до включения раскладки, продолжают открываться по своим
+    старым именам.
+    """
+
+    def generate_filename(self, filename):
+        return sharded_name(super().generate_filename(filename))
@@ -1,14 +1,101 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.test import AsyncClient, AsyncRequestFactory, TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import User, Coords, Level, PerevalAdded, Image
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from unittest import mock, skipUnless
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
+from .models import (
+    User, Coords, Level, PerevalAdded, Image, ImageBlob, ImageVariant, PerevalImage, TileCluster, Job,
+    UploadSession,
+)
+from . import jobs, tiles
+from .async_views import async_read_view, pereval_detail, perevals_by_email
+from .cache import pereval_cache
 from .data_manager import PerevalManager
+from .geo import geohash_encode, haversine_km
+from .images import decode_base64_image
+from .metrics import registry as metrics_registry
+from .processing import enqueue_images, modern_formats
+from .profiling import RequestProfilerMiddleware, profile_token
+from .renderers import FastJSONRenderer
+from .storage import image_storage, sharded_name
+from .views import SubmitDataDetailAPI
+import base64
+import copy
+import importlib
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import io
 import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import threading
+import random
+import zlib
 
 
-class PerevalManagerTest(TestCase):
+class MediaTestCase(TestCase):
+    """Тесты, сохраняющие файлы в хранилище: MEDIA_ROOT - временный каталог класса.
+
+    Изображения, их копии и части загрузок (PEREVAL_UPLOAD_DIR) не попадают
+    в media/ репозитория, каталог удаляется после тестов класса.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        media_override = override_settings(
+            MEDIA_ROOT=cls.media_root, PEREVAL_UPLOAD_DIR=os.path.join(cls.media_root, 'upload_sessions')
+        )
+        media_override.enable()
+        # Очистка в обратном порядке: сначала возврат настроек, затем удаление каталога
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        cls.addClassCleanup(media_override.disable)
+        super().setUpClass()
+
+
+def png_base64(seed=0):
+    """Крошечный PNG в виде data URI: цвет по seed, поэтому содержимое у разных seed разное"""
+    output = io.BytesIO()
+    PILImage.new('RGB', (1, 1), tuple(zlib.crc32(str(seed).encode()).to_bytes(4, 'big')[:3])).save(output, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+def pereval_payload(email, images=1, title='Перевал', latitude=45.5, longitude=7.5):
+    """Данные нового перевала в формате API.
+
+    images - список изображений или их число: тогда это крошечные PNG,
+    разные для разных email.
+    """
+    if isinstance(images, int):
+        images = [{'title': f'Фото {i}', 'data': png_base64(f'{email}{i}')} for i in range(images)]
+    return {
+        'beauty_title': 'пер.', 'title': title, 'other_titles': '', 'connect': '',
+        'user': {'email': email, 'fam': 'Т', 'name': 'Т', 'otc': '', 'phone': '1'},
+        'coords': {'latitude': latitude, 'longitude': longitude, 'height': 1500},
+        'level': {'winter': '', 'summer': '1A', 'autumn': '', 'spring': ''},
+        'images': images,
+    }
+
+
+class PerevalManagerTest(MediaTestCase):
     def setUp(self):
         self.manager = PerevalManager()
+        pereval_cache.cache.clear()
 
         # Создаем тестового пользователя
         self.user = User.objects.create(
@@ -92,12 +179,210 @@ class PerevalManagerTest(TestCase):
         self.assertEqual(result['status'], 200)
         self.assertIsNotNone(result['id'])
 
+    def test_submit_many_success(self):
+        """Тест пакетного добавления перевалов"""
+        items = []
+        for i in range(3):
+            item = copy.deepcopy(self.pereval_data)
+            item['title'] = f'Пакетный перевал {i}'
+            items.append(item)
+        items[2]['user']['email'] = 'test@example.com'
+
+        result = self.manager.submit_many(items)
+        self.assertEqual(result['status'], 200)
+        self.assertEqual([r['status'] for r in result['results']], [200, 200, 200])
+        ids = [r['id'] for r in result['results']]
+        self.assertEqual(PerevalAdded.objects.filter(id__in=ids).count(), 3)
+        self.assertEqual(User.objects.filter(email='new@example.com').count(), 1)
+        self.assertEqual(PerevalAdded.objects.get(id=ids[2]).user, self.user)
+        self.assertEqual(PerevalAdded.objects.get(id=ids[0]).images.count(), 1)
+
+    def test_submit_many_reports_invalid_items(self):
+        """Тест: невалидные записи пакета получают свой результат, остальные сохраняются"""
+        valid = copy.deepcopy(self.pereval_data)
+        invalid = copy.deepcopy(self.pereval_data)
+        del invalid['coords']
+        broken_image = copy.deepcopy(self.pereval_data)
+        broken_image['images'][0]['data'] = 'not an image'
+
+        result = self.manager.submit_many([valid, invalid, broken_image])
+        statuses = [r['status'] for r in result['results']]
+        self.assertEqual(statuses, [200, 400, 400])
+        self.assertTrue(PerevalAdded.objects.filter(id=result['results'][0]['id']).exists())
+
+    def test_submit_many_rejects_malformed_types(self):
+        """Тест: запись с неверными типами отклоняется до вставки и не роняет пакет"""
+        malformed = []
+        for path, value in [
+            (('coords', 'latitude'), 'abc'),
+            (('coords', 'height'), None),
+            (('images',), None),
+            (('level',), 'летом 1А'),
+            (('user', 'email'), 42),
+            (('user', 'fam'), 'Ф' * 151),
+        ]:
+            item = copy.deepcopy(self.pereval_data)
+            target = item
+            for key in path[:-1]:
+                target = target[key]
+            target[path[-1]] = value
+            malformed.append(item)
+        first, last = copy.deepcopy(self.pereval_data), copy.deepcopy(self.pereval_data)
+        # Координаты строками, как в примерах API ФСТР, приводятся к числам
+        last['coords'] = {'latitude': '45.5', 'longitude': '7.25', 'height': '1600'}
+
+        result = self.manager.submit_many([first, *malformed, last])
+        self.assertEqual(result['status'], 200)
+        statuses = [r['status'] for r in result['results']]
+        self.assertEqual(statuses, [200] + [400] * len(malformed) + [200])
+        self.assertIn('coords.latitude', result['results'][1]['message'])
+        saved = PerevalAdded.objects.select_related('coords').get(id=result['results'][-1]['id'])
+        self.assertEqual((saved.coords.latitude, saved.coords.height), (45.5, 1600))
+
+    def test_submit_many_query_count_independent_of_size(self):
+        """Тест: число запросов пакетной вставки не растет с числом записей"""
+        def count_queries(size, offset):
+            items = []
+            for i in range(size):
+                item = copy.deepcopy(self.pereval_data)
+                item['user']['email'] = f'batch{offset + i}@example.com'
+                # Новое содержимое в каждом пакете: уже известное не записывается повторно
+                item['images'][0]['data'] = png_base64(offset)
+                items.append(item)
+            with CaptureQueriesContext(connection) as ctx:
+                self.manager.submit_many(items)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(2, 0), count_queries(10, 100))
+
+    def test_submit_many_file_and_uploaded_images(self):
+        """Тест: в пакете изображения передаются файлами multipart и id загрузок, как в submit_pereval"""
+        uploaded = Image.objects.create(title='Частями', data='pereval_images/uploaded.jpg')
+        UploadSession.objects.create(title='Частями', filename='a.jpg', content_type='image/jpeg', size=1,
+                                     offset=1, status=UploadSession.StatusChoices.COMPLETE, image=uploaded)
+        by_file, by_id, reused = (copy.deepcopy(self.pereval_data) for _ in range(3))
+        by_file['images'] = [{'title': 'Файлом', 'file': 'photo'}]
+        by_id['images'] = [{'id': uploaded.id}]
+        reused['images'] = [{'id': uploaded.id}]
+
+        response = APIClient().post('/api/submitData/batch/', data={
+            'metadata': json.dumps([by_file, by_id, reused]),
+            'photo': SimpleUploadedFile('photo.jpg', noise_jpeg(), content_type='image/jpeg'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], [200, 200, 400])
+        self.assertTrue(PerevalAdded.objects.get(id=results[0]['id']).images.get().data.name.endswith('.jpeg'))
+        self.assertEqual(list(PerevalAdded.objects.get(id=results[1]['id']).images.all()), [uploaded])
+        self.assertEqual(UploadSession.objects.get(image=uploaded).status, UploadSession.StatusChoices.ATTACHED)
+
+    def test_submit_many_failure_removes_written_files(self):
+        """Тест: файлы, записанные до откатившейся транзакции пакета, удаляются"""
+        item = copy.deepcopy(self.pereval_data)
+        item['images'][0]['data'] = 'data:image/jpeg;base64,' + base64.b64encode(noise_jpeg()).decode()
+        with mock.patch.object(tiles, 'add_points', side_effect=RuntimeError('tiles')):
+            result = self.manager.submit_many([item])
+        self.assertEqual(result['results'][0]['status'], 500)
+        self.assertFalse(ImageBlob.objects.exists())
+        blob_dir = os.path.join(self.media_root, 'pereval_images', 'blobs')
+        self.assertEqual([files for _, _, files in os.walk(blob_dir) if files], [])
+
     def test_get_pereval_by_id(self):
         """Тест получения перевала по ID"""
         result = self.manager.get_pereval_by_id(self.pereval.id)
         self.assertEqual(result['status'], 200)
         self.assertEqual(result['title'], 'Тестовый перевал')
 
+    def _add_perevals(self, count, images_per_pereval):
+        """Добавление перевалов с изображениями тестовому пользователю"""
+        for i in range(count):
+            pereval = PerevalAdded.objects.create(
+                beauty_title='пер.',
+                title=f'Перевал {i}',
+                user=self.user,
+                coords=Coords.objects.create(latitude=45.0 + i, longitude=7.0, height=1000),
+                level=Level.objects.create(summer='1A')
+            )
+            for j in range(images_per_pereval):
+                pereval.images.add(Image.objects.create(title=f'Фото {j}', data=f'pereval_images/{i}_{j}.jpg'))
+
+    def test_get_pereval_by_id_query_count(self):
+        """Тест: получение перевала по ID выполняется за постоянное число запросов"""
+        for j in range(5):
+            image = Image.objects.create(title=f'Доп. фото {j}', data=f'pereval_images/extra_{j}.jpg')
+            self.pereval.images.add(image)
+            for size in ('thumb', 'medium'):
+                ImageVariant.objects.create(image=image, size=size, format='jpeg', width=1, height=1,
+                                            file=f'pereval_images/variants/extra_{j}_{size}.jpeg')
+
+        with self.assertNumQueries(3):
+            result = self.manager.get_pereval_by_id(self.pereval.id)
+        self.assertEqual(len(result['images']), 6)
+        self.assertEqual(set(result['images'][-1]['sizes']), {'thumb', 'medium'})
+        self.assertEqual(result['user']['email'], 'test@example.com')
+
+    def test_get_pereval_by_id_cached(self):
+        """Тест: повторное чтение карточки идет из кэша, изменение сбрасывает кэш"""
+        hits = pereval_cache.hits
+        self.manager.get_pereval_by_id(self.pereval.id)
+        with self.assertNumQueries(0):
+            self.manager.get_pereval_by_id(self.pereval.id)
+        self.assertEqual(pereval_cache.hits, hits + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.update_pereval(self.pereval.id, {'title': 'Новое название'})
+        self.assertEqual(self.manager.get_pereval_by_id(self.pereval.id)['title'], 'Новое название')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PerevalAdded.objects.get(id=self.pereval.id).save()
+        with self.assertNumQueries(3):
+            self.manager.get_pereval_by_id(self.pereval.id)
+
+    def test_get_perevals_by_email_query_count(self):
+        """Тест: список перевалов по email не порождает N+1 запросов"""
+        self._add_perevals(10, images_per_pereval=3)
+
+        with self.assertNumQueries(4):
+            result = self.manager.get_perevals_by_email('test@example.com')
+        self.assertEqual(len(result['perevals']), 11)
+        self.assertTrue(all(len(p['images']) >= 1 for p in result['perevals']))
+
+    def test_get_perevals_by_email_pagination(self):
+        """Тест keyset-пагинации по (add_time, id), в том числе при одинаковом времени"""
+        self._add_perevals(10, images_per_pereval=1)
+        PerevalAdded.objects.filter(id__gt=self.pereval.id + 5).update(add_time=self.pereval.add_time)
+
+        seen = []
+        cursor = None
+        while True:
+            result = self.manager.get_perevals_by_email('test@example.com', cursor=cursor, limit=4)
+            self.assertEqual(result['status'], 200)
+            seen.extend((p['add_time'], p['id']) for p in result['perevals'])
+            cursor = result['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 11)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_get_perevals_invalid_cursor(self):
+        """Тест обработки некорректного курсора"""
+        result = self.manager.get_perevals_by_email('test@example.com', cursor='мусор')
+        self.assertEqual(result['status'], 400)
+
+    def test_get_perevals_by_status(self):
+        """Тест общего списка перевалов с фильтром по статусу"""
+        self._add_perevals(3, images_per_pereval=0)
+        PerevalAdded.objects.filter(title='Перевал 1').update(status='accepted')
+
+        result = self.manager.get_perevals(status='accepted')
+        self.assertEqual(result['status'], 200)
+        self.assertEqual([p['title'] for p in result['perevals']], ['Перевал 1'])
+        # Публичный список не раскрывает email, телефон и имя автора
+        self.assertNotIn('user', result['perevals'][0])
+        self.assertEqual(len(self.manager.get_perevals()['perevals']), 4)
+        self.assertEqual(self.manager.get_perevals(status='unknown')['status'], 400)
+
     def test_update_pereval_success(self):
         """Тест успешного обновления перевала"""
         update_data = {'title': 'Обновленный перевал'}
@@ -115,6 +400,75 @@ class PerevalManagerTest(TestCase):
         self.assertEqual(result['state'], 0)
         self.assertIn('Редактирование запрещено', result['message'])
 
+    def test_update_pereval_writes_changed_columns(self):
+        """Тест: обновление пишет только изменившиеся столбцы, запрос без изменений не пишет в БД"""
+        with CaptureQueriesContext(connection) as ctx:
+            result = self.manager.update_pereval(self.pereval.id, {'title': 'Новое', 'coords': {'height': 1200}})
+        self.assertEqual(result['state'], 1)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        pereval_table = PerevalAdded._meta.db_table
+        self.assertFalse([sql for sql in updates if Coords._meta.db_table in sql or Level._meta.db_table in sql])
+        pereval_update, = [sql for sql in updates if sql.startswith(f'UPDATE "{pereval_table}"')]
+        self.assertIn('"title"', pereval_update)
+        self.assertNotIn('"beauty_title"', pereval_update)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.manager.update_pereval(self.pereval.id, {'title': 'Новое', 'level': {'summer': '1A'}})
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))])
+
+        self.manager.update_pereval(self.pereval.id, {'coords': {'latitude': 46.0}})
+        self.pereval.refresh_from_db()
+        self.assertEqual(self.pereval.coords.geohash, geohash_encode(46.0, 7.1525))
+
+    def test_update_pereval_validates_values(self):
+        """Тест: координаты и уровень проверяются так же, как при добавлении, и ничего не пишется"""
+        coords = Coords.objects.filter(id=self.pereval.coords_id).values().get()
+        for data, message in [
+            ({'coords': {'latitude': 'север'}}, 'coords.latitude'),
+            ({'coords': {'longitude': 500}}, 'coords.longitude'),
+            ({'coords': {'height': 1.5}}, 'coords.height'),
+            ({'title': 'Новое', 'level': {'summer': 'x' * 100}}, 'level.summer'),
+            ({'level': '1A'}, 'level'),
+        ]:
+            with self.subTest(data=data), CaptureQueriesContext(connection) as ctx:
+                result = self.manager.update_pereval(self.pereval.id, data)
+                self.assertEqual(result['state'], 0)
+                self.assertIn(message, result['message'])
+                self.assertEqual(ctx.captured_queries, [])
+        self.pereval.refresh_from_db()
+        self.assertEqual(Coords.objects.filter(id=self.pereval.coords_id).values().get(), coords)
+        self.assertNotEqual(self.pereval.title, 'Новое')
+
+        # Числовые строки приводятся к числам, как при добавлении
+        self.assertEqual(self.manager.update_pereval(self.pereval.id, {'coords': {'height': '1300'}})['state'], 1)
+        self.assertEqual(Coords.objects.get(id=self.pereval.coords_id).height, 1300)
+
+    def test_submit_pereval_atomic(self):
+        """Тест: ошибка при записи перевала не оставляет координат и уровня без перевала"""
+        coords_count, level_count = Coords.objects.count(), Level.objects.count()
+        # Ошибка на последнем шаге записи, когда перевал и изображения уже вставлены
+        with mock.patch.object(tiles, 'add_points', side_effect=RuntimeError('tiles')):
+            result = self.manager.submit_pereval(self.pereval_data)
+        self.assertEqual(result['status'], 500)
+        self.assertEqual(Coords.objects.count(), coords_count)
+        self.assertEqual(Level.objects.count(), level_count)
+        self.assertFalse(User.objects.filter(email='new@example.com').exists())
+
+    def test_submit_pereval_query_count_independent_of_images(self):
+        """Тест: число запросов добавления перевала не растет с числом изображений"""
+        def count_queries(images, offset):
+            data = copy.deepcopy(self.pereval_data)
+            data['user']['email'] = f'images{offset}@example.com'
+            data['images'] = [
+                {'title': f'Фото {i}', 'data': png_base64(offset + i)}
+                for i in range(images)
+            ]
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.manager.submit_pereval(data)['status'], 200)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(1, 0), count_queries(5, 100))
+
     def test_get_perevals_by_email(self):
         """Тест поиска перевалов по email"""
         result = self.manager.get_perevals_by_email('test@example.com')
@@ -123,9 +477,1161 @@ class PerevalManagerTest(TestCase):
         self.assertEqual(result['perevals'][0]['title'], 'Тестовый перевал')
 
 
-class PerevalAPITest(TestCase):
+def noise_jpeg(side=200):
+    """JPEG из шума: плохо сжимается, поэтому файл крупный (200 x 200 - около 50 КБ)"""
+    output = io.BytesIO()
+    noise = random.Random(side).randbytes(side * side * 3)
+    PILImage.frombytes('RGB', (side, side), noise).save(output, 'JPEG', quality=95)
+    return output.getvalue()
+
+
+class ImageDecodeTest(MediaTestCase):
+    def setUp(self):
+        # Крупнее порции декодирования и лимита запроса в test_request_images_size_limit
+        self.content = noise_jpeg(400)
+
+    def test_streaming_decode_matches_content(self):
+        """Тест потокового декодирования, в том числе base64 с переводами строк"""
+        for encoded in (base64.b64encode(self.content).decode(), base64.encodebytes(self.content).decode()):
+            ext, upload = decode_base64_image('data:image/jpeg;base64,' + encoded)
+            try:
+                self.assertEqual(ext, 'jpeg')
+                self.assertEqual(upload.size, len(self.content))
+                self.assertEqual(upload.read(), self.content)
+            finally:
+                upload.close()
+
+    @override_settings(PEREVAL_MAX_IMAGE_SIZE=1000)
+    def test_image_size_limit(self):
+        """Тест ограничения размера одного изображения"""
+        with self.assertRaisesMessage(ValidationError, 'больше допустимого'):
+            decode_base64_image('data:image/jpeg;base64,' + base64.b64encode(self.content).decode())
+
+    def test_invalid_base64(self):
+        """Тест отказа на некорректных данных"""
+        for data in ('data:image/png;base64,@@@@', 'data:image/png;base64,abc', 'просто строка', None):
+            with self.assertRaises(ValidationError):
+                decode_base64_image(data)
+
+    @override_settings(PEREVAL_MAX_REQUEST_IMAGES_SIZE=100 * 1024)
+    def test_request_images_size_limit(self):
+        """Тест: суммарный лимит проверяется до записи в БД"""
+        payload = pereval_payload('big@example.com', [
+            {'title': 'Фото', 'data': 'data:image/jpeg;base64,' + base64.b64encode(self.content).decode()}
+        ])
+        result = PerevalManager().submit_pereval(payload)
+        self.assertEqual(result['status'], 400)
+        self.assertFalse(User.objects.filter(email='big@example.com').exists())
+
+    def test_submitted_image_stored_intact(self):
+        """Тест: сохраненный файл совпадает с исходными байтами"""
+        payload = pereval_payload('file@example.com', [
+            {'title': 'Фото', 'data': 'data:image/jpeg;base64,' + base64.b64encode(self.content).decode()}
+        ])
+        result = PerevalManager().submit_pereval(payload)
+        image = PerevalAdded.objects.get(id=result['id']).images.get()
+        with image.data.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+    def test_multipart_upload(self):
+        """Тест загрузки изображения файлом multipart вместе с JSON-частью metadata"""
+        content = noise_jpeg()
+        metadata = pereval_payload('multipart@example.com', [{'title': 'Фото', 'file': 'photo'}])
+        response = APIClient().post('/api/submitData/', data={
+            'metadata': json.dumps(metadata),
+            'photo': SimpleUploadedFile('photo.png', content, content_type='image/png'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        image = PerevalAdded.objects.get(id=response.data['id']).images.get()
+        # Расширение - по содержимому, а не по имени и типу, присланным клиентом
+        self.assertTrue(image.data.name.endswith('.jpeg'))
+        with image.data.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+
+        metadata['images'] = [{'title': 'Фото', 'file': 'missing'}]
+        response = APIClient().post('/api/submitData/', data={'metadata': json.dumps(metadata)}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unsupported_formats_rejected(self):
+        """Тест: файлы не из списка форматов отклоняются, как бы клиент их ни назвал"""
+        gif = io.BytesIO()
+        PILImage.new('RGB', (4, 4)).save(gif, 'GIF')
+        metadata = pereval_payload('format@example.com', [{'title': 'Фото', 'file': 'photo'}])
+        for content in (b'<html><script></script></html>', gif.getvalue()):
+            response = APIClient().post('/api/submitData/', data={
+                'metadata': json.dumps(metadata),
+                'photo': SimpleUploadedFile('photo.jpg', content, content_type='image/jpeg'),
+            }, format='multipart')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Неподдерживаемый формат', response.data['message'])
+        for data in ('data:image/svg+xml;base64,PHN2Zz4=', 'data:text/html;base64,PGI+'):
+            with self.assertRaisesMessage(ValidationError, 'Неподдерживаемый формат'):
+                decode_base64_image(data)
+        # base64 проверяется по содержимому так же, как файлы: тип в data: задает клиент
+        for content in (b'<html><script></script></html>', gif.getvalue()):
+            data = 'data:image/png;base64,' + base64.b64encode(content).decode()
+            metadata['images'] = [{'title': 'Фото', 'data': data}]
+            result = PerevalManager().submit_pereval(copy.deepcopy(metadata))
+            self.assertEqual(result['status'], 400)
+            self.assertIn('Неподдерживаемый формат', result['message'])
+        self.assertFalse(User.objects.filter(email='format@example.com').exists())
+        ext, upload = decode_base64_image('data:image/png;base64,' + base64.b64encode(noise_jpeg()).decode())
+        upload.close()
+        self.assertEqual(ext, 'jpeg')
+
+    @override_settings(PEREVAL_MAX_REQUEST_SIZE=1024)
+    def test_request_body_limit(self):
+        """Тест отказа 413 по Content-Length"""
+        response = APIClient().post('/api/submitData/', data=json.dumps({'x': 'y' * 2048}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class UploadSessionTest(MediaTestCase):
     def setUp(self):
         self.client = APIClient()
+        self.content = noise_jpeg(300)
+        response = self.client.post('/api/uploads/', {
+            'title': 'Вид с перевала', 'filename': 'view.jpg', 'size': len(self.content)
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.url = f"/api/uploads/{response.data['id']}/"
+
+    def put(self, offset, chunk):
+        return self.client.put(self.url, data=chunk, content_type='application/octet-stream',
+                               headers={'Upload-Offset': str(offset)})
+
+    def test_resumable_upload_and_submit(self):
+        """Тест загрузки частями, докачки после обрыва и привязки к перевалу"""
+        self.assertEqual(self.put(0, self.content[:40000]).data['offset'], 40000)
+        # Повтор уже принятой части не засчитывается
+        response = self.put(0, self.content[:40000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '40000')
+
+        # Обрыв соединения: сохраняется полученная часть
+        upload_id = self.url.split('/')[-2]
+        result = PerevalManager().append_upload(upload_id, 40000, 50000, io.BytesIO(self.content[40000:60000]))
+        self.assertEqual((result['status'], result['offset']), (400, 60000))
+        self.assertEqual(self.client.get(self.url).data['offset'], 60000)
+        self.assertEqual(self.client.post(self.url + 'finalize/').status_code, 409)
+
+        self.assertEqual(self.put(60000, self.content[60000:]).status_code, 200)
+        response = self.client.post(self.url + 'finalize/')
+        self.assertEqual(response.status_code, 200)
+        image_id = response.data['image_id']
+        # Повторное завершение возвращает то же изображение
+        self.assertEqual(self.client.post(self.url + 'finalize/').data['image_id'], image_id)
+        with Image.objects.get(id=image_id).data.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+        payload = pereval_payload('chunks@example.com', [{'id': image_id}])
+        result = PerevalManager().submit_pereval(copy.deepcopy(payload))
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(list(PerevalAdded.objects.get(id=result['id']).images.values_list('id', flat=True)),
+                         [image_id])
+        # Одно изображение нельзя привязать ко второму перевалу
+        self.assertEqual(PerevalManager().submit_pereval(copy.deepcopy(payload))['status'], 400)
+
+    def test_finalize_rejects_non_image(self):
+        """Тест: загрузка не-изображения с именем .jpg не становится изображением"""
+        response = self.client.post('/api/uploads/', {
+            'title': 'Не фото', 'filename': 'page.jpg', 'size': 64
+        }, format='json')
+        url = f"/api/uploads/{response.data['id']}/"
+        self.client.put(url, data=b'<html>' + b'x' * 58, content_type='application/octet-stream',
+                        headers={'Upload-Offset': '0'})
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Неподдерживаемый формат', response.data['message'])
+        self.assertIsNone(response.data['image_id'])
+
+    def test_chunk_beyond_size(self):
+        """Тест отказа на часть, выходящую за объявленный размер"""
+        response = self.put(0, self.content + b'x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['offset'], 0)
+
+
+def jpeg_base64(size=(40, 20), orientation=None):
+    """Тестовая фотография JPEG в виде data URI, при необходимости с EXIF-поворотом"""
+    picture = PILImage.new('RGB', size, (200, 30, 30))
+    exif = PILImage.Exif()
+    exif[0x0110] = 'Test Camera'
+    if orientation:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    picture.save(output, 'JPEG', exif=exif)
+    return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+class ImageProcessingTest(MediaTestCase):
+    def submit(self, data):
+        result = PerevalManager().submit_pereval(pereval_payload('jobs@example.com', [{'title': 'Фото', 'data': data}]))
+        self.assertEqual(result['status'], 200)
+        return PerevalAdded.objects.get(id=result['id']).images.get()
+
+    def test_processing_strips_exif_and_rotates(self):
+        """Тест: обработка идет в воркере, EXIF удаляется, поворот применяется"""
+        image = self.submit(jpeg_base64(orientation=6))
+        self.assertEqual(image.processing_status, Image.ProcessingChoices.PENDING)
+        self.assertEqual(Job.objects.filter(status=Job.StatusChoices.QUEUED).count(), 1)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, Image.ProcessingChoices.READY)
+        with image.data.open('rb') as stored, PILImage.open(stored) as picture:
+            self.assertEqual(picture.size, (20, 40))
+            self.assertEqual(len(picture.getexif()), 0)
+        self.assertEqual(Job.objects.get().status, Job.StatusChoices.DONE)
+
+    @override_settings(PEREVAL_IMAGE_SIZES={'thumb': 50, 'medium': 400})
+    def test_variants_generated_once(self):
+        """Тест: уменьшенные копии создаются при обработке в WebP и JPEG"""
+        image = self.submit(jpeg_base64(size=(300, 150)))
+        jobs.run_pending()
+        image.refresh_from_db()
+        self.assertTrue(image.data.name.endswith('.webp'))
+        variants = {(variant.size, variant.format): variant for variant in image.variants.all()}
+        self.assertEqual(set(variants), {('thumb', 'jpeg'), ('thumb', 'webp'), ('medium', 'jpeg'), ('medium', 'webp')})
+        self.assertEqual((variants['thumb', 'webp'].width, variants['thumb', 'webp'].height), (50, 25))
+        # Изображение меньше размера не увеличивается
+        self.assertEqual((variants['medium', 'jpeg'].width, variants['medium', 'jpeg'].height), (300, 150))
+
+        # Повторная обработка не создает копии заново
+        enqueue_images([image])
+        jobs.run_pending()
+        self.assertEqual(image.variants.count(), 4)
+
+    @override_settings(PEREVAL_IMAGE_SIZES={'thumb': 50, 'large': 400})
+    def test_format_negotiation(self):
+        """Тест выбора формата по заголовку Accept"""
+        image = self.submit(jpeg_base64(size=(300, 150)))
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.run_pending()
+        pereval_id = image.perevalimage_set.get().pereval_id
+        url = f'/api/submitData/{pereval_id}/'
+
+        modern = APIClient().get(url, headers={'Accept': 'image/avif,image/webp,*/*'})
+        self.assertTrue(modern.data['images'][0]['sizes']['thumb'].endswith('.webp'))
+        self.assertTrue(modern.data['images'][0]['data'].endswith('.webp'))
+        self.assertIn('Accept', modern['Vary'])
+
+        legacy = APIClient().get(url, headers={'Accept': '*/*'})
+        self.assertTrue(legacy.data['images'][0]['sizes']['thumb'].endswith('.jpeg'))
+        self.assertEqual(legacy.data['images'][0]['data'], legacy.data['images'][0]['sizes']['large'])
+        self.assertNotEqual(modern['ETag'], legacy['ETag'])
+
+    @override_settings(PEREVAL_IMAGE_KEEP_ORIGINAL=True)
+    def test_keep_original(self):
+        """Тест: при PEREVAL_IMAGE_KEEP_ORIGINAL файл хранится как загружен, создаются только копии"""
+        data = jpeg_base64(orientation=6)
+        image = self.submit(data)
+        stored_name = image.data.name
+        jobs.run_pending()
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, Image.ProcessingChoices.READY)
+        self.assertEqual(image.data.name, stored_name)
+        with image.data.open('rb') as stored:
+            self.assertEqual(stored.read(), base64.b64decode(data.split(',', 1)[1]))
+        variants = {(variant.size, variant.format): variant for variant in image.variants.all()}
+        self.assertIn(('thumb', 'webp'), variants)
+        # Поворот из EXIF применяется к копиям
+        self.assertEqual((variants['thumb', 'webp'].width, variants['thumb', 'webp'].height), (20, 40))
+
+    def test_duplicate_uploads_share_blob(self):
+        """Тест: одинаковые фотографии хранятся одним файлом со счетчиком ссылок"""
+        data = jpeg_base64(size=(64, 48))
+        first, second = self.submit(data), self.submit(data)
+        self.assertEqual(first.data.name, second.data.name)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+        blob_path = first.data.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.run_pending()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        # Пересжатие одинакового содержимого дает один и тот же результат
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertEqual({v.file.name for v in first.variants.all()}, {v.file.name for v in second.variants.all()})
+
+        variant_paths = [variant.file.path for variant in second.variants.all()]
+        self.assertTrue(variant_paths)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(second.data.path))
+        # Копии общие: пока на них ссылается второе изображение, файлы остаются
+        self.assertTrue(all(os.path.exists(path) for path in variant_paths))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(os.path.exists(second.data.path))
+        self.assertEqual([path for path in variant_paths if os.path.exists(path)], [])
+
+    def test_duplicate_after_processing(self):
+        """Тест: повторная загрузка уже обработанного файла ссылается на результат без записи и задачи"""
+        data = jpeg_base64(size=(64, 48))
+        first = self.submit(data)
+        raw_path = first.data.path
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.run_pending()
+        first.refresh_from_db()
+        self.assertFalse(os.path.exists(raw_path))
+
+        second = self.submit(data)
+        self.assertEqual(second.blob_id, first.blob_id)
+        self.assertEqual(second.processing_status, Image.ProcessingChoices.READY)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+        self.assertFalse(os.path.exists(raw_path))
+        self.assertFalse(Job.objects.filter(status=Job.StatusChoices.QUEUED).exists())
+        self.assertEqual(
+            {(v.size, v.format, v.file.name) for v in first.variants.all()},
+            {(v.size, v.format, v.file.name) for v in second.variants.all()}
+        )
+
+    def test_invalid_image_marked_failed(self):
+        """Тест: битый файл помечается ошибкой без повторов задачи"""
+        # Заголовок JPEG цел (проверка формата при приеме проходит), данные обрезаны
+        image = self.submit('data:image/jpeg;base64,' + base64.b64encode(noise_jpeg()[:2000]).decode())
+        jobs.run_pending()
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, Image.ProcessingChoices.FAILED)
+        self.assertTrue(image.processing_error)
+        self.assertEqual(Job.objects.get().status, Job.StatusChoices.DONE)
+
+    @override_settings(PEREVAL_JOBS_MAX_ATTEMPTS=2, PEREVAL_JOBS_RETRY_DELAY=0)
+    def test_failed_job_retried(self):
+        """Тест повтора упавшей задачи и отметки ошибки после последней попытки"""
+        calls = []
+
+        @jobs.handler('test_failing')
+        def failing(**payload):
+            calls.append(payload)
+            raise RuntimeError('сбой')
+        self.addCleanup(jobs.HANDLERS.pop, 'test_failing')
+
+        jobs.enqueue('test_failing', [{'n': 1}])
+        with self.assertLogs('pereval.jobs', 'ERROR'):
+            jobs.run_pending()
+        job = Job.objects.get()
+        self.assertEqual((len(calls), job.status, job.attempts), (2, Job.StatusChoices.FAILED, 2))
+        self.assertEqual(job.last_error, 'сбой')
+
+
+class ShardedStorageTest(MediaTestCase):
+    def test_new_files_sharded(self):
+        """Тест: новые файлы раскладываются по подкаталогам, повторная раскладка не меняет имя"""
+        name = image_storage().generate_filename('pereval_images/photo.jpg')
+        self.assertRegex(name, r'^pereval_images/[0-9a-f]{2}/[0-9a-f]{2}/photo\.jpg$')
+        self.assertEqual(sharded_name(name), name)
+
+    def test_shard_media_moves_legacy_files(self):
+        """Тест переноса старых файлов: новое имя в БД, файл на месте, новый номер изменения"""
+        storage = image_storage()
+        name = storage.save('pereval_images/legacy_test.jpg', ContentFile(b'legacy'))
+        self.addCleanup(storage.delete, sharded_name(name))
+        user = User.objects.create(email='shard@example.com', fam='Ш', name='Ш', phone='1')
+        pereval = PerevalAdded.objects.create(
+            beauty_title='пер.', title='Шард', user=user,
+            coords=Coords.objects.create(latitude=45, longitude=7, height=1000), level=Level.objects.create()
+        )
+        image = Image.objects.create(title='Старое', data=name, processing_status=Image.ProcessingChoices.READY)
+        pereval.images.add(image)
+        change_seq = pereval.change_seq
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('shard_media', stdout=io.StringIO())
+        image.refresh_from_db()
+        pereval.refresh_from_db()
+        self.assertEqual(image.data.name, sharded_name(name))
+        with image.data.open('rb') as stored:
+            self.assertEqual(stored.read(), b'legacy')
+        self.assertFalse(storage.exists(name))
+        self.assertGreater(pereval.change_seq, change_seq)
+
+        output = io.StringIO()
+        call_command('shard_media', stdout=output)
+        self.assertIn('Перенесено файлов: 0', output.getvalue())
+
+
+@override_settings(PEREVAL_MEDIA_MODE='django')
+class MediaServingTest(MediaTestCase):
+    def setUp(self):
+        storage = image_storage()
+        self.name = storage.save(f'pereval_images/blobs/{"ab" * 32}.jpg', ContentFile(b'0123456789'))
+        self.addCleanup(storage.delete, self.name)
+        self.url = f'/media/{self.name}'
+
+    def test_immutable_and_not_modified(self):
+        """Тест: файл по хешу кэшируется навсегда, повторный запрос с ETag получает 304"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        """Тест запроса части файла и диапазона за пределами файла"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_offload_to_proxy(self):
+        """Тест X-Accel-Redirect: тело пустое, файл отдает nginx"""
+        with override_settings(PEREVAL_MEDIA_MODE='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_not_found(self):
+        """Тест: выход за MEDIA_ROOT и отключенная отдача без DEBUG дают 404"""
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/pereval_images/missing.jpg').status_code, 404)
+        with override_settings(PEREVAL_MEDIA_MODE=''):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class RendererTest(TestCase):
+    def test_same_output_as_drf(self):
+        """Тест: рендерер на orjson дает те же байты, что и JSONRenderer DRF"""
+        data = {
+            'id': 1,
+            'title': 'Перевал\u2028Пхия',
+            'add_time': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            'updated_at': datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc),
+            'height': Decimal('1200.5'),
+            'sizes': {200: {'webp': '/media/a.webp'}},
+            'images': [{'title': None, 'ready': True, 'latitude': 45.3842}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_indent_falls_back_to_drf(self):
+        """Тест: ответ с отступами (Accept: application/json; indent=2) строит стандартный рендерер"""
+        data = {'status': 200, 'perevals': []}
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2')
+        )
+
+
+@override_settings(PEREVAL_METRICS=True)
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        metrics_registry.reset()
+        pereval_cache.cache.clear()
+        user = User.objects.create(email='metrics@example.com', fam='М', name='М', phone='1')
+        self.pereval = PerevalAdded.objects.create(
+            beauty_title='пер.', title='Метрики', user=user,
+            coords=Coords.objects.create(latitude=45, longitude=7, height=1000), level=Level.objects.create()
+        )
+
+    @override_settings(PEREVAL_SERVER_TIMING=True)
+    def test_detail_histograms(self):
+        """Тест: запрос карточки попадает в гистограммы маршрута, Server-Timing по настройке"""
+        response = self.client.get(f'/api/submitData/{self.pereval.id}/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="3 queries", render;dur=[\d.]+, total;dur=')
+
+        snapshot = metrics_registry.snapshot()
+        route = 'api/submitData/<int:pk>/'
+        counts, total = snapshot['pereval_db_queries', route, 'GET']
+        self.assertEqual(sum(counts), 1)
+        self.assertEqual(total, 3)
+        self.assertIn(('pereval_render_duration_seconds', route, 'GET'), snapshot)
+
+    @override_settings(PEREVAL_SERVER_TIMING=True)
+    async def test_asgi_counts_queries(self):
+        """Тест: под ASGI SQL-запросы считаются так же, как под WSGI"""
+        client = AsyncClient()
+        response = await client.get(f'/api/submitData/{self.pereval.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+        # Таймер снимается после запроса: следующий считает только свои запросы
+        await pereval_cache.cache.aclear()
+        response = await client.get(f'/api/submitData/{self.pereval.id}/')
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+        counts, total = metrics_registry.snapshot()['pereval_db_queries', 'api/submitData/<int:pk>/', 'GET']
+        self.assertEqual((sum(counts), total), (2, 6))
+
+    def test_prometheus_exposition(self):
+        """Тест формата /metrics: накопительные ячейки, сумма и число наблюдений"""
+        self.client.get(f'/api/submitData/{self.pereval.id}/')
+        self.client.get(f'/api/submitData/{self.pereval.id}/')
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE pereval_request_duration_seconds histogram', body)
+        labels = 'route="api/submitData/<int:pk>/",method="GET"'
+        self.assertIn(f'pereval_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'pereval_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PEREVAL_METRICS_TOKEN='secret', PEREVAL_METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_access(self):
+        """Тест: /metrics только с разрешенного адреса или с токеном"""
+        cases = [
+            ({}, status.HTTP_403_FORBIDDEN),
+            ({'HTTP_AUTHORIZATION': 'Bearer wrong'}, status.HTTP_403_FORBIDDEN),
+            ({'HTTP_AUTHORIZATION': 'Bearer secret'}, status.HTTP_200_OK),
+            ({'REMOTE_ADDR': '10.0.0.1'}, status.HTTP_200_OK),
+        ]
+        for extra, expected in cases:
+            with self.subTest(extra=extra):
+                self.assertEqual(self.client.get('/metrics', **extra).status_code, expected)
+
+    @override_settings(PEREVAL_METRICS=False)
+    def test_metrics_disabled(self):
+        """Тест: с выключенными метриками /metrics не отвечает"""
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_threads_merged(self):
+        """Тест: наблюдения из разных потоков складываются в одну серию"""
+        values = (None, 2, None, None)
+        threads = [threading.Thread(target=metrics_registry.observe, args=('r', 'GET', values)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counts, total = metrics_registry.snapshot()['pereval_db_queries', 'r', 'GET']
+        self.assertEqual((sum(counts), total), (3, 6))
+
+
+class RequestProfilerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        user = User.objects.create(email='profile@example.com', fam='П', name='П', phone='1')
+        self.pereval = PerevalAdded.objects.create(
+            beauty_title='пер.', title='Профиль', user=user,
+            coords=Coords.objects.create(latitude=45, longitude=7, height=1000), level=Level.objects.create()
+        )
+
+    def test_disabled_without_directory(self):
+        """Тест: без каталога профилировщик исключается из цепочки middleware"""
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilerMiddleware(lambda request: None)
+
+    def test_signed_header(self):
+        """Тест: профиль пишется по подписанному заголовку, поддельный токен игнорируется"""
+        url = f'/api/submitData/{self.pereval.id}/'
+        with self.settings(PEREVAL_PROFILE_DIR=self.directory):
+            response = self.client.get(url, headers={'X-Pereval-Profile': 'profile:forged:token'})
+            self.assertNotIn('X-Pereval-Profile', response)
+            self.assertEqual(os.listdir(self.directory), [])
+
+            response = self.client.get(url, headers={'X-Pereval-Profile': profile_token()})
+        filename = response['X-Pereval-Profile']
+        self.assertRegex(filename, r'^\d{8}-\d{6}_GET_api_submitData_int_pk_\d+ms_[0-9a-f]{8}\.prof$')
+        self.assertEqual(os.listdir(self.directory), [filename])
+        stats = pstats.Stats(os.path.join(self.directory, filename))
+        self.assertTrue(any('data_manager' in path for path, _, _ in stats.stats))
+
+    def test_sampling_threshold(self):
+        """Тест: случайная выборка не пишет запросы быстрее PEREVAL_PROFILE_MIN_MS"""
+        with self.settings(PEREVAL_PROFILE_DIR=self.directory, PEREVAL_PROFILE_RATE=1.0, PEREVAL_PROFILE_MIN_MS=60000):
+            self.client.get(f'/api/submitData/{self.pereval.id}/')
+        self.assertEqual(os.listdir(self.directory), [])
+        # Цепочка middleware строится клиентом один раз - для новых настроек нужен новый клиент
+        with self.settings(PEREVAL_PROFILE_DIR=self.directory, PEREVAL_PROFILE_RATE=1.0):
+            self.client_class().get(f'/api/submitData/{self.pereval.id}/')
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+
+class GeoSearchTest(TestCase):
+    def setUp(self):
+        self.manager = PerevalManager()
+        self.user = User.objects.create(email='geo@example.com', fam='Гео', name='Тест', phone='1')
+        rnd = random.Random(42)
+        self.points = [(rnd.uniform(40, 50), rnd.uniform(-5, 5)) for _ in range(150)]
+        # Точки по обе стороны 180-го меридиана
+        self.points += [(10.0, 179.9), (10.0, -179.9), (10.5, 179.5)]
+        for i, (lat, lon) in enumerate(self.points):
+            PerevalAdded.objects.create(
+                beauty_title='пер.',
+                title=f'Гео {i}',
+                user=self.user,
+                coords=Coords.objects.create(latitude=lat, longitude=lon, height=1000),
+                level=Level.objects.create()
+            )
+
+    def test_geohash_encode(self):
+        """Тест кодирования geohash на известном примере"""
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(Coords.objects.first().geohash, geohash_encode(*self.points[0]))
+
+    def test_search_bbox_matches_full_scan(self):
+        """Тест: поиск в области дает тот же результат, что и полный перебор"""
+        result = self.manager.search_bbox(43.5, -1.25, 46.0, 2.75)
+        found = {(p['coords']['latitude'], p['coords']['longitude']) for p in result['perevals']}
+        expected = {(lat, lon) for lat, lon in self.points if 43.5 <= lat <= 46.0 and -1.25 <= lon <= 2.75}
+        self.assertEqual(result['status'], 200)
+        self.assertTrue(expected)
+        self.assertEqual(found, expected)
+
+    def test_search_bbox_across_antimeridian(self):
+        """Тест поиска в области, пересекающей 180-й меридиан"""
+        result = self.manager.search_bbox(9.0, 179.0, 11.0, -179.0)
+        self.assertEqual(len(result['perevals']), 3)
+
+    def test_search_nearest_matches_full_scan(self):
+        """Тест: k ближайших совпадают с полным перебором"""
+        lat, lon = 44.2, 0.7
+        result = self.manager.search_nearest(lat, lon, k=7)
+        expected = sorted(self.points, key=lambda point: haversine_km(lat, lon, *point))[:7]
+        found = [(p['coords']['latitude'], p['coords']['longitude']) for p in result['perevals']]
+        self.assertEqual(found, expected)
+
+    @override_settings(PEREVAL_SEARCH_NEAREST_CANDIDATES=7)
+    def test_search_nearest_candidates_capped(self):
+        """Тест: ограничение числа кандидатов отрезает дальние перевалы, а не случайные"""
+        lat, lon = 45.0, -0.3
+        with CaptureQueriesContext(connection) as ctx:
+            result = self.manager.search_nearest(lat, lon, k=7)
+        expected = sorted(self.points, key=lambda point: haversine_km(lat, lon, *point))[:7]
+        found = [(p['coords']['latitude'], p['coords']['longitude']) for p in result['perevals']]
+        self.assertEqual(found, expected)
+        self.assertTrue(all('LIMIT 7' in q['sql'] for q in ctx.captured_queries[:-1]))
+
+    @override_settings(PEREVAL_SEARCH_NEAREST_MAX_KM=100)
+    def test_search_nearest_max_radius(self):
+        """Тест: дальше максимального радиуса перевалы не ищутся, их может быть меньше k"""
+        result = self.manager.search_nearest(10.2, 179.8, k=10)
+        self.assertEqual(result['status'], 200)
+        found = {(p['coords']['latitude'], p['coords']['longitude']) for p in result['perevals']}
+        self.assertEqual(found, {(10.0, 179.9), (10.0, -179.9), (10.5, 179.5)})
+        self.assertTrue(all(p['distance_km'] <= 100 for p in result['perevals']))
+        self.assertEqual(self.manager.search_nearest(0.0, 100.0, k=10)['perevals'], [])
+
+    def test_search_validation(self):
+        """Тест проверки параметров геопоиска"""
+        self.assertEqual(self.manager.search_bbox(91, 0, 92, 1)['status'], 400)
+        self.assertEqual(self.manager.search_nearest(45, 0, k=0)['status'], 400)
+        response = APIClient().get('/api/search/nearest/?lat=abc&lon=1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TileTest(MediaTestCase):
+    def setUp(self):
+        self.manager = PerevalManager()
+        self.client = APIClient()
+        self.ids = []
+        for i, (lat, lon) in enumerate([(43.35, 42.44), (43.36, 42.45), (-33.0, 151.0)]):
+            result = self.manager.submit_pereval(pereval_payload(
+                'tiles@example.com', [{'title': 'Фото', 'data': png_base64(i)}], title=f'Тайл {i}',
+                latitude=lat, longitude=lon
+            ))
+            self.ids.append(result['id'])
+
+    def tile_total(self, zoom, x, y):
+        return sum(cluster['count'] for cluster in self.manager.get_tile(zoom, x, y)['clusters'])
+
+    def test_clusters_follow_submit_and_update(self):
+        """Тест инкрементального обновления кластеров при добавлении и переносе перевала"""
+        self.assertEqual(self.tile_total(0, 0, 0), 3)
+        x, y = tiles.cell_of(43.35, 42.44, 5)
+        x, y = x >> tiles.CLUSTER_BITS, y >> tiles.CLUSTER_BITS
+        self.assertEqual(self.tile_total(5, x, y), 2)
+
+        self.manager.update_pereval(self.ids[1], {'coords': {'latitude': -33.1, 'longitude': 151.1}})
+        self.assertEqual(self.tile_total(5, x, y), 1)
+        self.assertEqual(self.tile_total(0, 0, 0), 3)
+
+        PerevalAdded.objects.get(id=self.ids[0]).delete()
+        self.assertEqual(self.tile_total(5, x, y), 0)
+
+    def test_low_zooms_derived_on_read(self):
+        """Тест: мелкие масштабы не хранятся и совпадают с суммой ячеек хранимого масштаба"""
+        base_zoom = tiles.stored_zooms().start
+        self.assertGreater(base_zoom, 0)
+        self.assertFalse(TileCluster.objects.filter(zoom__lt=base_zoom).exists())
+        # Два соседних перевала - один кластер на мелком масштабе
+        x, y = tiles.cell_of(43.35, 42.44, 2)
+        clusters = self.manager.get_tile(2, x >> tiles.CLUSTER_BITS, y >> tiles.CLUSTER_BITS)['clusters']
+        self.assertEqual(clusters, [{'count': 2, 'latitude': 43.355, 'longitude': 42.445}])
+        world = self.manager.get_tile(0, 0, 0)['clusters']
+        self.assertEqual(sorted(cluster['count'] for cluster in world), [1, 2])
+        self.assertEqual(min(zoom for zoom, _, _ in tiles.point_deltas([(43.37, 42.46)])), base_zoom)
+
+    def test_rebuild_matches_incremental(self):
+        """Тест: полный пересчет дает те же кластеры, что и инкрементальные обновления"""
+        self.manager.update_pereval(self.ids[2], {'coords': {'latitude': 43.4}})
+        fields = ('zoom', 'cell_x', 'cell_y', 'count')
+        incremental = set(TileCluster.objects.filter(count__gt=0).values_list(*fields))
+        tiles.rebuild()
+        self.assertEqual(set(TileCluster.objects.values_list(*fields)), incremental)
+
+    def test_apply_deltas_upserts_in_key_order(self):
+        """Тест: ячейки обновляются пачками INSERT ... ON CONFLICT в порядке ключа, без чтения"""
+        keys = [(5, x, y) for x in (3, 1, 2) for y in (2, 1)]
+        deltas = {key: [1, 10.0, 20.0] for key in reversed(keys)}
+        deltas[(5, 9, 9)] = [0, 0.0, 0.0]
+        with mock.patch.object(tiles, 'UPSERT_BATCH_SIZE', 4), CaptureQueriesContext(connection) as ctx:
+            tiles.apply_deltas(deltas)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        created = TileCluster.objects.filter(zoom=5, cell_x__lt=4, cell_y__lt=4).order_by('id')
+        self.assertEqual([(c.zoom, c.cell_x, c.cell_y) for c in created], sorted(keys))
+        tiles.apply_deltas({(5, 1, 1): [-1, -10.0, -20.0], (5, 3, 2): [2, 20.0, 40.0]})
+        counts = {(x, y): count for x, y, count in created.values_list('cell_x', 'cell_y', 'count')}
+        self.assertEqual((counts[1, 1], counts[3, 2], counts[2, 2]), (0, 3, 1))
+        self.assertFalse(TileCluster.objects.filter(cell_x=9).exists())
+
+    def test_migration_backfills_clusters(self):
+        """Тест: миграция заполняет кластеры перевалов, добавленных до таблицы TileCluster"""
+        fields = ('zoom', 'cell_x', 'cell_y', 'count')
+        expected = set(TileCluster.objects.values_list(*fields))
+        TileCluster.objects.all().delete()
+        backfill = importlib.import_module('pereval.migrations.0014_tilecluster_backfill')
+        backfill.backfill_tile_clusters(django_apps, None)
+        self.assertEqual(set(TileCluster.objects.values_list(*fields)), expected)
+        # Перенос после заполнения не уводит счетчики в минус
+        self.manager.update_pereval(self.ids[0], {'coords': {'latitude': 10.0}})
+        self.assertFalse(TileCluster.objects.filter(count__lt=0).exists())
+
+    def test_tile_api_etag(self):
+        """Тест ETag и условного запроса тайла"""
+        response = self.client.get('/api/tiles/0/0/0/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age', response['Cache-Control'])
+        etag = response['ETag']
+
+        # Условный запрос - одно агрегирующее чтение версии, без чтения кластеров
+        for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            with self.subTest(if_none_match=header), self.assertNumQueries(1):
+                response = self.client.get('/api/tiles/0/0/0/', HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Подстрока чужого ETag - не совпадение
+        response = self.client.get('/api/tiles/0/0/0/', HTTP_IF_NONE_MATCH=f'"x{etag[1:-1]}x"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.manager.update_pereval(self.ids[0], {'coords': {'latitude': 43.5}})
+        response = self.client.get('/api/tiles/0/0/0/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.assertEqual(self.client.get('/api/tiles/1/2/0/').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_high_zoom_tile_returns_points(self):
+        """Тест: на крупном масштабе тайл отдает отдельные перевалы"""
+        x, y = tiles.cell_of(43.35, 42.44, 17)
+        result = self.manager.get_tile(20, x, y)
+        self.assertEqual([c['id'] for c in result['clusters']], [self.ids[0]])
+
+
+class SyncTest(MediaTestCase):
+    def setUp(self):
+        self.manager = PerevalManager()
+        self.user = User.objects.create(email='sync@example.com', fam='С', name='С', phone='1')
+        self.perevals = [
+            PerevalAdded.objects.create(
+                beauty_title='пер.', title=f'Синхр {i}', user=self.user,
+                coords=Coords.objects.create(latitude=45, longitude=7, height=1000),
+                level=Level.objects.create()
+            )
+            for i in range(3)
+        ]
+
+    def test_change_seq_grows(self):
+        """Тест: каждое сохранение получает новый, больший номер изменения"""
+        seqs = [pereval.change_seq for pereval in self.perevals]
+        self.assertEqual(seqs, sorted(set(seqs)))
+        self.perevals[0].save(update_fields=['title'])
+        self.assertGreater(self.perevals[0].change_seq, seqs[-1])
+
+    def test_counter_locked_only_at_end_of_submit(self):
+        """Тест: номер изменения берется последним, файлы пишутся до транзакции"""
+        storage = image_storage()
+        outer_blocks = len(connection.atomic_blocks)
+        depths = []
+        original_save = storage.save
+
+        def save(*args, **kwargs):
+            depths.append(len(connection.atomic_blocks) - outer_blocks)
+            return original_save(*args, **kwargs)
+
+        data = pereval_payload('counter@example.com', 2)
+        with mock.patch.object(storage, 'save', side_effect=save), \
+                CaptureQueriesContext(connection) as ctx:
+            result = self.manager.submit_pereval(data)
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(depths, [0, 0])
+        statements = [q['sql'] for q in ctx.captured_queries]
+        allocate = next(i for i, sql in enumerate(statements) if 'pereval_syncsequence' in sql)
+        self.assertTrue(statements[allocate + 1].startswith('UPDATE "pereval_perevaladded"'))
+        self.assertTrue(all(sql.startswith('RELEASE SAVEPOINT') for sql in statements[allocate + 2:]))
+        self.assertGreater(PerevalAdded.objects.get(id=result['id']).change_seq, self.perevals[-1].change_seq)
+
+    def test_sync_returns_only_changes(self):
+        """Тест: после токена возвращаются только измененные и удаленные перевалы"""
+        full = self.manager.sync('sync@example.com')
+        self.assertEqual(len(full['perevals']), 3)
+        token = full['next_token']
+
+        empty = self.manager.sync('sync@example.com', token)
+        self.assertEqual((empty['perevals'], empty['deleted']), ([], []))
+        self.assertEqual(empty['next_token'], token)
+
+        self.perevals[1].status = 'accepted'
+        self.perevals[1].save()
+        deleted_id = self.perevals[2].id
+        self.perevals[2].delete()
+
+        delta = self.manager.sync('sync@example.com', token)
+        self.assertEqual([p['id'] for p in delta['perevals']], [self.perevals[1].id])
+        self.assertEqual(delta['perevals'][0]['status'], 'accepted')
+        self.assertEqual(delta['deleted'], [deleted_id])
+
+    def test_sync_pages(self):
+        """Тест постраничной синхронизации через has_more"""
+        first = self.manager.sync('sync@example.com', limit=2)
+        self.assertTrue(first['has_more'])
+        second = self.manager.sync('sync@example.com', first['next_token'], limit=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['perevals']) + len(second['perevals']), 3)
+
+        response = APIClient().get('/api/sync/?user__email=sync@example.com&since=плохой')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        pereval_cache.cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create(email='async@example.com', fam='А', name='А', phone='1')
+        self.pereval = PerevalAdded.objects.create(
+            beauty_title='пер.', title='Async', user=self.user,
+            coords=Coords.objects.create(latitude=45, longitude=7, height=1000), level=Level.objects.create()
+        )
+        self.pereval.images.add(Image.objects.create(title='Фото', processing_status=Image.ProcessingChoices.READY))
+
+    async def test_detail_matches_sync_view(self):
+        """Тест: async-карточка совпадает с ответом синхронного APIView, ETag дает 304"""
+        sync_response = await sync_to_async(self.client.get)(f'/api/submitData/{self.pereval.id}/')
+        response = await pereval_detail(self.factory.get('/'), self.pereval.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(sync_response.content))
+        self.assertEqual(response['ETag'], sync_response['ETag'])
+
+        request = self.factory.get('/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual((await pereval_detail(request, self.pereval.id)).status_code, 304)
+        self.assertEqual((await pereval_detail(self.factory.get('/'), 10 ** 6)).status_code, 404)
+
+    async def test_list_by_email(self):
+        """Тест async-списка по email: данные, курсор и ошибки как у синхронного APIView"""
+        url = '/api/submitData/?user__email=async@example.com&limit=1'
+        sync_response = await sync_to_async(self.client.get)(url)
+        response = await perevals_by_email(self.factory.get(url))
+        self.assertEqual(json.loads(response.content), json.loads(sync_response.content))
+        self.assertEqual(len(json.loads(response.content)['perevals']), 1)
+
+        self.assertEqual((await perevals_by_email(self.factory.get('/api/submitData/'))).status_code, 400)
+        missing = await perevals_by_email(self.factory.get('/api/submitData/?user__email=none@example.com'))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_other_methods_use_sync_view(self):
+        """Тест: PATCH через async-представление обрабатывается синхронным APIView"""
+        view = async_read_view(pereval_detail, SubmitDataDetailAPI)
+        request = self.factory.patch('/', data={'title': 'Изменен'}, content_type='application/json')
+        response = await view(request, pk=self.pereval.id)
+        self.assertEqual(response.status_code, 200)
+        await self.pereval.arefresh_from_db()
+        self.assertEqual(self.pereval.title, 'Изменен')
+
+
+class QueryBudgetTest(MediaTestCase):
+    """Число SQL-запросов каждого метода PerevalManager.
+
+    Бюджеты закреплены точно на данных, где N+1 был бы заметен: у
+    пользователя несколько перевалов с изображениями и их копиями.
+    Изменение числа запросов в любую сторону - осознанная правка
+    QUERY_BUDGETS вместе с кодом. SAVEPOINT/RELEASE вложенных транзакций
+    тоже считаются запросами.
+    """
+    QUERY_BUDGETS = {
+        # Добавление нового пользователя: пользователь - 3 (SELECT, INSERT, SELECT), координаты,
+        # уровень, перевал - 3, blob - 4 (поиск уже обработанных, INSERT, SELECT, UPDATE ref_count),
+        # изображения, задачи обработки, связи - 3, кластеры карты - 1, номера изменений - 2
+        # (счетчик и UPDATE change_seq в конце транзакции), SAVEPOINT/RELEASE - 2
+        'submit_pereval': 18,  # с двумя изображениями base64
+        'submit_many': 18,  # три перевала: число запросов не зависит от размера пакета
+        'get_pereval_by_id': 3,  # перевал с пользователем, координатами и уровнем; изображения; копии
+        'aget_pereval_by_id': 3,
+        'update_pereval': 8,  # название, координаты и уровень сразу
+        'get_perevals_by_email': 4,  # пользователь; страница; изображения; копии
+        'aget_perevals_by_email': 4,
+        'get_pereval_updated_at': 1,
+        'aget_pereval_updated_at': 1,
+        'get_perevals_by_email_versions': 1,
+        'aget_perevals_by_email_versions': 1,
+        'get_perevals': 3,
+        'paginate': 1,
+        'apaginate': 1,
+        'search_bbox': 1,
+        'search_nearest': 2,  # координаты кандидатов; найденные перевалы
+        'get_tile': 1,
+        'get_tile_version': 1,
+        'sync': 4,  # изменения, удаления, изображения, копии
+        'claim_uploaded_images': 4,
+        'unavailable_uploads': 1,
+        'create_upload': 1,
+        'get_upload': 1,
+        'append_upload': 3,
+        'finalize_upload': 10,
+    }
+    # Методы без обращений к БД
+    WITHOUT_QUERIES = {
+        'get_db_config', 'validate_data', 'check_text', 'check_number', 'decode_image', 'file_image',
+        'check_uploaded_ids', 'upload_to_dict', 'changed_fields', 'validate_update', 'check_coords',
+        'encode_cursor', 'decode_cursor', 'pereval_to_point', 'validate_point',
+        'encode_sync_token', 'decode_sync_token',
+    }
+
+    def setUp(self):
+        pereval_cache.cache.clear()
+        self.manager = PerevalManager()
+        self.user = User.objects.create(email='budget@example.com', fam='Б', name='Б', phone='1')
+        self.perevals = []
+        for i in range(5):
+            pereval = PerevalAdded.objects.create(
+                beauty_title='пер.', title=f'Бюджет {i}', user=self.user,
+                coords=Coords.objects.create(latitude=45 + i / 100, longitude=7, height=1000),
+                level=Level.objects.create(summer='1A')
+            )
+            for j in range(2):
+                image = Image.objects.create(title=f'Фото {j}', data=f'pereval_images/budget_{i}_{j}.jpg')
+                pereval.images.add(image)
+                for size in ('thumb', 'medium'):
+                    ImageVariant.objects.create(image=image, size=size, format='webp', width=1, height=1,
+                                                file=f'pereval_images/variants/budget_{i}_{j}_{size}.webp')
+            self.perevals.append(pereval)
+
+    def calls(self):
+        """Вызов каждого метода на типичных данных"""
+        manager, pereval_id, email = self.manager, self.perevals[0].id, self.user.email
+        content = noise_jpeg(16)
+        upload = {}
+
+        def create_upload():
+            upload.update(manager.create_upload({'title': 'Фото', 'filename': 'view.jpg', 'size': len(content)}))
+
+        def claim():
+            image = Image.objects.create(title='Загружено', data='pereval_images/claimed.jpg')
+            UploadSession.objects.create(title='Фото', filename='claimed.jpg', content_type='image/jpeg', size=1,
+                                         offset=1, status=UploadSession.StatusChoices.COMPLETE, image=image)
+            return lambda: manager.claim_uploaded_images([image.id])
+
+        return [
+            ('get_pereval_by_id', lambda: manager.get_pereval_by_id(pereval_id)),
+            ('aget_pereval_by_id', lambda: async_to_sync(manager.aget_pereval_by_id)(pereval_id)),
+            ('get_perevals_by_email', lambda: manager.get_perevals_by_email(email, limit=3)),
+            ('aget_perevals_by_email', lambda: async_to_sync(manager.aget_perevals_by_email)(email, limit=3)),
+            ('get_pereval_updated_at', lambda: manager.get_pereval_updated_at(pereval_id)),
+            ('aget_pereval_updated_at', lambda: async_to_sync(manager.aget_pereval_updated_at)(pereval_id)),
+            ('get_perevals_by_email_versions', lambda: manager.get_perevals_by_email_versions(email, limit=3)),
+            ('aget_perevals_by_email_versions',
+             lambda: async_to_sync(manager.aget_perevals_by_email_versions)(email, limit=3)),
+            ('get_perevals', lambda: manager.get_perevals(status='new', limit=3)),
+            ('paginate', lambda: manager.paginate(PerevalAdded.objects.values('id', 'add_time'), limit=3)),
+            ('apaginate',
+             lambda: async_to_sync(manager.apaginate)(PerevalAdded.objects.values('id', 'add_time'), limit=3)),
+            ('search_bbox', lambda: manager.search_bbox(44.9, 6.9, 45.2, 7.1)),
+            ('search_nearest', lambda: manager.search_nearest(45.0, 7.0, k=3)),
+            ('get_tile', lambda: manager.get_tile(3, 4, 2)),
+            ('get_tile_version', lambda: manager.get_tile_version(3, 4, 2)),
+            ('sync', lambda: manager.sync(email)),
+            ('update_pereval', lambda: manager.update_pereval(
+                pereval_id, {'title': 'Новое', 'coords': {'latitude': 45.5}, 'level': {'summer': '2A'}}
+            )),
+            ('submit_pereval', lambda: manager.submit_pereval(pereval_payload('new@example.com', 2))),
+            ('submit_many', lambda: manager.submit_many([
+                pereval_payload(f'many{i}@example.com', 1) for i in range(3)
+            ])),
+            ('claim_uploaded_images', claim()),
+            ('unavailable_uploads', lambda: manager.unavailable_uploads([1, 2])),
+            ('create_upload', create_upload),
+            ('get_upload', lambda: manager.get_upload(upload['id'])),
+            ('append_upload', lambda: manager.append_upload(upload['id'], 0, len(content), io.BytesIO(content))),
+            ('finalize_upload', lambda: manager.finalize_upload(upload['id'])),
+        ]
+
+    def test_every_method_has_budget(self):
+        """Тест: у каждого публичного метода менеджера есть бюджет запросов"""
+        public = {
+            name for name in dir(PerevalManager)
+            if not name.startswith('_') and callable(getattr(PerevalManager, name))
+        }
+        self.assertEqual(public - self.WITHOUT_QUERIES, set(self.QUERY_BUDGETS))
+        self.assertEqual({name for name, _ in self.calls()}, set(self.QUERY_BUDGETS))
+
+    def test_query_budgets(self):
+        """Тест: методы менеджера укладываются ровно в свой бюджет запросов"""
+        for name, call in self.calls():
+            pereval_cache.cache.clear()
+            with self.subTest(method=name):
+                with CaptureQueriesContext(connection) as ctx:
+                    call()
+                queries = '\n'.join(query['sql'] for query in ctx.captured_queries)
+                self.assertEqual(len(ctx.captured_queries), self.QUERY_BUDGETS[name], f'{name}:\n{queries}')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Планы запросов проверяются на PostgreSQL')
+class QueryPlanTest(TestCase):
+    """EXPLAIN основных запросов PerevalManager на таблицах реального размера.
+
+    Каждый SELECT, выполненный методом, повторяется с EXPLAIN. Тест
+    падает, если план читает pereval_perevaladded, pereval_user или
+    pereval_perevalimage последовательным сканированием, а не по индексу.
+    На маленьких таблицах планировщик выбирает Seq Scan и без регрессии,
+    поэтому данные заполняются до PLAN_TABLE_ROWS перевалов и ANALYZE.
+    Для списков и синхронизации проверяется и имя индекса из миграций.
+    """
+    PLAN_TABLE_ROWS = 20000
+    SEQ_SCAN = re.compile(r'Seq Scan on (pereval_perevaladded|pereval_user|pereval_perevalimage)\b')
+    EXPECTED_INDEXES = {
+        'get_perevals_by_email': 'pereval_user_time_idx',
+        'get_perevals_by_email_next_page': 'pereval_user_time_idx',
+        'get_perevals': 'pereval_time_idx',
+        'get_perevals_by_status': 'pereval_status_time_idx',
+        'sync': 'pereval_user_seq_idx',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(7)
+        rows = cls.PLAN_TABLE_ROWS
+        users = User.objects.bulk_create([
+            User(email=f'plan{i}@example.com', fam='П', name='П', phone='1') for i in range(rows // 20)
+        ])
+        coords = Coords.objects.bulk_create([
+            Coords(latitude=rnd.uniform(40, 50), longitude=rnd.uniform(0, 20), height=2000) for _ in range(rows)
+        ])
+        levels = Level.objects.bulk_create([Level(summer='1A') for _ in range(rows)])
+        # Статусы распределены равномерно: фильтр по статусу выбирает четверть таблицы
+        statuses = [choice.value for choice in PerevalAdded.StatusChoices]
+        perevals = PerevalAdded.objects.bulk_create([
+            PerevalAdded(beauty_title='пер.', title=f'План {i}', user=rnd.choice(users), coords=c, level=lv,
+                         change_seq=i + 1, status=statuses[i % len(statuses)])
+            for i, (c, lv) in enumerate(zip(coords, levels))
+        ])
+        images = Image.objects.bulk_create([
+            Image(title='Фото', data=f'pereval_images/plan_{i}.jpg') for i in range(rows * 2)
+        ])
+        PerevalImage.objects.bulk_create([
+            PerevalImage(pereval=perevals[i // 2], image=image) for i, image in enumerate(images)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # update_pereval меняет только новые перевалы
+        cls.pereval_id = perevals[rows // 2 // len(statuses) * len(statuses)].id
+        cls.email = users[len(users) // 2].email
+
+    def plans(self, call):
+        """(SQL, план) каждого SELECT, выполненного call"""
+        with CaptureQueriesContext(connection) as ctx:
+            call()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                if not query['sql'].lstrip().upper().startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN ' + query['sql'])
+                plans.append((query['sql'], '\n'.join(row[0] for row in cursor.fetchall())))
+        return plans
+
+    def test_no_sequential_scans(self):
+        """Тест: основные запросы читают большие таблицы по индексам"""
+        manager = PerevalManager()
+        first_page = manager.get_perevals_by_email(self.email, limit=5)
+        calls = {
+            'get_pereval_by_id': lambda: manager.get_pereval_by_id(self.pereval_id),
+            'get_pereval_updated_at': lambda: manager.get_pereval_updated_at(self.pereval_id),
+            'get_perevals_by_email': lambda: manager.get_perevals_by_email(self.email, limit=5),
+            'get_perevals_by_email_next_page':
+                lambda: manager.get_perevals_by_email(self.email, first_page['next_cursor'], limit=5),
+            'get_perevals_by_email_versions': lambda: manager.get_perevals_by_email_versions(self.email, limit=5),
+            'get_perevals': lambda: manager.get_perevals(limit=20),
+            'get_perevals_by_status': lambda: manager.get_perevals(status='new', limit=20),
+            'sync': lambda: manager.sync(self.email, manager.encode_sync_token(self.PLAN_TABLE_ROWS // 2)),
+            'update_pereval': lambda: manager.update_pereval(self.pereval_id, {'title': 'План изменен'}),
+        }
+        for name, call in calls.items():
+            pereval_cache.cache.clear()
+            with self.subTest(method=name):
+                plans = self.plans(call)
+                for sql, plan in plans:
+                    self.assertIsNone(self.SEQ_SCAN.search(plan), f'{name}:\n{sql}\n{plan}')
+                if name in self.EXPECTED_INDEXES:
+                    self.assertTrue(
+                        any(self.EXPECTED_INDEXES[name] in plan for _, plan in plans),
+                        f'{name} не использует {self.EXPECTED_INDEXES[name]}:\n' + '\n'.join(plan for _, plan in plans)
+                    )
+
+
+class PerevalIndexTest(TestCase):
+    def test_expected_indexes_exist(self):
+        """Тест: индексы, на которые рассчитаны планы QueryPlanTest, созданы миграциями (на любой БД)"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, PerevalAdded._meta.db_table)
+        for name in sorted(set(QueryPlanTest.EXPECTED_INDEXES.values())):
+            with self.subTest(index=name):
+                self.assertIn(name, constraints)
+                self.assertTrue(constraints[name]['index'])
+
+
+class SeedPerevalsTest(MediaTestCase):
+    def test_seed(self):
+        """Тест генератора: объемы, координаты горных районов, номера изменений и общие заглушки"""
+        call_command('seed_perevals', count=120, images_per=2, users=30, chunk_size=50, stdout=io.StringIO())
+
+        self.assertEqual(PerevalAdded.objects.count(), 120)
+        self.assertEqual(PerevalImage.objects.count(), 240)
+        self.assertEqual(User.objects.count(), 30)
+        # Содержимое изображений - несколько заглушек со счетчиками ссылок
+        self.assertLessEqual(ImageBlob.objects.count(), 16)
+        self.assertEqual(sum(ImageBlob.objects.values_list('ref_count', flat=True)), 240)
+        # Изображения уже обработаны: все размеры и форматы, файлы копий общие
+        self.assertFalse(Image.objects.exclude(processing_status=Image.ProcessingChoices.READY).exists())
+        per_image = len(settings.PEREVAL_IMAGE_SIZES) * (1 + len(modern_formats()))
+        self.assertEqual(ImageVariant.objects.count(), 240 * per_image)
+        variant_files = set(ImageVariant.objects.values_list('file', flat=True))
+        self.assertLessEqual(len(variant_files), 16 * per_image)
+        self.assertTrue(all(image_storage().exists(name) for name in variant_files))
+        self.assertEqual(PerevalAdded.objects.values('change_seq').distinct().count(), 120)
+        for latitude, longitude, geohash in Coords.objects.values_list('latitude', 'longitude', 'geohash'):
+            self.assertTrue(37 <= latitude <= 68.5 and 6 <= longitude <= 101)
+            self.assertEqual(geohash, geohash_encode(latitude, longitude))
+        self.assertEqual(sum(cluster['count'] for cluster in tiles.tile_clusters(0, 0, 0)), 120)
+
+        # Распределение по пользователям неравномерное: у первого по рангу больше всех
+        per_user = sorted(User.objects.annotate(n=Count('pereval')).values_list('n', flat=True), reverse=True)
+        self.assertGreater(per_user[0], 120 / 30 * 3)
+
+        # Повторный запуск с тем же --seed добавляет данные, а не пересоздает: адреса с префиксом запуска
+        call_command('seed_perevals', count=10, images_per=0, stdout=io.StringIO())
+        self.assertEqual(PerevalAdded.objects.count(), 130)
+        self.assertEqual(User.objects.count(), 32)
+        self.assertEqual(len({email.rsplit('-', 1)[0] for email in User.objects.values_list('email', flat=True)}), 2)
+
+
+class PerevalAPITest(MediaTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        pereval_cache.cache.clear()
 
         # Создаем тестового пользователя
         self.user = User.objects.create(
@@ -209,6 +1715,37 @@ class PerevalAPITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['title'], 'API Тест')
 
+    def test_get_pereval_conditional(self):
+        """Тест условного GET карточки: 304 без построения ответа, 200 после изменения"""
+        url = f'/api/submitData/{self.pereval.id}/'
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, data=json.dumps({'title': 'Изменен'}), content_type='application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_search_by_email_conditional(self):
+        """Тест условного GET списка по email"""
+        url = '/api/submitData/?user__email=api_test@example.com'
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        PerevalAdded.objects.filter(id=self.pereval.id).update(status='accepted', updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['perevals'][0]['status'], 'accepted')
+
     def test_update_pereval(self):
         """Тест обновления данных перевала"""
         url = f'/api/submitData/{self.pereval.id}/'
@@ -236,6 +1773,27 @@ class PerevalAPITest(TestCase):
         self.assertEqual(len(response.data['perevals']), 1)
         self.assertEqual(response.data['perevals'][0]['title'], 'API Тест')
 
+    def test_create_batch(self):
+        """Тест пакетного создания перевалов через API"""
+        response = self.client.post(
+            '/api/submitData/batch/',
+            data=json.dumps([self.valid_payload, self.valid_payload]),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(all(r['id'] for r in response.data['results']))
+
+    def test_list_all_paginated(self):
+        """Тест постраничного списка всех перевалов"""
+        response = self.client.get('/api/submitData/all/?status=new&limit=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['perevals']), 1)
+        self.assertIsNone(response.data['next_cursor'])
+
+        response = self.client.get('/api/submitData/all/?limit=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_invalid_data(self):
         """Тест обработки невалидных данных"""
         url = '/api/submitData/'
@@ -0,0 +1,191 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .models import PerevalAdded, TileCluster
+
+# Каждый тайл делится на сетку 2^CLUSTER_BITS x 2^CLUSTER_BITS ячеек кластеров
+CLUSTER_BITS = 3
+MAX_MERCATOR_LATITUDE = 85.05112878
+# Ячеек в одном INSERT ... ON CONFLICT (по 7 параметров на ячейку)
+UPSERT_BATCH_SIZE = 500
+
+
+def cell_of(latitude, longitude, zoom):
+    """Ячейка кластера (cell_x, cell_y) точки на масштабе zoom в проекции Web Mercator"""
+    latitude = max(-MAX_MERCATOR_LATITUDE, min(MAX_MERCATOR_LATITUDE, latitude))
+    scale = 2 ** (zoom + CLUSTER_BITS)
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0
+    return min(int(x * scale), scale - 1), min(int(y * scale), scale - 1)
+
+
+def is_valid_tile(zoom, x, y):
+    return 0 <= zoom <= settings.PEREVAL_TILE_MAX_REQUEST_ZOOM and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+
+def tile_bounds(zoom, x, y):
+    """Границы тайла в градусах: (min_lat, min_lon, max_lat, max_lon)"""
+    n = 2 ** zoom
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return latitude(y + 1), x / n * 360.0 - 180.0, latitude(y), (x + 1) / n * 360.0 - 180.0
+
+
+def stored_zooms():
+    """Масштабы, кластеры которых хранятся в таблице.
+
+    Мелкие масштабы (ниже PEREVAL_TILE_MIN_ZOOM) не хранятся: ячейка
+    масштаба 0 покрывает весь мир, и каждая запись перевала обновляла бы
+    одну и ту же строку, выстраивая параллельные записи в очередь. Такие
+    тайлы собираются при чтении из ячеек масштаба PEREVAL_TILE_MIN_ZOOM.
+    """
+    max_zoom = settings.PEREVAL_TILE_MAX_ZOOM
+    return range(min(settings.PEREVAL_TILE_MIN_ZOOM, max_zoom), max_zoom + 1)
+
+
+def point_deltas(points, sign=1, deltas=None):
+    """Изменения кластеров хранимых масштабов от добавления (sign=1) или удаления (sign=-1) точек"""
+    if deltas is None:
+        deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for latitude, longitude in points:
+        latitude, longitude = float(latitude), float(longitude)
+        for zoom in stored_zooms():
+            delta = deltas[(zoom, *cell_of(latitude, longitude, zoom))]
+            delta[0] += sign
+            delta[1] += sign * latitude
+            delta[2] += sign * longitude
+    return deltas
+
+
+def apply_deltas(deltas):
+    """Инкрементальное обновление предрасчитанных кластеров.
+
+    Одно INSERT ... ON CONFLICT DO UPDATE с приращениями на каждые
+    UPSERT_BATCH_SIZE ячеек: недостающие ячейки создаются, существующие
+    увеличиваются на месте, поэтому параллельные записи не теряют изменения
+    друг друга. Ячейки идут в порядке ключа (zoom, cell_x, cell_y): все
+    транзакции блокируют строки в одном порядке и не ждут друг друга по кругу.
+    """
+    keys = sorted(key for key, delta in deltas.items() if any(delta))
+    if not keys:
+        return
+    table = connection.ops.quote_name(TileCluster._meta.db_table)
+    zoom, cell_x, cell_y, count, sum_lat, sum_lon, updated_at = (
+        connection.ops.quote_name(column)
+        for column in ('zoom', 'cell_x', 'cell_y', 'count', 'sum_lat', 'sum_lon', 'updated_at')
+    )
+    # updated_at - версия тайла для ETag (tile_version)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+            batch = keys[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} ({zoom}, {cell_x}, {cell_y}, {count}, {sum_lat}, {sum_lon}, {updated_at}) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({zoom}, {cell_x}, {cell_y}) DO UPDATE SET '
+                f'{count} = {table}.{count} + EXCLUDED.{count}, '
+                f'{sum_lat} = {table}.{sum_lat} + EXCLUDED.{sum_lat}, '
+                f'{sum_lon} = {table}.{sum_lon} + EXCLUDED.{sum_lon}, '
+                f'{updated_at} = EXCLUDED.{updated_at}',
+                [value for key in batch for value in (*key, *deltas[key], now)]
+            )
+
+
+def add_points(points):
+    apply_deltas(point_deltas(points))
+
+
+def move_point(old, new):
+    """Перенос точки: вычитание из старых кластеров и добавление в новые"""
+    deltas = point_deltas([old], sign=-1)
+    apply_deltas(point_deltas([new], deltas=deltas))
+
+
+def remove_points(points):
+    apply_deltas(point_deltas(points, sign=-1))
+
+
+def stored_cells(zoom, x, y):
+    """Хранимые ячейки под тайлом: масштаб и диапазоны cell_x, cell_y.
+
+    Для мелких масштабов - ячейки PEREVAL_TILE_MIN_ZOOM, для крупных
+    (выше PEREVAL_TILE_MAX_ZOOM) - ячейки PEREVAL_TILE_MAX_ZOOM, в которые
+    попадает тайл.
+    """
+    zooms = stored_zooms()
+    cell_zoom = min(max(zoom, zooms.start), zooms.stop - 1)
+    scale = 2 ** (cell_zoom + CLUSTER_BITS)
+    n = 2 ** zoom
+    return cell_zoom, (x * scale // n, ((x + 1) * scale - 1) // n), (y * scale // n, ((y + 1) * scale - 1) // n)
+
+
+def tile_version(zoom, x, y):
+    """Время последнего изменения ячеек под тайлом (None - ячеек нет).
+
+    Добавление, перенос и удаление перевала обновляют updated_at ячеек
+    всех хранимых масштабов, поэтому версия меняется с любым изменением
+    содержимого тайла. Одно агрегирующее чтение по индексу ячеек,
+    сами кластеры не читаются.
+    """
+    cell_zoom, x_range, y_range = stored_cells(zoom, x, y)
+    return TileCluster.objects.filter(
+        zoom=cell_zoom, cell_x__range=x_range, cell_y__range=y_range
+    ).aggregate(version=Max('updated_at'))['version']
+
+
+def tile_clusters(zoom, x, y):
+    """Кластеры тайла: число перевалов и центроид в каждой непустой ячейке"""
+    cell_zoom, x_range, y_range = stored_cells(zoom, x, y)
+    cells = TileCluster.objects.filter(zoom=cell_zoom, cell_x__range=x_range, cell_y__range=y_range, count__gt=0)
+    if zoom == cell_zoom:
+        clusters = cells.order_by('cell_x', 'cell_y').values_list('count', 'sum_lat', 'sum_lon')
+    else:
+        # Ячейка мелкого масштаба - сумма factor x factor ячеек хранимого масштаба
+        # под ней: тот же один запрос с группировкой по целочисленному делению
+        factor = 2 ** (cell_zoom - zoom)
+        clusters = (
+            cells
+            .values(parent_x=F('cell_x') / factor, parent_y=F('cell_y') / factor)
+            .annotate(total=Sum('count'), total_lat=Sum('sum_lat'), total_lon=Sum('sum_lon'))
+            .order_by('parent_x', 'parent_y')
+            .values_list('total', 'total_lat', 'total_lon')
+        )
+    return [
+        {
+            'count': count,
+            'latitude': round(sum_lat / count, 6),
+            'longitude': round(sum_lon / count, 6),
+        }
+        for count, sum_lat, sum_lon in clusters
+    ]
+
+
+def rebuild(chunk_size=10000, pereval_model=PerevalAdded, cluster_model=TileCluster):
+    """Полный пересчет кластеров по всем перевалам, масштаб за масштабом,
+    чтобы в памяти держать ячейки только одного масштаба.
+
+    Миграция заполнения передает исторические модели из apps.
+    """
+    cluster_model.objects.all().delete()
+    points = pereval_model.objects.values_list('coords__latitude', 'coords__longitude')
+    for zoom in stored_zooms():
+        cells = defaultdict(lambda: [0, 0.0, 0.0])
+        for latitude, longitude in points.iterator(chunk_size=chunk_size):
+            cell = cells[cell_of(latitude, longitude, zoom)]
+            cell[0] += 1
+            cell[1] += latitude
+            cell[2] += longitude
+        cluster_model.objects.bulk_create(
+            (
+                cluster_model(zoom=zoom, cell_x=cell_x, cell_y=cell_y, count=count, sum_lat=sum_lat, sum_lon=sum_lon)
+                for (cell_x, cell_y), (count, sum_lat, sum_lon) in cells.items()
+            ),
+            batch_size=chunk_size
+        )
@@ -0,0 +1,61 @@
+import os
+
+from django.conf import settings
+from django.core.files import File
+
+# Размер порции при записи тела запроса на диск
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class PartFile(File):
+    """Докачанный файл сессии: хранилище переносит его по пути, а не копирует"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(session):
+    return os.path.join(settings.PEREVAL_UPLOAD_DIR, f'{session.id}.part')
+
+
+def create_part(session):
+    os.makedirs(settings.PEREVAL_UPLOAD_DIR, exist_ok=True)
+    open(part_path(session), 'wb').close()
+
+
+def write_part(session, offset, length, stream):
+    """Запись части файла с позиции offset из потока запроса.
+
+    Возвращает число записанных байт: при обрыве соединения сохраняется
+    все, что успело прийти, и клиент докачивает только остаток.
+    """
+    written = 0
+    with open(part_path(session), 'r+b') as part:
+        part.seek(offset)
+        try:
+            while written < length:
+                chunk = stream.read(min(COPY_CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                part.write(chunk)
+                written += len(chunk)
+        except OSError:
+            # Клиент оборвал соединение: полученные байты остаются в файле
+            pass
+        part.flush()
+    return written
+
+
+def open_part(session, name):
+    """Готовый файл сессии, обрезанный до объявленного размера"""
+    path = part_path(session)
+    with open(path, 'r+b') as part:
+        part.truncate(session.size)
+    return PartFile(open(path, 'rb'), name=name)
+
+
+def remove_part(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
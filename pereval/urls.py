@@ -1,7 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from .views import SubmitDataListAPI, SubmitDataDetailAPI
+from .async_views import async_read_view, pereval_detail, perevals_by_email
+from .views import (
+    SubmitDataListAPI, SubmitDataBatchAPI, SubmitDataAllAPI, SubmitDataDetailAPI,
+    SearchBBoxAPI, SearchNearestAPI, TileAPI, CacheStatsAPI, SyncAPI,
+    UploadListAPI, UploadDetailAPI, UploadFinalizeAPI,
+)
+
+if settings.PEREVAL_ASYNC_VIEWS:
+    submit_data_view = async_read_view(perevals_by_email, SubmitDataListAPI)
+    submit_data_detail_view = async_read_view(pereval_detail, SubmitDataDetailAPI)
+else:
+    submit_data_view = SubmitDataListAPI.as_view()
+    submit_data_detail_view = SubmitDataDetailAPI.as_view()
 
 urlpatterns = [
-    path('submitData/', SubmitDataListAPI.as_view(), name='submit-data'),
-    path('submitData/<int:pk>/', SubmitDataDetailAPI.as_view(), name='submit-data-detail'),
+    path('submitData/', submit_data_view, name='submit-data'),
+    path('submitData/batch/', SubmitDataBatchAPI.as_view(), name='submit-data-batch'),
+    path('submitData/all/', SubmitDataAllAPI.as_view(), name='submit-data-all'),
+    path('submitData/<int:pk>/', submit_data_detail_view, name='submit-data-detail'),
+    path('search/bbox/', SearchBBoxAPI.as_view(), name='search-bbox'),
+    path('search/nearest/', SearchNearestAPI.as_view(), name='search-nearest'),
+    path('tiles/<int:z>/<int:x>/<int:y>/', TileAPI.as_view(), name='tiles'),
+    path('sync/', SyncAPI.as_view(), name='sync'),
+    path('uploads/', UploadListAPI.as_view(), name='uploads'),
+    path('uploads/<uuid:pk>/', UploadDetailAPI.as_view(), name='upload-detail'),
+    path('uploads/<uuid:pk>/finalize/', UploadFinalizeAPI.as_view(), name='upload-finalize'),
+    path('cache/stats/', CacheStatsAPI.as_view(), name='cache-stats'),
 ]
\ No newline at end of file
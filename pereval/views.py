@@ -1,3 +1,9 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -6,6 +12,168 @@ from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from .models import PerevalAdded
 from .data_manager import PerevalManager
+from .cache import pereval_cache
+from .images import accepted_formats, negotiate_image, negotiate_perevals
+
+
+PEREVAL_CREATE_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'beauty_title': openapi.Schema(type=openapi.TYPE_STRING),
+        'title': openapi.Schema(type=openapi.TYPE_STRING),
+        'other_titles': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+        'connect': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+        'user': openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'email': openapi.Schema(type=openapi.TYPE_STRING, format='email'),
+                'fam': openapi.Schema(type=openapi.TYPE_STRING),
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'otc': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+                'phone': openapi.Schema(type=openapi.TYPE_STRING),
+            },
+            required=['email', 'fam', 'name', 'phone']
+        ),
+        'coords': openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'latitude': openapi.Schema(type=openapi.TYPE_NUMBER, format='float'),
+                'longitude': openapi.Schema(type=openapi.TYPE_NUMBER, format='float'),
+                'height': openapi.Schema(type=openapi.TYPE_INTEGER),
+            },
+            required=['latitude', 'longitude', 'height']
+        ),
+        'level': openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'winter': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+                'summer': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+                'autumn': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+                'spring': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+            }
+        ),
+        'images': openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'data': openapi.Schema(type=openapi.TYPE_STRING, format='binary'),
+                    'title': openapi.Schema(type=openapi.TYPE_STRING),
+                },
+                required=['data', 'title']
+            )
+        )
+    },
+    required=['beauty_title', 'title', 'user', 'coords', 'images']
+)
+
+PAGE_PARAMETERS = [
+    openapi.Parameter(
+        'cursor',
+        openapi.IN_QUERY,
+        description="Курсор следующей страницы (next_cursor из предыдущего ответа)",
+        type=openapi.TYPE_STRING
+    ),
+    openapi.Parameter(
+        'limit',
+        openapi.IN_QUERY,
+        description="Число записей на странице",
+        type=openapi.TYPE_INTEGER
+    ),
+]
+
+
+def page_params(request):
+    """Параметры keyset-пагинации из строки запроса (запрос DRF или Django)"""
+    limit = request.GET.get('limit')
+    return request.GET.get('cursor'), int(limit) if limit else None
+
+
+def float_params(request, *names):
+    """Обязательные числовые параметры строки запроса"""
+    return [float(request.query_params[name]) for name in names]
+
+
+def versions_etag(versions, *extra):
+    """ETag по парам (id, updated_at) записей ответа"""
+    raw = '|'.join(f'{pereval_id}:{updated_at.isoformat()}' for pereval_id, updated_at in versions)
+    raw += '|' + '|'.join(str(value) for value in extra)
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+def is_conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def not_modified(request, etag, last_modified):
+    """Ответ 304, если у клиента актуальная версия, иначе None"""
+    return get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+
+
+def with_validators(response, etag, last_modified):
+    """Заголовки для последующих условных запросов клиента"""
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def request_too_large(request):
+    """Тело запроса больше лимита: отказ по Content-Length до разбора JSON"""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > settings.PEREVAL_MAX_REQUEST_SIZE:
+        return Response(
+            {
+                'status': status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                'message': f'Размер запроса больше допустимого ({settings.PEREVAL_MAX_REQUEST_SIZE} байт)',
+                'id': None
+            },
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    return None
+
+
+def multipart_metadata(request, expected=dict):
+    """Данные из части metadata multipart-запроса (JSON-строка): объект перевала или список для пакета"""
+    metadata = request.data.get('metadata')
+    if metadata is None:
+        raise ValueError('Отсутствует часть metadata с данными перевала')
+    if hasattr(metadata, 'read'):
+        metadata = metadata.read()
+    try:
+        data = json.loads(metadata)
+    except ValueError:
+        raise ValueError('Часть metadata должна содержать JSON')
+    if not isinstance(data, expected):
+        raise ValueError('Часть metadata должна содержать ' + ('JSON-массив' if expected is list else 'JSON-объект'))
+    return data
+
+
+def negotiate_result(request, result):
+    """Адреса изображений в лучшем формате, который принимает клиент (Accept)"""
+    if result.get('status') == 200:
+        accepted = accepted_formats(request.headers.get('Accept'))
+        if 'perevals' in result:
+            result = {**result, 'perevals': negotiate_perevals(result['perevals'], accepted)}
+        elif 'images' in result:
+            result = {**result, 'images': [negotiate_image(image, accepted) for image in result['images']]}
+    return result
+
+
+def negotiated_response(request, result):
+    response = Response(negotiate_result(request, result), status=result['status'])
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def bad_request(message):
+    return Response(
+        {'status': status.HTTP_400_BAD_REQUEST, 'message': message},
+        status=status.HTTP_400_BAD_REQUEST
+    )
 
 
 class SubmitDataListAPI(APIView):
@@ -14,65 +182,31 @@ class SubmitDataListAPI(APIView):
 
     @swagger_auto_schema(
         operation_id="submitData_create",
-        operation_description="Создание новой записи о перевале",
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'beauty_title': openapi.Schema(type=openapi.TYPE_STRING),
-                'title': openapi.Schema(type=openapi.TYPE_STRING),
-                'other_titles': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                'connect': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                'user': openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'email': openapi.Schema(type=openapi.TYPE_STRING, format='email'),
-                        'fam': openapi.Schema(type=openapi.TYPE_STRING),
-                        'name': openapi.Schema(type=openapi.TYPE_STRING),
-                        'otc': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'phone': openapi.Schema(type=openapi.TYPE_STRING),
-                    },
-                    required=['email', 'fam', 'name', 'phone']
-                ),
-                'coords': openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'latitude': openapi.Schema(type=openapi.TYPE_NUMBER, format='float'),
-                        'longitude': openapi.Schema(type=openapi.TYPE_NUMBER, format='float'),
-                        'height': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    },
-                    required=['latitude', 'longitude', 'height']
-                ),
-                'level': openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'winter': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'summer': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'autumn': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'spring': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                    }
-                ),
-                'images': openapi.Schema(
-                    type=openapi.TYPE_ARRAY,
-                    items=openapi.Schema(
-                        type=openapi.TYPE_OBJECT,
-                        properties={
-                            'data': openapi.Schema(type=openapi.TYPE_STRING, format='binary'),
-                            'title': openapi.Schema(type=openapi.TYPE_STRING),
-                        },
-                        required=['data', 'title']
-                    )
-                )
-            },
-            required=['beauty_title', 'title', 'user', 'coords', 'images']
+        operation_description=(
+            "Создание новой записи о перевале. Изображения передаются в base64 (JSON) "
+            "или файлами multipart/form-data: данные перевала в части metadata (JSON), "
+            "в images вместо data указывается имя файловой части в поле file"
         ),
+        request_body=PEREVAL_CREATE_SCHEMA,
         responses={
             201: openapi.Response('Created'),
             400: openapi.Response('Bad Request'),
+            413: openapi.Response('Request Entity Too Large'),
             500: openapi.Response('Server Error')
         }
     )
     def post(self, request):
-        result = self.manager.submit_pereval(request.data)
+        too_large = request_too_large(request)
+        if too_large:
+            return too_large
+        if request.content_type.startswith('multipart/form-data'):
+            try:
+                data = multipart_metadata(request)
+            except ValueError as e:
+                return Response({'status': 400, 'message': str(e), 'id': None}, status=status.HTTP_400_BAD_REQUEST)
+            result = self.manager.submit_pereval(data, files=request.FILES)
+        else:
+            result = self.manager.submit_pereval(request.data)
         return Response(result, status=result['status'])
 
     @swagger_auto_schema(
@@ -85,23 +219,105 @@ class SubmitDataListAPI(APIView):
                 description="Email пользователя",
                 type=openapi.TYPE_STRING,
                 required=True
-            )
+            ),
+            *PAGE_PARAMETERS
         ],
         responses={
             200: openapi.Response('OK'),
+            304: openapi.Response('Not Modified'),
             400: openapi.Response('Bad Request'),
             500: openapi.Response('Server Error')
         }
     )
     def get(self, request):
         email = request.query_params.get('user__email')
-        if email:
-            result = self.manager.get_perevals_by_email(email)
-            return Response(result, status=result['status'])
-        return Response(
-            {'status': status.HTTP_400_BAD_REQUEST, 'message': 'Email не указан'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        if not email:
+            return bad_request('Email не указан')
+        try:
+            cursor, limit = page_params(request)
+        except ValueError:
+            return bad_request('Параметр limit должен быть числом')
+
+        if is_conditional(request):
+            try:
+                versions, next_cursor = self.manager.get_perevals_by_email_versions(email, cursor, limit)
+            except ValidationError:
+                versions = None
+            if versions:
+                etag = versions_etag(versions, next_cursor, *accepted_formats(request.headers.get('Accept')))
+                response = not_modified(request, etag, max(updated_at for _, updated_at in versions))
+                if response is not None:
+                    return response
+
+        result = self.manager.get_perevals_by_email(email, cursor, limit)
+        response = negotiated_response(request, result)
+        if result['status'] == 200 and result['perevals']:
+            versions = [(pereval['id'], pereval['updated_at']) for pereval in result['perevals']]
+            etag = versions_etag(versions, result['next_cursor'], *accepted_formats(request.headers.get('Accept')))
+            with_validators(response, etag, max(updated_at for _, updated_at in versions))
+        return response
+
+
+class SubmitDataAllAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="submitData_listAll",
+        operation_description="Постраничный список всех перевалов (для модераторов и карты)",
+        manual_parameters=[
+            openapi.Parameter(
+                'status',
+                openapi.IN_QUERY,
+                description="Статус перевала",
+                type=openapi.TYPE_STRING,
+                enum=PerevalAdded.StatusChoices.values
+            ),
+            *PAGE_PARAMETERS
+        ],
+        responses={
+            200: openapi.Response('OK'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def get(self, request):
+        try:
+            cursor, limit = page_params(request)
+        except ValueError:
+            return bad_request('Параметр limit должен быть числом')
+        result = self.manager.get_perevals(request.query_params.get('status'), cursor, limit)
+        return negotiated_response(request, result)
+
+
+class SubmitDataBatchAPI(APIView):
+    parser_classes = [JSONParser, MultiPartParser]
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="submitData_batch",
+        operation_description=(
+            "Пакетное добавление перевалов (результат возвращается для каждой записи). Изображения - "
+            "как при создании одного перевала: base64, id загрузки частями или файлом multipart/form-data "
+            "(список перевалов в части metadata)"
+        ),
+        request_body=openapi.Schema(type=openapi.TYPE_ARRAY, items=PEREVAL_CREATE_SCHEMA),
+        responses={
+            200: openapi.Response('OK'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def post(self, request):
+        too_large = request_too_large(request)
+        if too_large:
+            return too_large
+        if request.content_type.startswith('multipart/form-data'):
+            try:
+                items = multipart_metadata(request, expected=list)
+            except ValueError as e:
+                return Response({'status': 400, 'message': str(e), 'results': []}, status=status.HTTP_400_BAD_REQUEST)
+            result = self.manager.submit_many(items, files=request.FILES)
+        else:
+            result = self.manager.submit_many(request.data)
+        return Response(result, status=result['status'])
 
 
 class SubmitDataDetailAPI(APIView):
@@ -110,16 +326,29 @@ class SubmitDataDetailAPI(APIView):
 
     @swagger_auto_schema(
         operation_id="submitData_retrieve",
-        operation_description="Получение данных перевала по ID",
+        operation_description="Получение данных перевала по ID (поддерживает If-None-Match/If-Modified-Since)",
         responses={
             200: openapi.Response('OK'),
+            304: openapi.Response('Not Modified'),
             404: openapi.Response('Not Found'),
             500: openapi.Response('Server Error')
         }
     )
     def get(self, request, pk):
+        if is_conditional(request):
+            updated_at = self.manager.get_pereval_updated_at(pk)
+            if updated_at is not None:
+                etag = versions_etag([(pk, updated_at)], *accepted_formats(request.headers.get('Accept')))
+                response = not_modified(request, etag, updated_at)
+                if response is not None:
+                    return response
+
         result = self.manager.get_pereval_by_id(pk)
-        return Response(result, status=result['status'])
+        response = negotiated_response(request, result)
+        if result['status'] == 200:
+            etag = versions_etag([(pk, result['updated_at'])], *accepted_formats(request.headers.get('Accept')))
+            with_validators(response, etag, result['updated_at'])
+        return response
 
     @swagger_auto_schema(
         operation_id="submitData_update",
@@ -179,3 +408,223 @@ class SubmitDataDetailAPI(APIView):
         result = manager.update_pereval(pk, request.data)
         status_code = 200 if result.get('state', 0) == 1 else 400
         return Response(result, status=status_code)
+
+
+class SearchBBoxAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="search_bbox",
+        operation_description="Перевалы в видимой области карты",
+        manual_parameters=[
+            openapi.Parameter(name, openapi.IN_QUERY, type=openapi.TYPE_NUMBER, required=True)
+            for name in ('min_lat', 'min_lon', 'max_lat', 'max_lon')
+        ] + [
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER)
+        ],
+        responses={
+            200: openapi.Response('OK'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def get(self, request):
+        try:
+            bbox = float_params(request, 'min_lat', 'min_lon', 'max_lat', 'max_lon')
+            _, limit = page_params(request)
+        except (KeyError, ValueError):
+            return bad_request('Укажите min_lat, min_lon, max_lat, max_lon числами')
+        result = self.manager.search_bbox(*bbox, limit=limit)
+        return Response(result, status=result['status'])
+
+
+class SearchNearestAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="search_nearest",
+        operation_description="Ближайшие к точке перевалы",
+        manual_parameters=[
+            openapi.Parameter('lat', openapi.IN_QUERY, type=openapi.TYPE_NUMBER, required=True),
+            openapi.Parameter('lon', openapi.IN_QUERY, type=openapi.TYPE_NUMBER, required=True),
+            openapi.Parameter('k', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: openapi.Response('OK'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def get(self, request):
+        try:
+            latitude, longitude = float_params(request, 'lat', 'lon')
+            k = int(request.query_params.get('k', 10))
+        except (KeyError, ValueError):
+            return bad_request('Укажите lat и lon числами')
+        result = self.manager.search_nearest(latitude, longitude, k)
+        return Response(result, status=result['status'])
+
+
+class TileAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="tiles_retrieve",
+        operation_description="Кластеры перевалов в тайле карты {z}/{x}/{y} (Web Mercator)",
+        responses={
+            200: openapi.Response('OK'),
+            304: openapi.Response('Not Modified'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def get(self, request, z, x, y):
+        # ETag - по версии тайла, прочитанной до кластеров: условный запрос кластеры
+        # не читает, а изменение между чтениями лишь даст клиенту устаревший ETag
+        version = self.manager.get_tile_version(z, x, y)
+        if version['status'] != 200:
+            return Response(version, status=version['status'])
+        etag = f'"{hashlib.md5(version["version"].encode()).hexdigest()}"'
+        # If-None-Match разбирается по RFC 9110: список ETag, слабые W/"..." и *
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(self.manager.get_tile(z, x, y))
+        response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.PEREVAL_TILE_CACHE_SECONDS}'
+        return response
+
+
+class CacheStatsAPI(APIView):
+
+    @swagger_auto_schema(
+        operation_id="cache_stats",
+        operation_description="Счетчики попаданий и промахов кэша карточек перевалов (для текущего процесса)",
+        responses={200: openapi.Response('OK')}
+    )
+    def get(self, request):
+        return Response(pereval_cache.stats())
+
+
+class SyncAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="sync",
+        operation_description="Дельта-синхронизация: перевалы пользователя, созданные, измененные "
+                              "или удаленные после токена since",
+        manual_parameters=[
+            openapi.Parameter(
+                'user__email',
+                openapi.IN_QUERY,
+                description="Email пользователя",
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'since',
+                openapi.IN_QUERY,
+                description="Токен next_token из предыдущей синхронизации (пусто - полная синхронизация)",
+                type=openapi.TYPE_STRING
+            ),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: openapi.Response('OK'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def get(self, request):
+        email = request.query_params.get('user__email')
+        if not email:
+            return bad_request('Email не указан')
+        try:
+            _, limit = page_params(request)
+        except ValueError:
+            return bad_request('Параметр limit должен быть числом')
+        result = self.manager.sync(email, request.query_params.get('since'), limit)
+        return negotiated_response(request, result)
+
+
+def with_upload_offset(result):
+    """Ответ по загрузке с текущей позицией в заголовке Upload-Offset"""
+    response = Response(result, status=result['status'])
+    if result.get('offset') is not None:
+        response['Upload-Offset'] = result['offset']
+    return response
+
+
+class UploadListAPI(APIView):
+    parser_classes = [JSONParser]
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="uploads_create",
+        operation_description="Создание сессии возобновляемой загрузки изображения",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'title': openapi.Schema(type=openapi.TYPE_STRING),
+                'filename': openapi.Schema(type=openapi.TYPE_STRING),
+                'size': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'content_type': openapi.Schema(type=openapi.TYPE_STRING),
+            },
+            required=['title', 'filename', 'size']
+        ),
+        responses={
+            201: openapi.Response('Created'),
+            400: openapi.Response('Bad Request'),
+        }
+    )
+    def post(self, request):
+        return with_upload_offset(self.manager.create_upload(request.data))
+
+
+class UploadDetailAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="uploads_retrieve",
+        operation_description="Состояние загрузки: позиция, с которой нужно продолжить",
+        responses={
+            200: openapi.Response('OK'),
+            404: openapi.Response('Not Found'),
+        }
+    )
+    def get(self, request, pk):
+        return with_upload_offset(self.manager.get_upload(pk))
+
+    @swagger_auto_schema(
+        operation_id="uploads_append",
+        operation_description="Запись части файла: тело запроса - байты части, "
+                              "заголовок Upload-Offset - позиция части в файле",
+        manual_parameters=[
+            openapi.Parameter('Upload-Offset', openapi.IN_HEADER, type=openapi.TYPE_INTEGER, required=True),
+        ],
+        responses={
+            200: openapi.Response('OK'),
+            400: openapi.Response('Bad Request'),
+            404: openapi.Response('Not Found'),
+            409: openapi.Response('Conflict'),
+        }
+    )
+    def put(self, request, pk):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return bad_request('Нужны заголовки Upload-Offset и Content-Length')
+        # Тело не разбирается парсерами DRF, а пишется в файл прямо из потока
+        return with_upload_offset(self.manager.append_upload(pk, offset, length, request.stream))
+
+
+class UploadFinalizeAPI(APIView):
+    manager = PerevalManager()
+
+    @swagger_auto_schema(
+        operation_id="uploads_finalize",
+        operation_description="Завершение загрузки: возвращает image_id для поля images в submitData",
+        responses={
+            200: openapi.Response('OK'),
+            404: openapi.Response('Not Found'),
+            409: openapi.Response('Conflict'),
+        }
+    )
+    def post(self, request, pk):
+        return with_upload_offset(self.manager.finalize_upload(pk))
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -36,6 +37,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pereval.metrics.RequestMetricsMiddleware',
+    'pereval.profiling.RequestProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,8 +51,9 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'transit_point.urls'
 
 REST_FRAMEWORK = {
+    # orjson, без установленного orjson - стандартный JSONRenderer
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'pereval.renderers.FastJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -137,4 +141,131 @@ SWAGGER_SETTINGS = {
     'USE_SESSION_AUTH': False,
 }
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Максимальное число перевалов в одном пакетном запросе
+PEREVAL_BATCH_MAX_SIZE = int(os.getenv('PEREVAL_BATCH_MAX_SIZE', 100))
+
+# Размер страницы списков перевалов (keyset-пагинация)
+PEREVAL_PAGE_SIZE = int(os.getenv('PEREVAL_PAGE_SIZE', 50))
+PEREVAL_PAGE_SIZE_MAX = int(os.getenv('PEREVAL_PAGE_SIZE_MAX', 500))
+
+# Ограничения геопоиска: число перевалов в области карты и максимальное k
+PEREVAL_SEARCH_LIMIT = int(os.getenv('PEREVAL_SEARCH_LIMIT', 1000))
+PEREVAL_SEARCH_K_MAX = int(os.getenv('PEREVAL_SEARCH_K_MAX', 100))
+# Поиск ближайших: радиус, дальше которого перевалы не ищутся, и число
+# кандидатов, читаемых из БД на каждом шаге расширения окрестности
+PEREVAL_SEARCH_NEAREST_MAX_KM = float(os.getenv('PEREVAL_SEARCH_NEAREST_MAX_KM', 500))
+PEREVAL_SEARCH_NEAREST_CANDIDATES = int(os.getenv('PEREVAL_SEARCH_NEAREST_CANDIDATES', 500))
+
+# Кластеры карты предрасчитываются до PEREVAL_TILE_MAX_ZOOM, на более крупных
+# масштабах (до PEREVAL_TILE_MAX_REQUEST_ZOOM) тайл отдает отдельные перевалы
+PEREVAL_TILE_MAX_ZOOM = int(os.getenv('PEREVAL_TILE_MAX_ZOOM', 14))
+# Кластеры масштабов ниже PEREVAL_TILE_MIN_ZOOM не хранятся, а суммируются при
+# чтении из ячеек PEREVAL_TILE_MIN_ZOOM: запись перевала не обновляет общие строки
+PEREVAL_TILE_MIN_ZOOM = int(os.getenv('PEREVAL_TILE_MIN_ZOOM', 5))
+PEREVAL_TILE_MAX_REQUEST_ZOOM = 22
+PEREVAL_TILE_CACHE_SECONDS = int(os.getenv('PEREVAL_TILE_CACHE_SECONDS', 60))
+
+# Кэш карточек перевалов: локальный LRU в памяти процесса или Redis,
+# если задан FSTR_REDIS_URL (нужен пакет redis)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pereval': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pereval',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('PEREVAL_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+if os.getenv('FSTR_REDIS_URL'):
+    CACHES['pereval'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('FSTR_REDIS_URL'),
+    }
+PEREVAL_CACHE_ALIAS = 'pereval'
+PEREVAL_CACHE_TIMEOUT = int(os.getenv('PEREVAL_CACHE_TIMEOUT', 3600))
+# Меняется при изменении формата карточки, чтобы не читать старые записи
+PEREVAL_CACHE_VERSION = 5
+
+# Ограничения размера изображений (байты после декодирования) и тела запроса
+PEREVAL_MAX_IMAGE_SIZE = int(os.getenv('PEREVAL_MAX_IMAGE_SIZE', 10 * 1024 * 1024))
+PEREVAL_MAX_REQUEST_IMAGES_SIZE = int(os.getenv('PEREVAL_MAX_REQUEST_IMAGES_SIZE', 50 * 1024 * 1024))
+PEREVAL_MAX_REQUEST_SIZE = int(os.getenv('PEREVAL_MAX_REQUEST_SIZE', 70 * 1024 * 1024))
+
+# Файлы multipart сразу пишутся во временный файл и переносятся в MEDIA_ROOT без чтения в память
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+
+# Возобновляемые загрузки: каталог недокачанных файлов (на том же диске, что MEDIA_ROOT,
+# чтобы готовый файл переносился без копирования) и срок жизни брошенных сессий в часах
+PEREVAL_UPLOAD_DIR = os.getenv('PEREVAL_UPLOAD_DIR', os.path.join(MEDIA_ROOT, 'upload_sessions'))
+PEREVAL_UPLOAD_SESSION_TTL = int(os.getenv('PEREVAL_UPLOAD_SESSION_TTL', 48))
+
+# Фоновая обработка изображений: очередь задач в БД, воркер - manage.py run_jobs.
+# PEREVAL_JOBS_EAGER=1 выполняет задачи в процессе веб-сервера (разработка без воркера)
+PEREVAL_JOBS_EAGER = os.getenv('PEREVAL_JOBS_EAGER', '0') == '1'
+PEREVAL_JOBS_MAX_ATTEMPTS = int(os.getenv('PEREVAL_JOBS_MAX_ATTEMPTS', 5))
+PEREVAL_JOBS_RETRY_DELAY = int(os.getenv('PEREVAL_JOBS_RETRY_DELAY', 10))
+PEREVAL_JOBS_STALE_TIMEOUT = int(os.getenv('PEREVAL_JOBS_STALE_TIMEOUT', 600))
+
+# Уменьшенные копии изображений: размер -> наибольшая сторона в пикселях
+PEREVAL_IMAGE_SIZES = {'thumb': 200, 'medium': 800, 'large': 1600}
+
+# Пересжатие в современные форматы: копии каждого размера создаются в WebP (и AVIF, если его
+# поддерживает Pillow) плюс JPEG/PNG для старых клиентов. Без PEREVAL_IMAGE_KEEP_ORIGINAL=1
+# исходный файл заменяется полноразмерной копией в WebP без метаданных, с ним - хранится
+# без изменений (вместе с EXIF), создаются только копии
+PEREVAL_IMAGE_FORMATS = ['avif', 'webp']
+PEREVAL_IMAGE_QUALITY = {
+    'jpeg': int(os.getenv('PEREVAL_IMAGE_JPEG_QUALITY', 85)),
+    'webp': int(os.getenv('PEREVAL_IMAGE_WEBP_QUALITY', 80)),
+    'avif': int(os.getenv('PEREVAL_IMAGE_AVIF_QUALITY', 60)),
+}
+PEREVAL_IMAGE_KEEP_ORIGINAL = os.getenv('PEREVAL_IMAGE_KEEP_ORIGINAL', '0') == '1'
+
+# Хранилище изображений (pereval.storage.image_storage): по умолчанию файловое с раскладкой
+# по подкаталогам. Для S3-совместимого хранилища (например, MinIO) задайте
+# PEREVAL_STORAGE_BACKEND=storages.backends.s3.S3Storage (пакет django-storages[s3]) и параметры
+# в PEREVAL_STORAGE_OPTIONS в виде JSON: {"bucket_name": ..., "endpoint_url": ..., ...}
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'pereval': {
+        'BACKEND': os.getenv('PEREVAL_STORAGE_BACKEND', 'pereval.storage.ShardedFileSystemStorage'),
+        'OPTIONS': json.loads(os.getenv('PEREVAL_STORAGE_OPTIONS', '{}')),
+    },
+}
+
+# Отдача MEDIA_URL (pereval.media.serve_media): '' - только при DEBUG, как раньше;
+# 'django' - из Python с ETag, Range и кэшированием; 'x-accel-redirect' (nginx) или
+# 'x-sendfile' (Apache, lighttpd) - байты файла отдает фронтовой сервер.
+# Файлы с хешем содержимого в имени кэшируются навсегда, остальные - на PEREVAL_MEDIA_MAX_AGE секунд
+PEREVAL_MEDIA_MODE = os.getenv('PEREVAL_MEDIA_MODE', '')
+PEREVAL_MEDIA_ACCEL_PREFIX = os.getenv('PEREVAL_MEDIA_ACCEL_PREFIX', '/protected-media/')
+PEREVAL_MEDIA_MAX_AGE = int(os.getenv('PEREVAL_MEDIA_MAX_AGE', 3600))
+
+# Async-представления чтения (pereval.async_views) для запуска под ASGI (uvicorn):
+# GET карточки перевала и списка по email на async ORM. Под WSGI оставьте 0
+PEREVAL_ASYNC_VIEWS = os.getenv('PEREVAL_ASYNC_VIEWS', '0') == '1'
+
+# Метрики запросов (pereval.metrics): гистограммы задержки, SQL и сериализации по маршрутам
+# на /metrics в формате Prometheus. PEREVAL_SERVER_TIMING=1 добавляет заголовок Server-Timing
+# (раскрывает время SQL клиентам - включайте для отладки или за доверенным прокси).
+# /metrics отвечает только адресам из PEREVAL_METRICS_ALLOWED_IPS (через запятую) или
+# с заголовком Authorization: Bearer <PEREVAL_METRICS_TOKEN>, остальным - 403
+PEREVAL_METRICS = os.getenv('PEREVAL_METRICS', '0') == '1'
+PEREVAL_METRICS_TOKEN = os.getenv('PEREVAL_METRICS_TOKEN', '')
+PEREVAL_METRICS_ALLOWED_IPS = [
+    ip.strip() for ip in os.getenv('PEREVAL_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()
+]
+PEREVAL_SERVER_TIMING = os.getenv('PEREVAL_SERVER_TIMING', '0') == '1'
+
+# Профилирование запросов (pereval.profiling): cProfile выбранных запросов, файлы .prof в каталоге
+# PEREVAL_PROFILE_DIR. Пустой каталог - профилировщик выключен и не стоит ничего. Запросы выбираются
+# долей PEREVAL_PROFILE_RATE (0..1, пишутся не быстрее PEREVAL_PROFILE_MIN_MS) или заголовком
+# X-Pereval-Profile с токеном manage.py profile_token (действует PEREVAL_PROFILE_TOKEN_TTL секунд)
+PEREVAL_PROFILE_DIR = os.getenv('PEREVAL_PROFILE_DIR', '')
+PEREVAL_PROFILE_RATE = float(os.getenv('PEREVAL_PROFILE_RATE', 0))
+PEREVAL_PROFILE_MIN_MS = int(os.getenv('PEREVAL_PROFILE_MIN_MS', 0))
+PEREVAL_PROFILE_TOKEN_TTL = int(os.getenv('PEREVAL_PROFILE_TOKEN_TTL', 3600))